@@ -20,6 +20,8 @@ from core.model import SessionManager
 from core.opds import VerboseAnnotator
 from core.util.problem_detail import ProblemDetail
 
+from http_pool import configure_from_database
+
 from controller import (
     authenticated_client_from_request,
     CatalogController,
@@ -44,6 +46,7 @@ def initialize_database(autoinitialize=True):
     app._db = _db
 
     Configuration.load(_db)
+    configure_from_database(_db)
     testing = 'TESTING' in os.environ
     log_level = LogConfiguration.initialize(_db, testing=testing)
     if app.debug is None:
@@ -106,6 +109,11 @@ def heartbeat():
 def canonical_author_name():
     return CanonicalizationController(app._db).canonicalize_author_name()
 
+@app.route('/canonical-author-names', methods=['POST'])
+@returns_problem_detail
+def canonical_author_names():
+    return CanonicalizationController(app._db).canonicalize_author_names()
+
 @app.route('/lookup')
 @app.route('/<collection_metadata_identifier>/lookup')
 @accepts_auth
@@ -0,0 +1,152 @@
+"""Small in-process caches for data that's expensive to recompute."""
+from collections import OrderedDict
+from threading import RLock
+import time
+
+from nose.tools import set_trace
+
+
+class LRUCache(object):
+    """A thread-safe dictionary that holds no more than `max_size` items,
+    discarding the least recently used item when it gets full.
+
+    Items may also be given a lifetime in seconds, after which they
+    are treated as missing.
+    """
+
+    def __init__(self, max_size, ttl=None):
+        """Constructor.
+
+        :param max_size: Hold no more than this many items.
+        :param ttl: By default, items expire after this many
+            seconds. If this is None, items never expire.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = RLock()
+
+    def __len__(self):
+        with self._lock:
+            self._discard_expired()
+            return len(self._items)
+
+    def _discard_expired(self):
+        now = time.time()
+        for key, (value, expires) in self._items.items():
+            if expires is not None and expires <= now:
+                del self._items[key]
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            value, expires = self._items.pop(key)
+            if expires is not None and expires <= time.time():
+                return default
+
+            # This is now the most recently used item.
+            self._items[key] = (value, expires)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store an item.
+
+        :param ttl: The item expires after this many seconds. By
+            default, the cache's own `ttl` is used.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        expires = None
+        if ttl is not None:
+            expires = time.time() + ttl
+
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (value, expires)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def delete_matching(self, predicate):
+        """Delete every item for which predicate(key, value) is true."""
+        with self._lock:
+            for key, (value, expires) in self._items.items():
+                if predicate(key, value):
+                    del self._items[key]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class AnnotatedEntryCache(object):
+    """Holds serialized OPDS entries for the collection updates feed,
+    already annotated with LicensePool- and Identifier-specific
+    information.
+
+    Entries for a Work are discarded when the Work's
+    last_update_time or its own cached OPDS entry changes, or when
+    the Work is explicitly invalidated because its OPDS entries were
+    regenerated in this process. Since annotations can also depend
+    on data that changes without touching the Work, nothing is kept
+    for longer than `ttl` seconds.
+    """
+
+    # By default, an annotated entry is kept for ten minutes.
+    DEFAULT_TTL = 60 * 10
+
+    def __init__(self, max_works=5000, ttl=DEFAULT_TTL):
+        self.works = LRUCache(max_works, ttl=ttl)
+
+    @classmethod
+    def _version(cls, work):
+        """Identify the version of a Work that annotated entries were
+        made from.
+        """
+        entry = work.verbose_opds_entry or work.simple_opds_entry
+        return (work.last_update_time, hash(entry))
+
+    @classmethod
+    def _entry_key(cls, licensepool, identifier):
+        licensepool_id = None
+        if licensepool:
+            licensepool_id = licensepool.id
+        return (licensepool_id, identifier.id)
+
+    def get(self, work, licensepool, identifier):
+        """Find a cached entry.
+
+        :return: A serialized OPDS entry, or None.
+        """
+        cached = self.works.get(work.id)
+        if not cached:
+            return None
+        version, entries = cached
+        if version != self._version(work):
+            return None
+        return entries.get(self._entry_key(licensepool, identifier))
+
+    def set(self, work, licensepool, identifier, entry):
+        """Cache a serialized OPDS entry."""
+        version = self._version(work)
+        cached = self.works.get(work.id)
+        if not cached or cached[0] != version:
+            cached = (version, {})
+            self.works.set(work.id, cached)
+        cached[1][self._entry_key(licensepool, identifier)] = entry
+
+    def invalidate(self, work):
+        """Forget every cached entry for a Work."""
+        self.works.delete(work.id)
+
+
+# Entries for the collection updates feed. This is shared by the web
+# application and WorkPresentationCoverageProvider.
+annotated_entries = AnnotatedEntryCache()
@@ -1,15 +1,31 @@
 """Use external services to canonicalize names."""
+import copy
+import datetime
 import logging
 import os
 import re
 
 from nose.tools import set_trace
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    Unicode,
+    UniqueConstraint,
+    literal,
+)
+from cache import LRUCache
 from oclc.linked_data import OCLCLinkedData
 from viaf import VIAFClient, MockVIAFClient
 
 from core.model import (
+    Base,
+    Contribution,
     Contributor,
+    Edition,
     Identifier,
+    get_one,
+    get_one_or_create,
 )
 
 from core.util.personal_names import (
@@ -19,6 +35,7 @@ from core.util.personal_names import (
     name_tidy, 
 )
 from core.util.titles import (
+    normalize_title_for_matching,
     title_match_ratio, 
 )
 
@@ -43,6 +60,24 @@ class AuthorNameCanonicalizer(object):
         self.viaf = viaf or VIAFClient(_db)
         self.log = logging.getLogger("Author name canonicalizer")
 
+    def in_session(self, _db):
+        """Make a copy of this AuthorNameCanonicalizer that does all its
+        database work through `_db`, so it can be used in another
+        thread.
+
+        The copy uses the same OCLC Linked Data and VIAF clients,
+        also switched over to `_db`.
+        """
+        canonicalizer = copy.copy(self)
+        canonicalizer._db = _db
+        for name in ('oclcld', 'viaf'):
+            client = getattr(self, name, None)
+            if client is not None:
+                client = copy.copy(client)
+                client._db = _db
+                setattr(canonicalizer, name, client)
+        return canonicalizer
+
     @classmethod
     def primary_author_name(self, author_name):
         """From an 'author' name that may contain multiple people, extract
@@ -103,6 +138,18 @@ class AuthorNameCanonicalizer(object):
                 "Neither useful identifier nor display name was provided."
             )
 
+        for n in self.candidate_names(display_name):
+            v = self._canonicalize(identifier, n)
+            if v:
+                return v
+
+        # All our techniques have failed. Woe! Let's just try to finagle
+        # this provided display name into a sort name.
+        return self.default_name(display_name)
+
+
+    def candidate_names(self, display_name):
+        """Which names should we try to canonicalize, in order?"""
         # From an author name that potentially names multiple people,
         # extract only the first name.
         shortened_name = self.primary_author_name(display_name)
@@ -112,16 +159,57 @@ class AuthorNameCanonicalizer(object):
         candidates = [shortened_name]
         if display_name != shortened_name:
             candidates.append(display_name)
+        return candidates
 
-        for n in candidates:
-            v = self._canonicalize(identifier, n)
-            if v:
-                return v
+    def sort_names_from_database(self, questions):
+        """Answer as many questions as possible using only the
+        Contributors already in the database, with at most two
+        queries.
 
-        # All our techniques have failed. Woe! Let's just try to finagle
-        # this provided display name into a sort name.
-        return self.default_name(display_name)
+        A question is answered here only if canonicalize_author_name()
+        would have answered it from the database without going to
+        OCLC or VIAF.
 
+        :param questions: A list of (Identifier, display name) 2-tuples.
+        :return: A dictionary mapping questions to sort names.
+        """
+        first_candidates = dict()
+        known_titles = dict()
+        for question in questions:
+            identifier, display_name = question
+            if not display_name:
+                continue
+            name = self.candidate_names(display_name)[0]
+            if name:
+                first_candidates[question] = name
+                known_titles[question] = self.known_titles(identifier)
+
+        # Titles only need to be looked up for names that came with
+        # known titles of their own.
+        with_titles = set()
+        without_titles = set()
+        for question, name in first_candidates.items():
+            if ' ' not in name:
+                continue
+            if known_titles[question]:
+                with_titles.add(name)
+            else:
+                without_titles.add(name)
+        candidates = self.sort_name_candidates(
+            without_titles - with_titles, with_titles=False
+        )
+        candidates.update(self.sort_name_candidates(with_titles))
+
+        answers = dict()
+        for question, name in first_candidates.items():
+            if not ' ' in name:
+                # A one-named entity; see _canonicalize().
+                answers[question] = name
+            elif name in candidates:
+                answers[question] = self.sort_name_from_candidates(
+                    candidates[name], known_titles[question]
+                )
+        return answers
 
     def default_name(self, display_name):
         shortened_name = self.primary_author_name(display_name)
@@ -139,39 +227,16 @@ class AuthorNameCanonicalizer(object):
         self.log.debug("Attempting to canonicalize %s", display_name)
 
         # can we infer any titles we know this person wrote?
-        known_titles = []
-        if identifier:
-            editions = identifier.primarily_identifies
-            # only choose one version of the title
-            if editions and editions[0].title:
-                known_titles.append(editions[0].title)
+        known_titles = self.known_titles(identifier)
 
-        contributors = self._db.query(Contributor).filter(
-            Contributor.display_name==display_name).filter(
-                Contributor.sort_name != None).all()
+        candidates = self.sort_name_candidates(
+            [display_name], with_titles=bool(known_titles)
+        ).get(display_name)
         sort_name = None
-        if contributors:
-            # Yes, awesome. Let's gild this lily -- are there any contributors
-            # who have sort_names and also have written titles similar to the 
-            # identifier's?  If not, no worries, choose any sort_name, and it's 
-            # probably good.
-            for contributor in contributors:
-                # did we just find the sort_name in a previous iteration?
-                if sort_name:
-                    break
-
-                for contribution in contributor.contributions:
-                    if (contribution.edition and contribution.edition.title and 
-                        known_titles and 
-                        (title_match_ratio(known_titles[0], contribution.edition.title) > 80)):
-                        # whew! 
-                        sort_name = contributor.sort_name
-                        break
-
-            else:
-                # we have contributors, but none of their titles matched what we know
-                sort_name = contributors[0].sort_name
-
+        if candidates:
+            sort_name = self.sort_name_from_candidates(
+                candidates, known_titles
+            )
             self.log.debug(
                 "Found existing contributor for %s: %s",
                 display_name, sort_name
@@ -209,6 +274,93 @@ class AuthorNameCanonicalizer(object):
         return sort_name
 
 
+    def known_titles(self, identifier):
+        """Find titles we know were written by the author of the book
+        with the given Identifier.
+        """
+        known_titles = []
+        if identifier:
+            editions = identifier.primarily_identifies
+            # only choose one version of the title
+            if editions and editions[0].title:
+                known_titles.append(editions[0].title)
+        return known_titles
+
+    def sort_name_candidates(self, display_names, with_titles=True):
+        """Find the sort names of existing Contributors, along with the
+        titles they worked on, for any number of display names.
+
+        This is a single query against the index on
+        contributors.display_name, and it doesn't load any
+        Contributors, Contributions, or Editions into the session.
+
+        :param with_titles: If this is False, don't bother finding
+            the titles; every set of titles will be empty.
+        :return: A dictionary mapping each display name to a list of
+            (sort name, set of normalized titles) 2-tuples, one per
+            Contributor.
+        """
+        by_display_name = dict()
+        display_names = set(display_names)
+        if not display_names:
+            return by_display_name
+
+        if with_titles:
+            qu = self._db.query(
+                Contributor.display_name, Contributor.id,
+                Contributor.sort_name, Edition.title
+            ).outerjoin(Contributor.contributions).outerjoin(
+                Contribution.edition
+            )
+        else:
+            qu = self._db.query(
+                Contributor.display_name, Contributor.id,
+                Contributor.sort_name, literal(None)
+            )
+        qu = qu.filter(
+            Contributor.display_name.in_(display_names)
+        ).filter(
+            Contributor.sort_name != None
+        ).order_by(Contributor.id)
+
+        candidates = dict()
+        for display_name, contributor_id, sort_name, title in qu:
+            if contributor_id not in candidates:
+                candidates[contributor_id] = (sort_name, set())
+                by_display_name.setdefault(display_name, []).append(
+                    candidates[contributor_id]
+                )
+            if title:
+                candidates[contributor_id][1].add(
+                    normalize_title_for_matching(title)
+                )
+        return by_display_name
+
+    def sort_name_from_candidates(self, candidates, known_titles):
+        """Choose a sort name for a display name shared by a number of
+        Contributors.
+
+        :param candidates: A list of (sort name, set of normalized
+            titles) 2-tuples, as found by sort_name_candidates().
+        """
+        # Let's gild this lily -- are there any contributors who have
+        # sort_names and also have written titles similar to the
+        # identifier's?  If not, no worries, choose any sort_name, and
+        # it's probably good.
+        if known_titles:
+            known_title = normalize_title_for_matching(known_titles[0])
+            for sort_name, titles in candidates:
+                if known_title in titles:
+                    return sort_name
+            for sort_name, titles in candidates:
+                for title in titles:
+                    if title_match_ratio(known_title, title) > 80:
+                        # whew!
+                        return sort_name
+
+        # we have contributors, but none of their titles matched what we know
+        return candidates[0][0]
+
     def sort_name_from_oclc_linked_data(
             self, identifier, display_name):
         """Try to find an author sort name for this book from
@@ -291,6 +443,114 @@ class AuthorNameCanonicalizer(object):
 
 
 
+class CanonicalAuthorName(Base):
+    """An answer given by an AuthorNameCanonicalizer.
+
+    The question is stored in the normalized form given by
+    CanonicalizationCache.key(), with an empty string standing in for
+    a missing URN or display name.
+    """
+    __tablename__ = 'canonicalauthornames'
+    id = Column(Integer, primary_key=True)
+    urn = Column(Unicode, nullable=False)
+    display_name = Column(Unicode, nullable=False)
+
+    # None if we failed to find the author name.
+    author_name = Column(Unicode)
+
+    timestamp = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint('urn', 'display_name'),
+    )
+
+
+class CanonicalizationCache(object):
+    """Remembers the answers given by an AuthorNameCanonicalizer, so
+    that the same question can be answered again without going to
+    the database, OCLC, or VIAF.
+
+    Answers are kept in memory, and also stored as CanonicalAuthorNames
+    so they survive restarts and are shared between processes. A
+    failure to find an author name is remembered for less time than a
+    success.
+    """
+
+    MAX_AGE = datetime.timedelta(days=30)
+    NEGATIVE_MAX_AGE = datetime.timedelta(days=1)
+
+    # Shared by every CanonicalizationCache in this process.
+    recent = LRUCache(max_size=10000)
+
+    def __init__(self, _db):
+        self._db = _db
+
+    @classmethod
+    def key(cls, identifier, display_name):
+        """The question being asked, with insignificant differences
+        (such as extra whitespace) removed.
+        """
+        if display_name:
+            display_name = " ".join(display_name.split())
+        urn = None
+        if identifier:
+            urn = identifier.urn
+        return (urn or u"", display_name or u"")
+
+    @classmethod
+    def max_age(cls, author_name):
+        if author_name:
+            return cls.MAX_AGE
+        return cls.NEGATIVE_MAX_AGE
+
+    def get(self, identifier, display_name):
+        """Look for a previous answer to this question.
+
+        :return: A 2-tuple (found, author_name). `author_name` may be
+            None even if an answer was found -- that means we
+            previously failed to find the author name.
+        """
+        key = self.key(identifier, display_name)
+        missing = object()
+        author_name = self.recent.get(key, missing)
+        if author_name is not missing:
+            return True, author_name
+
+        urn, display_name = key
+        answer = get_one(
+            self._db, CanonicalAuthorName, urn=urn, display_name=display_name
+        )
+        if not answer:
+            return False, None
+        author_name = answer.author_name
+
+        remaining = (
+            answer.timestamp + self.max_age(author_name)
+            - datetime.datetime.utcnow()
+        )
+        remaining = remaining.total_seconds()
+        if remaining <= 0:
+            return False, None
+        self.recent.set(key, author_name, ttl=remaining)
+        return True, author_name
+
+    def set(self, identifier, display_name, author_name):
+        """Remember the answer to a question."""
+        key = self.key(identifier, display_name)
+        self.recent.set(
+            key, author_name, ttl=self.max_age(author_name).total_seconds()
+        )
+
+        urn, display_name = key
+        now = datetime.datetime.utcnow()
+        answer, is_new = get_one_or_create(
+            self._db, CanonicalAuthorName, urn=urn, display_name=display_name,
+            create_method_kwargs=dict(timestamp=now)
+        )
+        answer.author_name = author_name or None
+        answer.timestamp = now
+
+
 class MockAuthorNameCanonicalizer(AuthorNameCanonicalizer):
 
     """Mocks the services used by the author name canonicalizer, but
@@ -380,3 +640,9 @@ class SimpleMockAuthorNameCanonicalizer(AuthorNameCanonicalizer):
         """
         self.canonicalize_author_name_calls.append((identifier, display_name))
         return self.mapping.get((identifier, display_name), None)
+
+    def sort_names_from_database(self, questions):
+        """Pretend the database can't answer any questions, so that
+        they all go through canonicalize_author_name.
+        """
+        return {}
@@ -0,0 +1,123 @@
+"""Run independent, I/O-bound pieces of work in parallel.
+
+Most of the time the metadata wrangler spends on a request or a
+coverage run is spent waiting for some third-party API to respond.
+These helpers make it possible to wait on several of them at once
+without changing the code that does the actual work.
+"""
+from multiprocessing.pool import ThreadPool
+
+from nose.tools import set_trace
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker
+
+
+def run_concurrently(function, items, workers):
+    """Call `function` once for each item in `items`, using up to
+    `workers` threads.
+
+    If only one worker is allowed, or there's only one item, everything
+    happens in the current thread.
+
+    :return: A list of return values, in the same order as `items`. If
+        any call raised an exception, then once every call has
+        finished, the exception raised by the call for the earliest
+        such item is re-raised.
+    """
+    items = list(items)
+    if not workers or workers <= 1 or len(items) <= 1:
+        return [function(item) for item in items]
+
+    def call(item):
+        # Catch exceptions here, so that pool.map doesn't give up
+        # waiting as soon as one call fails.
+        try:
+            return function(item), None
+        except Exception, e:
+            return None, e
+
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        outcomes = pool.map(call, items)
+    finally:
+        pool.close()
+        pool.join()
+
+    for result, exception in outcomes:
+        if exception is not None:
+            raise exception
+    return [result for result, exception in outcomes]
+
+
+def independent_session_factory(_db):
+    """Find a way of creating new database sessions that talk to the same
+    database as `_db`, for use in other threads.
+
+    :return: A callable that creates a new session, or None if `_db`
+        is bound to a single Connection rather than an Engine. A
+        Connection can't be shared between threads, so in that case
+        (which mostly happens during tests) all work has to be done
+        through `_db`, in the current thread.
+    """
+    bind = _db.get_bind()
+    if not isinstance(bind, Engine):
+        return None
+    return sessionmaker(bind=bind)
+
+
+def run_in_background(function, items, workers):
+    """Start calling `function` once for each item in `items`, using up
+    to `workers` threads, and return without waiting for the calls to
+    finish.
+
+    :return: A function that waits for every call to finish and
+        returns a list of return values, in the same order as `items`.
+        If the return values turn out not to be needed, there's no
+        need to call it; the threads will go away on their own once
+        the work is done.
+    """
+    items = list(items)
+    if not items:
+        return lambda: []
+
+    pool = ThreadPool(max(1, min(workers, len(items))))
+    result = pool.map_async(function, items)
+    pool.close()
+    def wait():
+        try:
+            return result.get()
+        finally:
+            pool.join()
+    return wait
+
+
+def run_pipelined(function, items, workers):
+    """Call `function` once for each item in `items`, using up to
+    `workers` threads, and yield the return values one at a time as
+    they become available.
+
+    This lets the caller start working on the first result while
+    the later ones are still being computed.
+
+    If only one worker is allowed, or there's only one item, each
+    call happens in the current thread, just before its return value
+    is yielded.
+
+    :return: A generator of return values, in the same order as
+        `items`. If a call raises an exception, it's re-raised when
+        the generator gets to that call's return value.
+    """
+    items = list(items)
+    if not workers or workers <= 1 or len(items) <= 1:
+        for item in items:
+            yield function(item)
+        return
+
+    pool = ThreadPool(min(workers, len(items)))
+    try:
+        for result in pool.imap(function, items):
+            yield result
+    finally:
+        # If the caller stops early, any calls already in progress
+        # will finish, but their return values will be discarded.
+        pool.close()
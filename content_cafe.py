@@ -31,10 +31,16 @@ from core.model import (
     Measurement,
     Identifier,
 )
-from core.util.http import HTTP
 from core.util.summary import SummaryEvaluator
 
-from coverage_utils import MetadataWranglerBibliographicCoverageProvider
+from http_pool import (
+    configure_from_database,
+    shared_pool,
+)
+from coverage_utils import (
+    MetadataWranglerBibliographicCoverageProvider,
+    PrefetchesMetadata,
+)
 
 def load_file(filename):
     """Load a file from the Content Cafe subdirectory of files/."""
@@ -44,7 +50,8 @@ def load_file(filename):
     return open(path).read()
 
 
-class ContentCafeCoverageProvider(MetadataWranglerBibliographicCoverageProvider):
+class ContentCafeCoverageProvider(PrefetchesMetadata,
+                                  MetadataWranglerBibliographicCoverageProvider):
     """Create bare-bones Editions for ISBN-type Identifiers.
 
     An Edition will have no bibliographic information, apart from a
@@ -73,6 +80,14 @@ class ContentCafeCoverageProvider(MetadataWranglerBibliographicCoverageProvider)
         _db = Session.object_session(collection)
         self.content_cafe = api or ContentCafeAPI.from_config(self._db)
 
+    def fetch(self, identifier):
+        """Ask Content Cafe about the given Identifier.
+
+        :return: A Metadata object, or None if Content Cafe has no
+            knowledge of this ISBN.
+        """
+        return self.content_cafe.create_metadata(identifier)
+
     def process_item(self, identifier):
         """Associate bibliographic metadata with the given Identifier.
 
@@ -80,7 +95,7 @@ class ContentCafeCoverageProvider(MetadataWranglerBibliographicCoverageProvider)
         """
         try:
             # Create a Metadata object.
-            metadata = self.content_cafe.create_metadata(identifier)
+            metadata = self.fetched_data(identifier)
             if not metadata:
                 # TODO: The only time this is really a transient error
                 # is when the book is too new for Content Cafe to know
@@ -157,12 +172,13 @@ class ContentCafeAPI(object):
         """Constructor.
         """
         self._db = _db
+        configure_from_database(_db)
         self.user_id = user_id
         self.password = password
         self.soap_client = (
             soap_client or ContentCafeSOAPClient(user_id, password)
         )
-        self.do_get = do_get or HTTP.get_with_timeout
+        self.do_get = do_get or shared_pool().get_with_timeout
 
     @property
     def data_source(self):
@@ -191,9 +207,11 @@ class ContentCafeAPI(object):
 
         media_type = response.headers.get('Content-Type', 'image/jpeg')
 
-        # Start building a Metadata object.
+        # Start building a Metadata object. This may be happening in a
+        # background thread, so refer to the DataSource by name rather
+        # than looking it up in the database.
         metadata = Metadata(
-            self.data_source, primary_identifier=isbn_identifier
+            DataSource.CONTENT_CAFE, primary_identifier=isbn_identifier
         )
         
         # Add the cover image to it
@@ -1,18 +1,30 @@
 from nose.tools import set_trace
 from datetime import datetime
-from flask import request, make_response
+from flask import (
+    Response,
+    g,
+    make_response,
+    request,
+    stream_with_context,
+)
 from flask_babel import lazy_gettext as _
 from lxml import etree
 from sqlalchemy import (
     and_,
+    func,
+    literal,
     not_,
+    tuple_,
 )
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import joinedload
+from sqlalchemy.types import DateTime
 from sqlalchemy.sql.expression import and_
 from Crypto.PublicKey import RSA
 from Crypto.Cipher import PKCS1_OAEP
 import base64
 import feedparser
+import hashlib
 import json
 import jwt
 import logging
@@ -61,13 +73,28 @@ from core.opds import (
 from core.util import fast_query_count
 from core.util.authentication_for_opds import AuthenticationForOPDSDocument
 from core.util.http import HTTP
-from core.util.opds_writer import OPDSMessage
+from core.util.opds_writer import (
+    OPDSFeed,
+    OPDSMessage,
+)
 from core.util.problem_detail import ProblemDetail
 
 from coverage import (
     IdentifierResolutionCoverageProvider,
 )
-from canonicalize import AuthorNameCanonicalizer
+from cache import (
+    LRUCache,
+    annotated_entries,
+)
+from canonicalize import (
+    AuthorNameCanonicalizer,
+    CanonicalizationCache,
+    CanonicalizationError,
+)
+from concurrency import (
+    independent_session_factory,
+    run_concurrently,
+)
 from integration_client import IntegrationClientCoverImageCoverageProvider
 from problem_details import *
 
@@ -81,11 +108,15 @@ HTTP_INTERNAL_SERVER_ERROR = 500
 OPDS_2_MEDIA_TYPE = 'application/opds+json'
 
 
+# Maps a hash of each recently used shared secret to the ID of the
+# IntegrationClient it belongs to.
+authenticated_client_ids = LRUCache(max_size=1000, ttl=300)
+
 def authenticated_client_from_request(_db, required=True):
     header = request.headers.get('Authorization')
     if header and 'bearer' in header.lower():
         shared_secret = base64.b64decode(header.split(' ')[1])
-        client = IntegrationClient.authenticate(_db, shared_secret)
+        client = client_for_shared_secret(_db, shared_secret)
         if client:
             return client
     if not required and not header:
@@ -95,6 +126,69 @@ def authenticated_client_from_request(_db, required=True):
     return INVALID_CREDENTIALS
 
 
+def client_for_shared_secret(_db, shared_secret):
+    """Find the IntegrationClient with the given shared secret.
+
+    The answer is remembered for the rest of the request, and the
+    client's ID is remembered for a few minutes after that.
+
+    :return: An IntegrationClient, or None.
+    """
+    key = hashlib.sha256(shared_secret).hexdigest()
+    clients = g.setdefault('authenticated_clients', {})
+    if key in clients:
+        return clients[key]
+
+    client = None
+    client_id = authenticated_client_ids.get(key)
+    if client_id is not None:
+        client = _db.query(IntegrationClient).get(client_id)
+        if not client or client.shared_secret != shared_secret:
+            # The secret has changed since we last saw it.
+            authenticated_client_ids.delete(key)
+            client = None
+    if not client:
+        client = IntegrationClient.authenticate(_db, shared_secret)
+        if client:
+            authenticated_client_ids.set(key, client.id)
+
+    clients[key] = client
+    return client
+
+def forget_shared_secrets(client):
+    """Stop associating any previously seen shared secrets with the
+    given IntegrationClient. Called when its secret changes.
+    """
+    authenticated_client_ids.delete_matching(
+        lambda key, client_id: client_id == client.id
+    )
+    clients = g.get('authenticated_clients', {})
+    for key, value in clients.items():
+        if value is client:
+            del clients[key]
+
+# Maps the details used to find a Collection to the Collection's ID.
+collection_ids = LRUCache(max_size=1000, ttl=3600)
+
+def cached_collection(_db, key, find):
+    """Find a Collection, using its cached ID if possible.
+
+    :param key: The cache key for this Collection.
+    :param find: A function that finds the Collection the slow way.
+    :return: A Collection.
+    """
+    collection = None
+    collection_id = collection_ids.get(key)
+    if collection_id is not None:
+        # Query.get() won't even go to the database if the
+        # Collection is already in the session.
+        collection = _db.query(Collection).get(collection_id)
+    if not collection:
+        collection = find()
+        if collection:
+            collection_ids.set(key, collection.id)
+    return collection
+
 def collection_from_details(_db, client, collection_details):
     if not (client and isinstance(client, IntegrationClient)):
         return None
@@ -106,13 +200,174 @@ def collection_from_details(_db, client, collection_details):
         if data_source_name:
             data_source_name = urllib.unquote(data_source_name)
 
-        collection, ignore = Collection.from_metadata_identifier(
-            _db, collection_details, data_source=data_source_name
-        )
-        return collection
+        def find():
+            collection, ignore = Collection.from_metadata_identifier(
+                _db, collection_details, data_source=data_source_name
+            )
+            return collection
+        key = (client.id, collection_details, data_source_name)
+        return cached_collection(_db, key, find)
     return None
 
 
+class KeysetPagination(object):
+    """Paginate a query by remembering where the previous page left off,
+    rather than by counting rows from the start of the results. Every
+    page costs the same, no matter how deep into the results it is.
+
+    Clients see the position as an opaque `key` argument in a 'next'
+    link.
+    """
+
+    DEFAULT_SIZE = Pagination.DEFAULT_SIZE
+    MAX_SIZE = 100
+
+    # datetime values in a key are encoded with this format.
+    TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+    # A nullable timestamp column is treated as though its NULLs were
+    # this value, which comes before any real timestamp. That way rows
+    # with NULL timestamps sort first, and a key can always be
+    # compared with a row.
+    NULL_TIMESTAMP = datetime(1900, 1, 1)
+
+    def __init__(self, columns, key=None, size=DEFAULT_SIZE):
+        """Constructor.
+
+        :param columns: A list of SQL columns. The query will be
+            ordered by these columns, which must uniquely identify a
+            result.
+        :param key: A tuple of values for `columns`, taken from the
+            last result on the previous page. If this is None, we're on
+            the first page.
+        :param size: The number of results on a page.
+        """
+        self.columns = [self.null_safe(column) for column in columns]
+        self.key = key
+        self.size = size
+
+        # Set by find_next_key().
+        self.next_key = None
+
+    @classmethod
+    def is_timestamp(cls, column):
+        return isinstance(column.expression.type, DateTime)
+
+    @classmethod
+    def null_safe(cls, column):
+        """If `column` is a nullable timestamp, replace it with an
+        expression that uses NULL_TIMESTAMP in place of NULL.
+        """
+        if cls.is_timestamp(column) and getattr(
+            column.expression, 'nullable', False
+        ):
+            return func.coalesce(column, literal(cls.NULL_TIMESTAMP))
+        return column
+
+    @classmethod
+    def from_request(cls, columns, default_size=DEFAULT_SIZE):
+        """Create a KeysetPagination based on the `key` and `size` request
+        arguments.
+
+        :return: A KeysetPagination, or a ProblemDetail if the `key`
+            can't be understood.
+        """
+        size = request.args.get('size', '')
+        if size.isdigit():
+            size = min(int(size), cls.MAX_SIZE)
+        else:
+            size = default_size
+
+        key = request.args.get('key')
+        if key:
+            try:
+                key = cls.decode_key(key, columns)
+            except (TypeError, ValueError), e:
+                return INVALID_INPUT.detailed(_("Invalid pagination key."))
+        return cls(columns, key=key, size=size)
+
+    @classmethod
+    def encode_key(cls, key):
+        values = []
+        for value in key:
+            if value == cls.NULL_TIMESTAMP:
+                value = None
+            elif isinstance(value, datetime):
+                value = value.strftime(cls.TIMESTAMP_FORMAT)
+            values.append(value)
+        return base64.urlsafe_b64encode(json.dumps(values))
+
+    @classmethod
+    def decode_key(cls, encoded, columns):
+        """Turn a key from a client back into a tuple of values for
+        `columns`.
+
+        A timestamp column's value must be a timestamp in
+        TIMESTAMP_FORMAT or null; any other column's value must be an
+        integer.
+
+        :raise ValueError: If the key isn't a list of the right number
+            and kind of values.
+        """
+        values = json.loads(base64.urlsafe_b64decode(str(encoded)))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError(
+                "Pagination key must be a list of %d values." % len(columns)
+            )
+        key = []
+        for column, value in zip(columns, values):
+            if cls.is_timestamp(column):
+                if value is None:
+                    value = cls.NULL_TIMESTAMP
+                elif isinstance(value, basestring):
+                    value = datetime.strptime(value, cls.TIMESTAMP_FORMAT)
+                else:
+                    raise ValueError("Expected a timestamp: %r" % value)
+            elif not isinstance(value, (int, long)) or isinstance(value, bool):
+                raise ValueError("Expected an integer: %r" % value)
+            key.append(value)
+        return tuple(key)
+
+    @property
+    def next_page(self):
+        return self.__class__(self.columns, key=self.next_key, size=self.size)
+
+    @property
+    def first_page(self):
+        return self.__class__(self.columns, size=self.size)
+
+    def items(self):
+        """The request arguments that identify this page."""
+        items = [('size', self.size)]
+        if self.key is not None:
+            items.append(('key', self.encode_key(self.key)))
+        return items
+
+    def apply(self, qu):
+        """Restrict a query to this page of results."""
+        qu = qu.order_by(None).order_by(*self.columns)
+        if self.key is not None:
+            qu = qu.filter(
+                tuple_(*self.columns) > tuple_(*[literal(x) for x in self.key])
+            )
+        return qu.limit(self.size)
+
+    def find_next_key(self, qu):
+        """Find out where the next page of results starts, by loading only
+        the ordering columns for this page plus one more row.
+
+        :return: The key for the next page, or None if this is the
+            last page.
+        """
+        rows = self.apply(qu).limit(self.size + 1).with_entities(
+            *self.columns
+        ).all()
+        self.next_key = None
+        if len(rows) > self.size:
+            self.next_key = tuple(rows[self.size - 1])
+        return self.next_key
+
+
 class IndexController(object):
 
     def __init__(self, _db):
@@ -183,22 +438,45 @@ class CanonicalizationController(object):
 
     log = logging.getLogger("Canonicalization Controller")
 
-    def __init__(self, _db, canonicalizer=None):
+    # Canonicalize no more than this many names in a single request.
+    MAX_BATCH_SIZE = 500
+
+    # Send this many names to OCLC and VIAF at once.
+    WORKERS = 5
+
+    def __init__(self, _db, canonicalizer=None, cache=None):
         self._db = _db
-        self.canonicalizer = canonicalizer or AuthorNameCanonicalizer(self._db)
+        self._canonicalizer = canonicalizer
+        self.cache = cache or CanonicalizationCache(self._db)
+
+    @property
+    def canonicalizer(self):
+        # Creating an AuthorNameCanonicalizer means creating API
+        # clients, which isn't necessary if the answer is cached.
+        if not self._canonicalizer:
+            self._canonicalizer = AuthorNameCanonicalizer(self._db)
+        return self._canonicalizer
 
     def canonicalize_author_name(self):
         urn = request.args.get('urn')
         identifier = self.parse_identifier(urn)
 
         display_name = request.args.get('display_name')
-        author_name = self.canonicalizer.canonicalize_author_name(
-            identifier, display_name
-        )
-        self.log.info(
-            "Incoming display name/identifier: %r/%s. Canonicalizer said: %s",
-            display_name, identifier, author_name
-        )
+        found, author_name = self.cache.get(identifier, display_name)
+        if found:
+            self.log.info(
+                "Incoming display name/identifier: %r/%s. Cache said: %s",
+                display_name, identifier, author_name
+            )
+        else:
+            author_name = self.canonicalizer.canonicalize_author_name(
+                identifier, display_name
+            )
+            self.cache.set(identifier, display_name, author_name)
+            self.log.info(
+                "Incoming display name/identifier: %r/%s. Canonicalizer said: %s",
+                display_name, identifier, author_name
+            )
 
         if not author_name:
             return make_response("", HTTP_NOT_FOUND)
@@ -206,6 +484,167 @@ class CanonicalizationController(object):
             author_name, HTTP_OK, {"Content-Type": "text/plain"}
         )
 
+    def canonicalize_author_names(self):
+        """Canonicalize many author names at once.
+
+        The request body is a JSON list of objects, each with a 'urn'
+        and/or a 'display_name'. The response is a JSON list with one
+        object for each distinct question, which adds a 'sort_name'
+        (possibly null) to the question.
+        """
+        try:
+            data = json.loads(request.data)
+        except ValueError, e:
+            data = None
+        if not (isinstance(data, list)
+                and all(isinstance(x, dict) for x in data)):
+            return INVALID_INPUT.detailed(
+                _("Request body must be a JSON list of objects.")
+            )
+
+        questions = []
+        seen = set()
+        for item in data:
+            question = (item.get('urn'), item.get('display_name'))
+            if not all(x is None or isinstance(x, basestring)
+                       for x in question):
+                return INVALID_INPUT.detailed(
+                    _("'urn' and 'display_name' must be strings.")
+                )
+            if question not in seen and any(question):
+                seen.add(question)
+                questions.append(question)
+        if len(questions) > self.MAX_BATCH_SIZE:
+            return INVALID_INPUT.detailed(
+                _("The maximum number of names you can provide at once is %(max)d. (You sent %(count)d)",
+                  max=self.MAX_BATCH_SIZE, count=len(questions))
+            )
+
+        identifiers = dict()
+        for urn, display_name in questions:
+            if urn not in identifiers:
+                identifiers[urn] = self.parse_identifier(urn)
+
+        # Some questions have already been answered.
+        answers = dict()
+        for question in questions:
+            urn, display_name = question
+            found, author_name = self.cache.get(identifiers[urn], display_name)
+            if found:
+                answers[question] = author_name
+
+        # Others can be answered with a single database query.
+        unanswered = [x for x in questions if x not in answers]
+        from_database = self.canonicalizer.sort_names_from_database(
+            [(identifiers[urn], display_name) for urn, display_name in unanswered]
+        )
+        for question in unanswered:
+            urn, display_name = question
+            author_name = from_database.get((identifiers[urn], display_name))
+            if author_name:
+                answers[question] = author_name
+                self.cache.set(identifiers[urn], display_name, author_name)
+
+        # The rest need to go to OCLC and VIAF.
+        unanswered = [x for x in questions if x not in answers]
+        for question, author_name in zip(
+            unanswered, self.canonicalize_concurrently(unanswered)
+        ):
+            answers[question] = author_name
+            urn, display_name = question
+            self.cache.set(identifiers[urn], display_name, author_name)
+
+        results = [
+            dict(urn=urn, display_name=display_name,
+                 sort_name=answers.get((urn, display_name)))
+            for urn, display_name in questions
+        ]
+        return make_response(
+            json.dumps(results), HTTP_OK,
+            {"Content-Type": "application/json"}
+        )
+
+    def canonicalize_concurrently(self, questions):
+        """Run (urn, display name) questions through this controller's
+        AuthorNameCanonicalizer, several at a time, each in its own
+        database session.
+
+        If that's not possible, the questions are run one at a time
+        in the controller's own database session.
+
+        :return: A list of answers, in the same order as `questions`.
+        """
+        session_factory = None
+        if len(questions) > 1:
+            session_factory = self.session_factory()
+        if not session_factory:
+            return [
+                self._canonicalize_one(
+                    self.canonicalizer, self.parse_identifier(urn),
+                    display_name
+                )
+                for urn, display_name in questions
+            ]
+
+        # Any Identifiers that need to be created are created here,
+        # and committed, before the worker threads start. Otherwise a
+        # worker's session could try to create an Identifier this
+        # session has created but not committed, and block on it
+        # while this thread waits for the worker.
+        jobs = []
+        for urn, display_name in questions:
+            identifier = self.parse_identifier(urn)
+            key = None
+            if identifier:
+                key = (identifier.type, identifier.identifier)
+            jobs.append((key, urn, display_name))
+        self._db.commit()
+
+        original = self.canonicalizer
+        def canonicalize(job):
+            key, urn, display_name = job
+            _db = session_factory()
+            try:
+                canonicalizer = original.in_session(_db)
+                identifier = None
+                if key:
+                    identifier_type, value = key
+                    identifier = get_one(
+                        _db, Identifier, type=identifier_type,
+                        identifier=value
+                    )
+                author_name = self._canonicalize_one(
+                    canonicalizer, identifier, display_name
+                )
+                # Keep anything we fetched from OCLC or VIAF.
+                _db.commit()
+                return author_name
+            except Exception, e:
+                _db.rollback()
+                self.log.error(
+                    "Error canonicalizing %r/%s", display_name, urn,
+                    exc_info=e
+                )
+                return None
+            finally:
+                _db.close()
+        return run_concurrently(canonicalize, jobs, self.WORKERS)
+
+    def session_factory(self):
+        """Find a way of creating database sessions for worker threads.
+
+        :return: A callable, or None if worker threads can't be used.
+        """
+        return independent_session_factory(self._db)
+
+    def _canonicalize_one(self, canonicalizer, identifier, display_name):
+        try:
+            return canonicalizer.canonicalize_author_name(
+                identifier, display_name
+            )
+        except CanonicalizationError, e:
+            return None
+
     def parse_identifier(self, urn):
         """Try to parse a URN into an identifier.
 
@@ -241,6 +680,10 @@ class CatalogController(object):
     # overall without impacting non-ISBN collections too much.
     UPDATES_SIZE = 35
 
+    # A streamed updates feed is never held in memory all at once, so
+    # clients can ask for much bigger pages.
+    MAX_STREAMED_UPDATES_SIZE = 1000
+
     TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
 
     def __init__(self, _db):
@@ -269,6 +712,18 @@ class CatalogController(object):
                 endpoint, collection, page=page, **url_param_kwargs
             )
 
+        if isinstance(pagination, KeysetPagination):
+            # We can only go forward from here, or back to the start.
+            if pagination.next_key is not None:
+                feed.add_link_to_feed(
+                    feed.feed, rel="next", href=href_for(pagination.next_page)
+                )
+            if pagination.key is not None:
+                feed.add_link_to_feed(
+                    feed.feed, rel="first", href=href_for(pagination.first_page)
+                )
+            return
+
         if fast_query_count(query) > (pagination.size + pagination.offset):
             feed.add_link_to_feed(
                 feed.feed, rel="next", href=href_for(pagination.next_page)
@@ -306,31 +761,26 @@ class CatalogController(object):
                     message % (last_update_time, self.TIMESTAMP_FORMAT)
                 )
 
-        pagination = load_pagination_from_request(default_size=self.UPDATES_SIZE)
+        pagination = self.load_pagination(
+            [Work.last_update_time, Work.id, Identifier.id],
+            self.UPDATES_SIZE
+        )
+        if isinstance(pagination, ProblemDetail):
+            return pagination
+        stream = request.args.get('stream', '').lower() == 'true'
+        if stream:
+            size = request.args.get('size', '')
+            if size.isdigit():
+                pagination.size = min(
+                    int(size), self.MAX_STREAMED_UPDATES_SIZE
+                )
 
-        precomposed_entries = []
-        # Add entries for Works associated with the collection's catalog.
+        # Find Works associated with the collection's catalog.
         updated_works = collection.works_updated_since(self._db, last_update_time)
-        works = pagination.apply(updated_works).all()
+        if isinstance(pagination, KeysetPagination):
+            pagination.find_next_key(updated_works)
+        works = pagination.apply(updated_works)
         annotator = VerboseAnnotator()
-        works_for_feed = []
-        for work, licensepool, identifier in works:
-            entry = work.verbose_opds_entry or work.simple_opds_entry
-            if entry:
-                # A cached OPDS entry for this Work already
-                # exists. annotate it with LicensePool and
-                # Identifier-specific information. We have to do this
-                # ourselves because we're asking LookupAcquisitionFeed
-                # to treat these as precomposed entries, meaning
-                # they must be complete as-is.
-                entry = etree.fromstring(entry)
-                annotator.annotate_work_entry(
-                    work, licensepool, None, identifier, None, entry
-                )
-                precomposed_entries.append(entry)
-            else:
-                # There is no cached OPDS entry. We'll create one later.
-                works_for_feed.append((work, identifier))
 
         title = "%s Collection Updates for %s" % (collection.protocol, client.url)
         url_params = dict()
@@ -342,6 +792,29 @@ class CatalogController(object):
             )
         url = self.collection_feed_url('updates', collection, **url_params)
 
+        if stream:
+            feed = LookupAcquisitionFeed(self._db, title, url, [], annotator)
+            self.add_pagination_links_to_feed(
+                pagination, updated_works, feed, 'updates', collection,
+                stream='true', **url_params
+            )
+            return Response(
+                stream_with_context(self._stream_feed(feed, works, annotator)),
+                200, {"Content-Type": OPDSFeed.ACQUISITION_FEED_TYPE}
+            )
+
+        precomposed_entries = []
+        works_for_feed = []
+        for work, licensepool, identifier in works.all():
+            entry = self.precomposed_update_entry(
+                annotator, work, licensepool, identifier
+            )
+            if entry is not None:
+                precomposed_entries.append(etree.fromstring(entry))
+            else:
+                # There is no cached OPDS entry. We'll create one later.
+                works_for_feed.append((work, identifier))
+
         update_feed = LookupAcquisitionFeed(
             self._db, title, url, works_for_feed, annotator,
             precomposed_entries=precomposed_entries
@@ -354,6 +827,78 @@ class CatalogController(object):
 
         return feed_response(update_feed)
 
+    def load_pagination(self, columns, default_size):
+        """Decide how to paginate a feed.
+
+        Feeds are paginated by keyset, ordered by `columns`, unless
+        the client followed an old-style link that uses an offset.
+
+        :return: A KeysetPagination or Pagination, or a ProblemDetail.
+        """
+        if 'after' in request.args:
+            return load_pagination_from_request(default_size=default_size)
+        return KeysetPagination.from_request(columns, default_size)
+
+    def precomposed_update_entry(self, annotator, work, licensepool,
+                                 identifier):
+        """Build an updates feed entry from a Work's cached OPDS entry.
+
+        Annotated entries are themselves cached, so most of the time
+        this doesn't involve any XML processing.
+
+        :return: A serialized OPDS entry, or None if the Work has no
+            cached OPDS entry.
+        """
+        cached = annotated_entries.get(work, licensepool, identifier)
+        if cached:
+            return cached
+
+        entry = work.verbose_opds_entry or work.simple_opds_entry
+        if not entry:
+            return None
+
+        # Annotate the cached entry with LicensePool and
+        # Identifier-specific information. We have to do this
+        # ourselves because we're asking LookupAcquisitionFeed to
+        # treat these as precomposed entries, meaning they must be
+        # complete as-is.
+        entry = etree.fromstring(entry)
+        annotator.annotate_work_entry(
+            work, licensepool, None, identifier, None, entry
+        )
+        entry = etree.tostring(entry)
+        annotated_entries.set(work, licensepool, identifier, entry)
+        return entry
+
+    def _stream_feed(self, feed, works, annotator):
+        """Yield an updates feed one piece at a time: first everything
+        up to the first entry, then each entry as soon as it's ready,
+        then the closing tag.
+
+        :param feed: A LookupAcquisitionFeed with no entries, whose
+            header will be sent.
+        :param works: A query that finds (Work, LicensePool,
+            Identifier) tuples, one per entry.
+        """
+        closing_tag = "</feed>"
+        header = etree.tostring(feed.feed)
+        yield header[:header.rindex(closing_tag)]
+
+        for work, licensepool, identifier in works:
+            entry = self.precomposed_update_entry(
+                annotator, work, licensepool, identifier
+            )
+            if entry is None:
+                entry = feed.create_entry((work, identifier))
+                if isinstance(entry, OPDSMessage):
+                    entry = entry.tag
+                if entry is not None:
+                    entry = etree.tostring(entry)
+            if entry is not None:
+                yield entry
+
+        yield closing_tag
+
     def add_items(self, collection_details):
         """Adds identifiers to a Collection's catalog"""
         client = authenticated_client_from_request(self._db)
@@ -363,7 +908,10 @@ class CatalogController(object):
         collection = collection_from_details(
             self._db, client, collection_details
         )
-        urns = request.args.getlist('urn')
+        # URNs may be sent in the query string, or, if there are too
+        # many of them for that, as a form-encoded request body.
+        query_urns = request.args.getlist('urn')
+        urns = query_urns + request.form.getlist('urn')
         messages = []
         identifiers_by_urn, failures = Identifier.parse_urns(self._db, urns)
 
@@ -373,31 +921,20 @@ class CatalogController(object):
             )
             messages.append(message)
 
-        # Find the subset of incoming identifiers that are already
-        # in the catalog.
-        already_in_catalog, ignore = self._in_catalog_subset(
-            collection, identifiers_by_urn
-        )
-
-        # Everything else needs to be added to the catalog.
-        needs_to_be_added = [
-            x for x in identifiers_by_urn.values()
-            if x.id not in already_in_catalog
-        ]
-        collection.catalog_identifiers(needs_to_be_added)
+        added = self._add_to_catalog(collection, identifiers_by_urn.values())
 
         for urn, identifier in identifiers_by_urn.items():
-            if identifier.id in already_in_catalog:
-                status = HTTP_OK
-                description = "Already in catalog"
-            else:
+            if identifier.id in added:
                 status = HTTP_CREATED
                 description = "Successfully added"
+            else:
+                status = HTTP_OK
+                description = "Already in catalog"
 
             messages.append(OPDSMessage(urn, status, description))
 
         title = "%s Catalog Item Additions for %s" % (collection.protocol, client.url)
-        url = self.collection_feed_url('add', collection, urn=urns)
+        url = self.collection_feed_url('add', collection, urn=query_urns)
         addition_feed = AcquisitionFeed(
             self._db, title, url, [], VerboseAnnotator,
             precomposed_entries=messages
@@ -533,7 +1070,11 @@ class CatalogController(object):
         ).filter(is_awaiting_metadata.c.id==None)
 
         # Add a message for each unresolved identifier
-        pagination = load_pagination_from_request(default_size=25)
+        pagination = self.load_pagination([Identifier.id], 25)
+        if isinstance(pagination, ProblemDetail):
+            return pagination
+        if isinstance(pagination, KeysetPagination):
+            pagination.find_next_key(unresolved_identifiers)
         feed_identifiers = pagination.apply(unresolved_identifiers).all()
         messages = list()
         for identifier in feed_identifiers:
@@ -614,6 +1155,32 @@ class CatalogController(object):
 
         return feed_response(removal_feed)
 
+    def _add_to_catalog(self, collection, identifiers):
+        """Add Identifiers to a Collection's catalog with a single INSERT,
+        skipping any that are already there.
+
+        Because the database decides which Identifiers are new, two
+        clients adding the same Identifier at the same time can't
+        both end up adding it.
+
+        :return: A set of IDs for the Identifiers that were actually
+            added to the catalog.
+        """
+        identifier_ids = set([x.id for x in identifiers])
+        if not identifier_ids:
+            return set()
+
+        table = collections_identifiers
+        statement = insert(table).values([
+            dict(collection_id=collection.id, identifier_id=identifier_id)
+            for identifier_id in identifier_ids
+        ]).on_conflict_do_nothing().returning(table.c.identifier_id)
+        added = set([row[0] for row in self._db.execute(statement)])
+
+        # The catalog changed behind the ORM's back.
+        self._db.expire(collection, ['catalog'])
+        return added
+
     def _in_catalog_subset(self, collection, identifiers_by_urn):
         """Helper method to find a subset of identifiers that
         are already in a catalog.
@@ -760,6 +1327,10 @@ class CatalogController(object):
                 log.error("Error in IntegrationClient.register", exc_info=e)
                 return INVALID_CREDENTIALS.detailed(e.message)
 
+        # The client's secret may have changed, so the secrets we
+        # remember for it are no good.
+        forget_shared_secrets(client)
+
         # Now that we have an IntegrationClient with a shared
         # secret, encrypt the shared secret with the provided public key
         # and send it back.
@@ -798,6 +1369,13 @@ class URNLookupController(CoreURNLookupController):
 
     log = logging.getLogger("URN lookup controller")
 
+    # By default, a client can ask for up to this many Identifiers at
+    # a time to be resolved immediately. This sitewide setting changes
+    # that limit. Third-party data for all of them is fetched in
+    # parallel before they're resolved; see resolve_concurrently().
+    IMMEDIATE_RESOLUTION_LIMIT = "immediate_resolution_limit"
+    DEFAULT_IMMEDIATE_RESOLUTION_LIMIT = 10
+
     def __init__(self, _db, coverage_provider_kwargs=None):
         """Constructor.
 
@@ -805,16 +1383,25 @@ class URNLookupController(CoreURNLookupController):
         IdentifierResolutionCoverageProvider, pass in these keyword
         arguments.  Used only in testing.
         """
-        self._default_collection_id = None
         super(URNLookupController, self).__init__(_db)
         self.coverage_provider_kwargs = dict(coverage_provider_kwargs or {})
 
     @property
     def default_collection(self):
-        if getattr(self, '_default_collection_id', None) is None:
+        def find():
             default_collection, ignore = IdentifierResolutionCoverageProvider.unaffiliated_collection(self._db)
-            self._default_collection_id = default_collection.id
-        return get_one(self._db, Collection, id=self._default_collection_id)
+            return default_collection
+        return cached_collection(self._db, 'unaffiliated', find)
+
+    @property
+    def immediate_resolution_limit(self):
+        """How many Identifiers can be resolved immediately in a
+        single request?
+        """
+        limit = ConfigurationSetting.sitewide(
+            self._db, self.IMMEDIATE_RESOLUTION_LIMIT
+        ).int_value
+        return limit or self.DEFAULT_IMMEDIATE_RESOLUTION_LIMIT
 
     def presentation_ready_work_for(self, identifier):
         """Either return an existing presentation-ready work associated with
@@ -863,8 +1450,9 @@ class URNLookupController(CoreURNLookupController):
             limit = 1
 
         if resolve_now:
-            # You can't force-resolve more than one Identifier at a time.
-            limit = 1
+            # Resolving an Identifier immediately is expensive, so
+            # there's a separate limit on how many you can ask for.
+            limit = min(limit, self.immediate_resolution_limit)
 
         if len(urns) > limit:
             return INVALID_INPUT.detailed(
@@ -875,23 +1463,74 @@ class URNLookupController(CoreURNLookupController):
         )
         self.add_urn_failure_messages(failures)
 
+        # Put the Identifiers back in the order the client sent them,
+        # so that the feed is in that order too.
+        urns_and_identifiers = []
+        for urn in urns:
+            identifier = identifiers_by_urn.pop(urn, None)
+            if identifier:
+                urns_and_identifiers.append((urn, identifier))
+        identifiers = [identifier for urn, identifier in urns_and_identifiers]
+
         # Catalog all identifiers.
-        collection.catalog_identifiers(identifiers_by_urn.values())
+        collection.catalog_identifiers(identifiers)
 
         # Load all coverage records in a single query to speed up the
         # code that reports on the status of Identifiers that aren't
         # ready.
-        self.bulk_load_coverage_records(identifiers_by_urn.values())
+        self.bulk_load_coverage_records(identifiers)
 
-        resolver = IdentifierResolutionCoverageProvider(
-            collection, provide_coverage_immediately=resolve_now,
-            **self.coverage_provider_kwargs
-        )
-        for urn, identifier in identifiers_by_urn.items():
+        needs_work = [
+            identifier for identifier in identifiers
+            if not self.presentation_ready_work_for(identifier)
+        ]
+        resolver = None
+        if resolve_now:
+            resolver = IdentifierResolutionCoverageProvider(
+                collection, provide_coverage_immediately=True,
+                **self.coverage_provider_kwargs
+            )
+            self.resolve_concurrently(resolver, needs_work)
+        elif needs_work:
+            # Register all the Identifiers with their CoverageProviders
+            # as a single batch, rather than one at a time.
+            registrar = IdentifierResolutionCoverageProvider(
+                collection, **self.coverage_provider_kwargs
+            )
+            registrar.process_batch_and_handle_results(needs_work)
+            self.bulk_load_coverage_records(needs_work)
+
+        for urn, identifier in urns_and_identifiers:
             self.process_identifier(
                 identifier, urn, resolver=resolver
             )
 
+    def resolve_concurrently(self, resolver, identifiers):
+        """Get ready to immediately resolve a number of Identifiers by
+        fetching data about all of them from third parties at once,
+        in background threads.
+
+        Every CoverageProvider that can prefetch (Content Cafe, OCLC
+        Classify, Overdrive and the IntegrationClient cover image
+        provider) requests its data for every Identifier up front, up
+        to IdentifierResolutionCoverageProvider.PREFETCH_WORKERS
+        requests at a time, so a request waits on roughly its slowest
+        upstream calls rather than all of them in turn.
+
+        The Identifiers themselves are not resolved in a pool of
+        separate sessions. They're still resolved one at a time,
+        through this controller's own database session, so everything
+        happens in the request's transaction. Work that has to happen
+        during resolution, such as asking VIAF about an Overdrive
+        book's authors, still happens one Identifier at a time.
+
+        :param resolver: The IdentifierResolutionCoverageProvider that
+            will resolve the Identifiers.
+        :param identifiers: A list of Identifiers that don't have a
+            presentation-ready Work yet.
+        """
+        resolver.start_prefetching(identifiers)
+
     def process_identifier(self, identifier, urn, resolver):
         """If there is a presentation-ready Work for the given Identifier,
         add its OPDS entry to the feed.
@@ -908,7 +1547,9 @@ class URNLookupController(CoreURNLookupController):
         :param collection: The Identifier was registered with this collection.
         :param resolver: An IdentifierResolutionCoverageProvider which
             will either create a presentation-ready Work immediately, or
-            make sure that one eventually gets created.
+            make sure that one eventually gets created. If this is
+            None, the Identifier has already been resolved and all
+            that's left is to report on the result.
         :return: None.
         """
         work = self.presentation_ready_work_for(identifier)
@@ -916,6 +1557,9 @@ class URNLookupController(CoreURNLookupController):
             # We already have a presentation-ready Work for this Identifier.
             return self.add_work(identifier, work)
 
+        if not resolver:
+            return self.add_status_message(urn, identifier)
+
         # Some work has not been done. Make the
         # IdentifierResolutionCoverageProvider process this
         # Identifier. This will either do the work, or register all
@@ -1,6 +1,9 @@
+import datetime
 import logging
+from collections import defaultdict
 from nose.tools import set_trace
 
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm.session import Session
 
 from core.config import CannotLoadConfiguration
@@ -34,6 +37,8 @@ from core.mirror import MirrorUploader
 
 from core.util import fast_query_count
 
+from concurrency import run_in_background
+from coverage_utils import PrefetchesMetadata
 from oclc.classify import IdentifierLookupCoverageProvider
 
 from overdrive import (
@@ -85,6 +90,10 @@ class IdentifierResolutionCoverageProvider(CatalogCoverageProvider):
     # We cover all Collections, regardless of their protocol.
     PROTOCOL = None
 
+    # When providing coverage immediately, this many CoverageProviders
+    # can be fetching data from third parties at once.
+    PREFETCH_WORKERS = 4
+
     def __init__(self, collection, mirror=None, http_get=None, viaf=None,
                  provide_coverage_immediately=False, force=False,
                  provider_kwargs=None, **kwargs
@@ -158,6 +167,10 @@ class IdentifierResolutionCoverageProvider(CatalogCoverageProvider):
 
         self.viaf = viaf or VIAFClient(self._db)
 
+        # Maps each Identifier whose data is being prefetched to a
+        # 2-tuple (providers, wait). See start_prefetching().
+        self._prefetching = {}
+
         # Instantiate the coverage providers that may be needed to
         # relevant to any given Identifier.
         #
@@ -292,21 +305,64 @@ class IdentifierResolutionCoverageProvider(CatalogCoverageProvider):
             message = "Registering %s with coverage providers."
         self.log.info(message, identifier)
 
-        # Make sure there's a LicensePool for this Identifier in this
-        # Collection. Since we're the metadata wrangler, the
-        # LicensePool is a stub that doesn't actually represent the
-        # right to loan the book, but that's okay.
+        license_pool = self.prepare_license_pool(identifier)
+
+        # Let all the CoverageProviders do something.
+        results = self.process_all_providers(identifier)
+        self.make_work_if_necessary(license_pool, results)
+
+        # The only way this can fail is if there is an uncaught exception
+        # during the registration/processing process. The failure of a
+        # CoverageProvider to provide coverage doesn't mean this process
+        # has failed -- that's a problem that the CoverageProvider itself
+        # can resolve later.
+        return identifier
+
+    def process_batch(self, identifiers):
+        """Handle a batch of Identifiers.
+
+        When providing coverage immediately, each Identifier is
+        processed on its own. Otherwise, the whole batch is registered
+        with each CoverageProvider at once.
+        """
+        if self.provide_coverage_immediately:
+            return super(
+                IdentifierResolutionCoverageProvider, self
+            ).process_batch(identifiers)
+
+        self.log.info(
+            "Registering %d identifiers with coverage providers.",
+            len(identifiers)
+        )
+        license_pools = [
+            self.prepare_license_pool(identifier)
+            for identifier in identifiers
+        ]
+        records = self.register_with_providers(identifiers)
+        for identifier, license_pool in zip(identifiers, license_pools):
+            self.make_work_if_necessary(license_pool, records[identifier])
+        return identifiers
+
+    def prepare_license_pool(self, identifier):
+        """Make sure there's a LicensePool for this Identifier in this
+        Collection. Since we're the metadata wrangler, the
+        LicensePool is a stub that doesn't actually represent the
+        right to loan the book, but that's okay.
+        """
         license_pool = self.license_pool(identifier)
         if not license_pool.licenses_owned:
             license_pool.update_availability(1, 1, 0, 0)
         if not license_pool.collection:
             license_pool.collection = self.collection
+        return license_pool
 
-        # Let all the CoverageProviders do something.
-        results = [
-            self.process_one_provider(identifier, provider)
-            for provider in self.providers
-        ]
+    def make_work_if_necessary(self, license_pool, results):
+        """Create a presentation-ready Work for a LicensePool if any
+        CoverageProvider succeeded but there's no such Work yet.
+
+        :param results: The CoverageRecords (or other results) produced
+            by the CoverageProviders.
+        """
         successes = [
             x for x in results if isinstance(x, CoverageRecord)
             and x.status==CoverageRecord.SUCCESS
@@ -329,12 +385,97 @@ class IdentifierResolutionCoverageProvider(CatalogCoverageProvider):
                 # data.
                 work.set_presentation_ready()
 
-        # The only way this can fail is if there is an uncaught exception
-        # during the registration/processing process. The failure of a
-        # CoverageProvider to provide coverage doesn't mean this process
-        # has failed -- that's a problem that the CoverageProvider itself
-        # can resolve later.
-        return identifier
+    def start_prefetching(self, identifiers):
+        """Start fetching, in background threads, whatever data the
+        CoverageProviders that can prefetch will need for
+        `identifiers`.
+
+        A provider only fetches data for an Identifier it's actually
+        going to process. The background threads are given whatever
+        each provider's prefetch_arguments() returns rather than
+        Identifiers, so they never touch this provider's database
+        session.
+        """
+        jobs = []
+        prefetching = []
+        for identifier in identifiers:
+            if identifier in self._prefetching:
+                continue
+            providers = []
+            for provider in self.providers:
+                if not (isinstance(provider, PrefetchesMetadata)
+                        and provider.can_cover(identifier)
+                        and self.will_process(identifier, provider)):
+                    continue
+                try:
+                    arguments = provider.prefetch_arguments(identifier)
+                except Exception, e:
+                    # This provider will just have to get its data
+                    # when it's processed.
+                    self.log.error(
+                        "Could not prefetch data from %r for %r",
+                        provider, identifier, exc_info=e
+                    )
+                    continue
+                providers.append(provider)
+                jobs.append((provider, arguments))
+            prefetching.append((identifier, providers))
+
+        wait = run_in_background(
+            lambda job: job[0].prefetch(job[1]), jobs, self.PREFETCH_WORKERS
+        )
+        for identifier, providers in prefetching:
+            self._prefetching[identifier] = (providers, wait)
+
+    def will_process(self, identifier, provider):
+        """Will process_one_provider() actually ask `provider` to do
+        any work on `identifier`, or will it find that the work has
+        already been done?
+        """
+        if not self.provide_coverage_immediately:
+            return False
+        if self.force:
+            return True
+        record = CoverageRecord.lookup(
+            identifier, provider.data_source, provider.operation,
+            collection=self.registration_collection(provider)
+        )
+        return provider.should_update(record)
+
+    def process_all_providers(self, identifier):
+        """Run an Identifier through every CoverageProvider.
+
+        When providing coverage immediately, CoverageProviders that can
+        fetch their data without touching the database do so in
+        background threads, while the other CoverageProviders do their
+        work. The fetched data is then applied, one provider at a time,
+        through this provider's database session.
+
+        :return: A list containing the result of each
+            process_one_provider() call.
+        """
+        if self.provide_coverage_immediately:
+            self.start_prefetching([identifier])
+        prefetching, wait = self._prefetching.pop(
+            identifier, ([], lambda: [])
+        )
+        try:
+            results = [
+                self.process_one_provider(identifier, provider)
+                for provider in self.providers
+                if provider not in prefetching
+            ]
+            wait()
+            results.extend([
+                self.process_one_provider(identifier, provider)
+                for provider in prefetching
+            ])
+        finally:
+            # If something went wrong before a provider got around
+            # to using its prefetched data, don't keep it around.
+            for provider in prefetching:
+                provider.discard_prefetched(identifier)
+        return results
 
     def process_one_provider(self, identifier, provider):
         if not provider.can_cover(identifier):
@@ -342,24 +483,111 @@ class IdentifierResolutionCoverageProvider(CatalogCoverageProvider):
             # handle Identifiers of this type.
             return
 
-        # TODO: This code could be moved into
-        # IdentifierCoverageProvider.register, if it weren't a class
-        # method. This would simplify testing.
-        if provider.COVERAGE_COUNTS_FOR_EVERY_COLLECTION:
-            # We need to cover this Identifier once, and then we're
-            # done, for all collections.
-            collection = None
-        else:
-            # We need separate coverage for the specific Collection
-            # associated with this CoverageProvider.
-            collection = provider.collection
-
         if self.provide_coverage_immediately:
             coverage_record = provider.ensure_coverage(
                 identifier, force=self.force
             )
         else:
             coverage_record, is_new = provider.register(
-                identifier, collection=collection, force=self.force
+                identifier, collection=self.registration_collection(provider),
+                force=self.force
             )
         return coverage_record
+
+    def registration_collection(self, provider):
+        """Which Collection should an Identifier's registration with
+        the given CoverageProvider be associated with?
+        """
+        # TODO: This code could be moved into
+        # IdentifierCoverageProvider.register, if it weren't a class
+        # method. This would simplify testing.
+        if provider.COVERAGE_COUNTS_FOR_EVERY_COLLECTION:
+            # We need to cover this Identifier once, and then we're
+            # done, for all collections.
+            return None
+        # We need separate coverage for the specific Collection
+        # associated with this CoverageProvider.
+        return provider.collection
+
+    def register_with_providers(self, identifiers):
+        """Register a batch of Identifiers with every CoverageProvider that
+        can handle them.
+
+        This takes a handful of queries per CoverageProvider, rather
+        than a handful of queries per CoverageProvider per Identifier.
+
+        :return: A dictionary mapping each Identifier to a list of its
+            CoverageRecords with the CoverageProviders.
+        """
+        records = defaultdict(list)
+        for provider in self.providers:
+            coverable = [x for x in identifiers if provider.can_cover(x)]
+            if not coverable:
+                continue
+            for record in self.bulk_register(provider, coverable):
+                records[record.identifier].append(record)
+
+        # The Identifiers' CoverageRecords changed behind the ORM's
+        # back, so make sure they're reloaded the next time someone
+        # looks.
+        for identifier in identifiers:
+            self._db.expire(identifier, ['coverage_records'])
+        return records
+
+    def bulk_register(self, provider, identifiers):
+        """Make sure every one of `identifiers` has a CoverageRecord with
+        `provider`, creating the missing ones in the 'registered'
+        state with a single multi-row INSERT.
+
+        The INSERT skips any CoverageRecord that already exists, so if
+        another request registers the same Identifier at the same
+        time, both requests end up with the same CoverageRecord
+        instead of one of them failing.
+
+        If self.force is set, existing CoverageRecords are put back
+        into the 'registered' state, just as
+        IdentifierCoverageProvider.register would do.
+
+        :return: A list of CoverageRecords, one for each Identifier.
+        """
+        self._db.flush()
+        data_source = provider.data_source
+        operation = provider.operation
+        collection = self.registration_collection(provider)
+        collection_id = None
+        if collection:
+            collection_id = collection.id
+        identifier_ids = [identifier.id for identifier in identifiers]
+
+        def existing_records():
+            return self._db.query(CoverageRecord).filter(
+                CoverageRecord.identifier_id.in_(identifier_ids),
+                CoverageRecord.data_source==data_source,
+                CoverageRecord.operation==operation,
+                CoverageRecord.collection_id==collection_id,
+            ).all()
+
+        now = datetime.datetime.utcnow()
+        records = existing_records()
+        if self.force:
+            for record in records:
+                record.status = CoverageRecord.REGISTERED
+                record.timestamp = now
+                record.exception = None
+
+        covered = set([record.identifier_id for record in records])
+        missing = [x for x in identifier_ids if x not in covered]
+        if missing:
+            statement = insert(CoverageRecord.__table__).values([
+                dict(
+                    identifier_id=identifier_id,
+                    data_source_id=data_source.id,
+                    operation=operation,
+                    collection_id=collection_id,
+                    status=CoverageRecord.REGISTERED,
+                    timestamp=now,
+                ) for identifier_id in missing
+            ]).on_conflict_do_nothing()
+            self._db.execute(statement)
+            records = existing_records()
+        return records
@@ -1,5 +1,14 @@
+import datetime
+
 from nose.tools import set_trace
 
+from sqlalchemy import (
+    Column,
+    DateTime,
+    ForeignKey,
+    Integer,
+    inspect,
+)
 from sqlalchemy.orm.session import Session
 
 from core.config import CannotLoadConfiguration
@@ -7,13 +16,112 @@ from core.coverage import (
     BibliographicCoverageProvider,
     CoverageFailure
 )
-from core.metadata_layer import ReplacementPolicy
+from core.metadata_layer import (
+    IdentifierData,
+    ReplacementPolicy,
+)
 from core.mirror import MirrorUploader
 from core.model import (
+    Base,
     DataSource,
     Work,
+    get_one_or_create,
 )
 
+class PrefetchesMetadata(object):
+    """A mix-in for CoverageProviders whose work splits into two parts:
+    fetching data from a third-party API, which doesn't touch the
+    database, and applying that data, which does.
+
+    This lets IdentifierResolutionCoverageProvider fetch data in a
+    background thread while other CoverageProviders are busy, and
+    apply it later through the main database session.
+
+    Subclasses must implement fetch(), and process_item() should get
+    its data by calling fetched_data() rather than fetch() -- or, if
+    fetch() can't stand in for the usual way of getting the data,
+    by calling prefetched_data() and falling back to the usual way.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(PrefetchesMetadata, self).__init__(*args, **kwargs)
+        self._prefetched = {}
+
+    @classmethod
+    def prefetch_key(cls, identifier):
+        """The key under which prefetched data about `identifier` is
+        kept. It's made of plain strings, so it means the same thing
+        in any thread.
+        """
+        return (identifier.type, identifier.identifier)
+
+    def prefetch_arguments(self, identifier):
+        """Find out, through the database, whatever fetch() will need to
+        know about `identifier`.
+
+        This is called in the thread that owns the database session,
+        just before fetch() is called in the background.
+
+        :return: An object with `type` and `identifier` attributes
+            that can safely be handed to another thread. By default,
+            an IdentifierData.
+        """
+        return IdentifierData(identifier.type, identifier.identifier)
+
+    def fetch(self, identifier):
+        """Get data about `identifier` from a third party.
+
+        This may be called from a thread other than the one that owns
+        the database session, so it must not touch the database.
+
+        :param identifier: An Identifier, or, when called from a
+            background thread, whatever prefetch_arguments() returned.
+            Only its `type` and `identifier` should be relied on.
+        """
+        raise NotImplementedError()
+
+    def prefetch(self, identifier_data):
+        """Call fetch() ahead of time and hold on to whatever it returns
+        (or raises) until process_item() is called for the
+        corresponding Identifier.
+
+        :param identifier_data: The output of prefetch_arguments().
+            This is called in a background thread, so it must not be
+            given a database object.
+        """
+        try:
+            fetched = self.fetch(identifier_data)
+        except Exception, e:
+            fetched = e
+        self._prefetched[self.prefetch_key(identifier_data)] = fetched
+
+    def prefetched_data(self, identifier):
+        """Get the output of fetch() for `identifier`, if it was
+        prefetched.
+
+        :return: Whatever fetch() returned, or None if nothing was
+            prefetched.
+        """
+        fetched = self._prefetched.pop(self.prefetch_key(identifier), None)
+        if isinstance(fetched, Exception):
+            raise fetched
+        return fetched
+
+    def fetched_data(self, identifier):
+        """Get the output of fetch() for `identifier`, using the
+        prefetched result if there is one.
+        """
+        if self.prefetch_key(identifier) in self._prefetched:
+            return self.prefetched_data(identifier)
+        return self.fetch(identifier)
+
+    def discard_prefetched(self, identifier):
+        """Forget any prefetched data about `identifier` that was never
+        used.
+        """
+        self._prefetched.pop(self.prefetch_key(identifier), None)
+
+
 class MetadataWranglerBibliographicCoverageProvider(BibliographicCoverageProvider):
 
     def _default_replacement_policy(self, _db):
@@ -123,18 +231,96 @@ class ResolveVIAFOnSuccessCoverageProvider(MetadataWranglerBibliographicCoverage
             return self.failure(identifier, message, transient=True)
         return identifier
 
+    # A Contributor won't be run through VIAF again until this much
+    # time has passed.
+    VIAF_MAX_AGE = datetime.timedelta(days=90)
+
     def resolve_viaf(self, work):
         """Get VIAF data on all contributors to the Work's presentation edition.
         """
+        contributors = []
         for pool in work.license_pools:
             edition = pool.presentation_edition
             if not edition:
                 continue
-            for contributor in edition.contributors:
-                # TODO: We need some way of not going to VIAF over and over
-                # again for the same contributors.
+            contributors.extend(edition.contributors)
+        self.resolve_viaf_for_contributors(contributors)
+
+    def resolve_viaf_for_contributors(self, contributors):
+        """Get VIAF data on a number of contributors.
+
+        Each distinct Contributor is run through VIAF at most once,
+        and Contributors that were run through VIAF recently are
+        skipped.
+        """
+        distinct = []
+        seen = set()
+        for contributor in contributors:
+            if contributor.id in seen:
+                continue
+            seen.add(contributor.id)
+            distinct.append(contributor)
+
+        # Find out which contributors are fresh with a single query.
+        recently_resolved = self.recently_resolved(distinct)
+        for contributor in distinct:
+            if contributor.id not in recently_resolved:
                 self.viaf.process_contributor(contributor)
-                if not contributor.display_name:
-                    contributor.family_name, contributor.display_name = (
-                        contributor.default_names()
-                    )
+                state = inspect(contributor)
+                if state.deleted or state.was_deleted:
+                    # The contributor was merged into a duplicate. The
+                    # duplicate has the VIAF data now, but there's no
+                    # need to mark it -- it will get its own turn.
+                    continue
+                self.mark_viaf_resolved(contributor)
+            if not contributor.display_name:
+                contributor.family_name, contributor.display_name = (
+                    contributor.default_names()
+                )
+
+    def recently_resolved(self, contributors, now=None):
+        """Find which of these Contributors were run through VIAF
+        less than VIAF_MAX_AGE ago.
+
+        :return: A set of Contributor IDs.
+        """
+        ids = [x.id for x in contributors if x.id is not None]
+        if not ids:
+            return set()
+        now = now or datetime.datetime.utcnow()
+        qu = self._db.query(ContributorVIAFResolution.contributor_id).filter(
+            ContributorVIAFResolution.contributor_id.in_(ids)
+        ).filter(
+            ContributorVIAFResolution.timestamp > now - self.VIAF_MAX_AGE
+        )
+        return set(contributor_id for [contributor_id] in qu)
+
+    def needs_viaf(self, contributor, now=None):
+        """Has it been a while since this Contributor was run through
+        VIAF?
+        """
+        return contributor.id not in self.recently_resolved(
+            [contributor], now=now
+        )
+
+    def mark_viaf_resolved(self, contributor, now=None):
+        """Note that this Contributor was just run through VIAF."""
+        now = now or datetime.datetime.utcnow()
+        resolution, is_new = get_one_or_create(
+            self._db, ContributorVIAFResolution, contributor_id=contributor.id,
+            create_method_kwargs=dict(timestamp=now)
+        )
+        resolution.timestamp = now
+
+
+class ContributorVIAFResolution(Base):
+    """Records the last time a Contributor was run through VIAF by a
+    ResolveVIAFOnSuccessCoverageProvider.
+    """
+    __tablename__ = 'contributorviafresolutions'
+    id = Column(Integer, primary_key=True)
+    contributor_id = Column(
+        Integer, ForeignKey('contributors.id', ondelete='CASCADE'),
+        nullable=False, unique=True
+    )
+    timestamp = Column(DateTime, nullable=False)
@@ -0,0 +1,163 @@
+"""Shared, pooled HTTP connections for talking to third-party APIs.
+
+Every upstream API client (VIAF, OCLC, Content Cafe, the shadow
+catalog) makes its requests through a single HTTPPool, so connections
+to each host are kept alive and reused instead of paying for a new
+TCP (and TLS) handshake on every lookup.
+"""
+import threading
+from urlparse import urlparse
+
+import requests
+from nose.tools import set_trace
+from requests.adapters import HTTPAdapter
+
+from core.model import ConfigurationSetting
+from core.util.http import HTTP
+
+
+class HTTPPool(object):
+    """A requests Session with a connection pool per host, a default
+    timeout, and a limit on how many requests can be in flight to any
+    one host at a time.
+    """
+
+    # Keep connection pools around for this many different hosts.
+    DEFAULT_HOSTS = 20
+
+    # Keep this many connections open to each host.
+    DEFAULT_POOL_SIZE = 10
+
+    # Give up on a request after this many seconds.
+    DEFAULT_TIMEOUT = 20
+
+    # Allow this many simultaneous requests to any one host.
+    DEFAULT_MAX_CONCURRENT_REQUESTS = 5
+
+    def __init__(self, hosts=None, pool_size=None, timeout=None,
+                 max_concurrent_requests=None, host_limits=None):
+        """Constructor.
+
+        :param hosts: Keep connection pools for this many hosts.
+        :param pool_size: Keep this many connections open to each host.
+        :param timeout: The default timeout for a request, in seconds.
+        :param max_concurrent_requests: By default, allow this many
+            simultaneous requests to any one host.
+        :param host_limits: A dictionary mapping hostnames to the
+            number of simultaneous requests allowed to that host, for
+            hosts that need a different limit from the default.
+        """
+        self.pool_size = pool_size or self.DEFAULT_POOL_SIZE
+        self.timeout = timeout or self.DEFAULT_TIMEOUT
+        self.max_concurrent_requests = (
+            max_concurrent_requests or self.DEFAULT_MAX_CONCURRENT_REQUESTS
+        )
+        self.host_limits = host_limits or {}
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=hosts or self.DEFAULT_HOSTS,
+            pool_maxsize=self.pool_size,
+        )
+        for scheme in ('http://', 'https://'):
+            self.session.mount(scheme, adapter)
+
+        self._host_semaphores = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, url):
+        """Find the semaphore that limits requests to the host of `url`."""
+        host = urlparse(url).netloc.lower()
+        with self._lock:
+            if host not in self._host_semaphores:
+                limit = self.host_limits.get(
+                    host, self.max_concurrent_requests
+                )
+                self._host_semaphores[host] = threading.BoundedSemaphore(
+                    limit
+                )
+            return self._host_semaphores[host]
+
+    def request(self, http_method, url, **kwargs):
+        """Make an HTTP request through the pool.
+
+        This is a drop-in replacement for requests.request.
+        """
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        with self._semaphore(url):
+            return self.session.request(http_method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        """A drop-in replacement for requests.get."""
+        kwargs.setdefault('allow_redirects', True)
+        return self.request("GET", url, **kwargs)
+
+    def get_with_timeout(self, url, *args, **kwargs):
+        """A drop-in replacement for HTTP.get_with_timeout."""
+        return HTTP._request_with_timeout(
+            url, self.request, "GET", url, *args, **kwargs
+        )
+
+    def do_get(self, url, headers=None, **kwargs):
+        """A drop-in replacement for Representation.simple_http_get, for
+        use as the `do_get` argument to Representation.get.
+        """
+        kwargs.setdefault('allow_redirects', True)
+        response = self.request("GET", url, headers=headers, **kwargs)
+        return response.status_code, response.headers, response.content
+
+    def do_get_no_redirect(self, url, headers=None, **kwargs):
+        """A drop-in replacement for Representation.http_get_no_redirect."""
+        kwargs['allow_redirects'] = False
+        return self.do_get(url, headers, **kwargs)
+
+
+# The pool shared by every upstream API client.
+shared = HTTPPool()
+
+# Has the shared pool been configured in this process?
+configured = False
+
+# Site-wide ConfigurationSettings that control the shared pool.
+POOL_SIZE = "http_pool_size"
+TIMEOUT = "http_pool_timeout"
+MAX_CONCURRENT_REQUESTS = "http_pool_max_concurrent_requests"
+
+# A JSON object mapping hostnames to the number of simultaneous
+# requests allowed to each one.
+HOST_LIMITS = "http_pool_host_limits"
+
+
+def configure(**kwargs):
+    """Replace the shared pool with one that has different settings.
+
+    Takes the same arguments as the HTTPPool constructor.
+    """
+    global shared, configured
+    shared = HTTPPool(**kwargs)
+    configured = True
+    return shared
+
+
+def configure_from_database(_db):
+    """Configure the shared pool from the site-wide ConfigurationSettings,
+    unless that's already been done in this process.
+
+    This is called when the web application starts up, and when an
+    upstream API client is created.
+    """
+    if configured:
+        return shared
+    setting = lambda key: ConfigurationSetting.sitewide(_db, key)
+    return configure(
+        pool_size=setting(POOL_SIZE).int_value,
+        timeout=setting(TIMEOUT).int_value,
+        max_concurrent_requests=setting(MAX_CONCURRENT_REQUESTS).int_value,
+        host_limits=setting(HOST_LIMITS).json_value,
+    )
+
+
+def shared_pool():
+    """The pool that upstream API clients should use."""
+    return shared
@@ -1,10 +1,15 @@
+import copy
+from collections import namedtuple
+
 from nose.tools import set_trace
 from sqlalchemy.orm.session import Session
 from core.model import (
     CoverageRecord,
     DataSource,
     ExternalIntegration,
+    Hyperlink,
     PresentationCalculationPolicy,
+    Representation,
 )
 from core.coverage import (
     CatalogCoverageProvider,
@@ -16,6 +21,16 @@ from core.metadata_layer import (
 )
 from core.mirror import MirrorUploader
 
+from cache import annotated_entries
+from coverage_utils import PrefetchesMetadata
+
+# The cover images that will need to be mirrored for an Identifier,
+# found ahead of time so they can be downloaded without going through
+# the database.
+CoverImageDownloads = namedtuple(
+    "CoverImageDownloads", ["type", "identifier", "urls"]
+)
+
 
 class WorkPresentationCoverageProvider(WorkCoverageProvider):
 
@@ -57,6 +72,12 @@ class WorkPresentationCoverageProvider(WorkCoverageProvider):
             default_fiction=None, default_audience=None,
         )
         work.set_presentation_ready(exclude_search=True)
+
+        # The Work's OPDS entries were just regenerated, so any
+        # annotated copies of them are out of date. A process that
+        # doesn't share this cache will notice that the entries
+        # themselves have changed.
+        annotated_entries.invalidate(work)
         return work
 
 
@@ -126,8 +147,8 @@ class CalculatesWorkPresentation(object):
         pass
 
 
-class IntegrationClientCoverImageCoverageProvider(CatalogCoverageProvider,
-    CalculatesWorkPresentation
+class IntegrationClientCoverImageCoverageProvider(PrefetchesMetadata,
+    CatalogCoverageProvider, CalculatesWorkPresentation
 ):
     """Mirrors and scales cover images we heard about from an IntegrationClient."""
 
@@ -159,14 +180,73 @@ class IntegrationClientCoverImageCoverageProvider(CatalogCoverageProvider,
         """Use the collection's name as the data source name."""
         return DataSource.lookup(self._db, self.collection.name, autocreate=True)
 
+    def prefetch_arguments(self, identifier):
+        """Find the cover images that haven't been mirrored yet."""
+        urls = []
+        if self.replacement_policy.mirror:
+            for link in identifier.links:
+                if link.rel != Hyperlink.IMAGE or not link.resource:
+                    continue
+                representation = link.resource.representation
+                if representation and representation.mirror_url:
+                    continue
+                urls.append(link.resource.url)
+        return CoverImageDownloads(identifier.type, identifier.identifier, urls)
+
+    def fetch(self, downloads):
+        """Download the cover images that are about to be mirrored.
+
+        :param downloads: A CoverImageDownloads.
+        :return: A dictionary mapping URLs to the (status, headers,
+            content) responses downloaded from them. An image that
+            can't be downloaded here is left for the mirroring code
+            to deal with.
+        """
+        http_get = (self.replacement_policy.http_get
+                    or Representation.simple_http_get)
+        responses = {}
+        for url in downloads.urls:
+            try:
+                responses[url] = http_get(url, {})
+            except Exception, e:
+                continue
+        return responses
+
     def process_item(self, identifier):
         edition = self.edition(identifier)
         metadata = Metadata.from_edition(edition)
         metadata.apply(edition, self.collection,
-                       replace=self.replacement_policy)
+                       replace=self.policy_for(identifier))
 
         failure = self.register_work_for_calculation(identifier)
         if failure:
             return failure
 
         return identifier
+
+    def policy_for(self, identifier):
+        """The ReplacementPolicy to use when applying metadata for
+        `identifier`. If its cover images were downloaded ahead of
+        time, they're used instead of being downloaded again.
+        """
+        try:
+            responses = self.prefetched_data(identifier)
+        except Exception, e:
+            self.log.error(
+                "Could not prefetch cover images for %r", identifier,
+                exc_info=e
+            )
+            responses = None
+        if not responses:
+            return self.replacement_policy
+
+        original_get = (self.replacement_policy.http_get
+                        or Representation.simple_http_get)
+        def http_get(url, *args, **kwargs):
+            if url in responses:
+                return responses.pop(url)
+            return original_get(url, *args, **kwargs)
+
+        policy = copy.copy(self.replacement_policy)
+        policy.http_get = http_get
+        return policy
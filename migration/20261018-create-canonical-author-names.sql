@@ -0,0 +1,15 @@
+-- Answers given by AuthorNameCanonicalizer used to be stored as
+-- Representations of made-up URLs. They now get their own table,
+-- keyed by the normalized question.
+create table if not exists canonicalauthornames (
+ id serial primary key,
+ urn varchar not null,
+ display_name varchar not null,
+ author_name varchar,
+ timestamp timestamp without time zone not null,
+ unique (urn, display_name)
+);
+
+-- The old answers are cheap to regenerate, so they're not copied over.
+delete from representations
+ where url like 'http://librarysimplified.org/terms/canonical-author-name?%';
@@ -0,0 +1,19 @@
+-- The last time each Contributor was run through VIAF is kept in its
+-- own table, rather than in Contributor.extra.
+create table if not exists contributorviafresolutions (
+ id serial primary key,
+ contributor_id integer not null references contributors(id) on delete cascade,
+ timestamp timestamp without time zone not null,
+ unique (contributor_id)
+);
+
+-- Move over any times that were stored in Contributor.extra.
+insert into contributorviafresolutions (contributor_id, timestamp)
+ select id, (extra->>'viaf_resolved_at')::timestamp
+ from contributors
+ where extra->>'viaf_resolved_at' is not null
+ on conflict (contributor_id) do nothing;
+
+update contributors
+ set extra = (extra::jsonb - 'viaf_resolved_at')::json
+ where extra->>'viaf_resolved_at' is not null;
@@ -0,0 +1,10 @@
+-- VIAF clusters that have been parsed once are stored in their
+-- own table, keyed by VIAF ID, so they don't need to be fetched
+-- from their Representations and parsed again.
+create table if not exists viafclusters (
+ id serial primary key,
+ viaf varchar not null,
+ data json not null,
+ timestamp timestamp without time zone not null,
+ unique (viaf)
+);
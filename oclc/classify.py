@@ -1,5 +1,8 @@
+import datetime
+import isbnlib
 import logging
 import re
+import threading
 import urllib
 
 from lxml import etree
@@ -31,7 +34,19 @@ from core.model import (
 )
 from core.util import MetadataSimilarity
 from core.util.xmlparser import XMLParser
-from coverage_utils import MetadataWranglerBibliographicCoverageProvider
+from concurrency import (
+    run_concurrently,
+    run_pipelined,
+)
+from cache import LRUCache
+from coverage_utils import (
+    MetadataWranglerBibliographicCoverageProvider,
+    PrefetchesMetadata,
+)
+from http_pool import (
+    configure_from_database,
+    shared_pool,
+)
 from viaf import NameParser as VIAFNameParser
 
 class OCLC(object):
@@ -40,6 +55,28 @@ class OCLC(object):
     HOLDING_COUNT = "OCLC.holdings"
     FORMAT = "OCLC.format"
 
+class ClassifyDocument(object):
+    """Everything OCLCClassifyXMLParser needs from an OCLC Classify
+    document, gathered in a single pass over the document.
+    """
+
+    def __init__(self, code=None):
+        # The internal 'status code' of the response.
+        self.code = code
+
+        # A list of IdentifierData for the OCLC Work IDs mentioned.
+        self.owis = []
+
+        # The <author> tags, from which ContributorData can be made.
+        self.author_tags = []
+
+        # A list of SubjectData.
+        self.subjects = []
+
+        # A list of MeasurementData, totalled across every <work> tag.
+        self.measurements = []
+
+
 class OCLCClassifyXMLParser(XMLParser):
     """Turn the output of the OCLC Classify API into a Metadata object
     (if the ISBN identifies a single work) or a list of OCLC Work IDs
@@ -66,6 +103,38 @@ class OCLCClassifyXMLParser(XMLParser):
 
     CLASSIFIERS = {"fast": Subject.FAST, "lcc": Subject.LCC, "ddc": Subject.DDC}
 
+    # Classifier types keep their subjects in either 'heading' or
+    # 'mostPopular' tags. If a classifier has both, the headings win.
+    SUBJECT_TAG_NAMES = ("heading", "mostPopular")
+
+    # XPath expressions, compiled once with the 'oclc' namespace bound.
+    _response = etree.XPath("oclc:response", namespaces=NAMESPACES)
+    _works = etree.XPath("//oclc:work", namespaces=NAMESPACES)
+    _authors = etree.XPath("//oclc:authors/oclc:author", namespaces=NAMESPACES)
+
+    # Fully qualified tag names, for recognizing tags during extract().
+    _tag = "{%s}%%s" % NAMESPACES['oclc']
+    RESPONSE_TAG = _tag % "response"
+    WORK_TAG = _tag % "work"
+    AUTHORS_TAG = _tag % "authors"
+    AUTHOR_TAG = _tag % "author"
+
+    _classifier_tags = {}
+    _subject_tags = {}
+    CLASSIFIER_TAGS = {}
+    SUBJECT_TAGS = {}
+    for _name in CLASSIFIERS:
+        _classifier_tags[_name] = etree.XPath(
+            "//oclc:%s" % _name, namespaces=NAMESPACES
+        )
+        CLASSIFIER_TAGS[_tag % _name] = _name
+        for _item in SUBJECT_TAG_NAMES:
+            _subject_tags[(_name, _item)] = etree.XPath(
+                "//oclc:%s//oclc:%s" % (_name, _item), namespaces=NAMESPACES
+            )
+            SUBJECT_TAGS[_tag % _item] = _item
+    del _tag, _name, _item
+
     @classmethod
     def initial_look_up(cls, tree):
         """Extract the internal 'status code' and any OCLC Work IDs
@@ -75,9 +144,64 @@ class OCLCClassifyXMLParser(XMLParser):
         :return A 2-tuple (code, [owis]). Each item in `owis` is
             an IdentifierData describing an OCLC Work ID.
         """
-        code = int(cls._xpath1(tree, "oclc:response").get('code'))
+        code = int(cls._response(tree)[0].get('code'))
         return code, cls._owi_data(tree)
 
+    @classmethod
+    def extract(cls, tree):
+        """Gather the status code, OCLC Work IDs, <author> tags, subjects
+        and measurements from a preparsed XML document, looking at
+        each relevant tag only once.
+
+        :param tree: An XML document parsed with etree
+        :return: A ClassifyDocument
+        """
+        document = ClassifyDocument()
+        measurements = cls._empty_measurement_data()
+
+        # Subject tags for each classifier, by the kind of tag they are.
+        subject_tags = dict(
+            (name, dict((item, []) for item in cls.SUBJECT_TAG_NAMES))
+            for name in cls.CLASSIFIERS
+        )
+
+        for tag in tree.iter(
+            cls.RESPONSE_TAG, cls.WORK_TAG, cls.AUTHOR_TAG,
+            *cls.SUBJECT_TAGS.keys()
+        ):
+            if tag.tag == cls.WORK_TAG:
+                document.owis.append(
+                    IdentifierData(Identifier.OCLC_WORK, tag.get("owi"))
+                )
+                cls._update_data(tag, measurements)
+            elif tag.tag == cls.AUTHOR_TAG:
+                parent = tag.getparent()
+                if parent is not None and parent.tag == cls.AUTHORS_TAG:
+                    document.author_tags.append(tag)
+            elif tag.tag == cls.RESPONSE_TAG:
+                if document.code is None and tag.get('code') is not None:
+                    document.code = int(tag.get('code'))
+            else:
+                # A subject tag. Which classifier does it belong to?
+                for ancestor in tag.iterancestors():
+                    name = cls.CLASSIFIER_TAGS.get(ancestor.tag)
+                    if name:
+                        item = cls.SUBJECT_TAGS[tag.tag]
+                        subject_tags[name][item].append(tag)
+                        break
+
+        for name in cls.CLASSIFIERS.keys():
+            for item in cls.SUBJECT_TAG_NAMES:
+                tags = subject_tags[name][item]
+                if tags:
+                    document.subjects.extend(
+                        cls.make_subject_data(name, tags)
+                    )
+                    break
+
+        document.measurements = cls.make_measurement_data(measurements)
+        return document
+
     @classmethod
     def _owi_data(cls, tree):
         """Extract OCLC Work IDs from a preparsed XML document.
@@ -86,7 +210,7 @@ class OCLCClassifyXMLParser(XMLParser):
         :return A list of IdentifierData
         """
         results = []
-        tags = cls._xpath(tree, "//oclc:work")
+        tags = cls._works(tree)
 
         owi_numbers = [tag.get("owi") for tag in tags]
         for number in owi_numbers:
@@ -103,28 +227,34 @@ class OCLCClassifyXMLParser(XMLParser):
         :param metadata: A Metadata to be improved with the information
             from the XML document.
         """
+        document = cls.extract(tree)
+
         # If the Metadata already has ContributorData objects, do
         # nothing -- otherwise we're likely to add duplicate or
         # irrelevant information.
         if not metadata.contributors:
-            metadata.contributors = cls.contributors(tree)
+            metadata.contributors = cls._contributors_from_tags(
+                document.author_tags
+            )
 
         # SubjectData and MeasurementData are additive. If two OWIs
         # have the same classification the Metadata should get one
         # SubjectData with the total weight.
 
         # Build a dictionary mapping (type, identifier) to SubjectData,
-        # so that add_subjects() has an easier job.
+        # so that _merge_subjects() has an easier job.
         existing_subjects = dict()
         for subject in metadata.subjects:
             existing_subjects[(subject.type, subject.identifier)] = subject
-        cls.add_subjects(tree, metadata, existing_subjects)
+        cls._merge_subjects(document.subjects, metadata, existing_subjects)
 
-        # Similarly for MeasurementData and add_measurements().
+        # Similarly for MeasurementData and _merge_measurements().
         existing_measurements = dict()
         for measurement in metadata.measurements:
             existing_measurements[measurement.quantity_measured] = measurement
-        cls.add_measurements(tree, metadata, existing_measurements)
+        cls._merge_measurements(
+            document.measurements, metadata, existing_measurements
+        )
 
         return metadata
 
@@ -133,8 +263,12 @@ class OCLCClassifyXMLParser(XMLParser):
     @classmethod
     def contributors(cls, tree):
         """Returns a list of ContributorData objects"""
+        return cls._contributors_from_tags(cls._authors(tree))
+
+    @classmethod
+    def _contributors_from_tags(cls, tags):
+        """Turn a list of <author> tags into ContributorData objects."""
         results = []
-        tags = cls._xpath(tree, "//oclc:authors/oclc:author")
         for tag in tags:
             contributor, default_role_used = NameParser.parse(tag.text)
             results.append(cls._add_lc_viaf(contributor, tag))
@@ -157,8 +291,18 @@ class OCLCClassifyXMLParser(XMLParser):
         """Extract MeasurementData from a parsed XML document
         and update a list of existing MeasurementData.
         """
-        tags = cls._xpath(tree, "//oclc:work")
-        for measurement in cls.get_measurements(tags):
+        tags = cls._works(tree)
+        cls._merge_measurements(
+            cls.get_measurements(tags), metadata, existing_measurements
+        )
+
+    @classmethod
+    def _merge_measurements(cls, measurements, metadata,
+                            existing_measurements):
+        """Add a list of MeasurementData to a Metadata, adding to the
+        value of any MeasurementData it already has.
+        """
+        for measurement in measurements:
             key = measurement.quantity_measured
             if key in existing_measurements:
                 # We don't need another MeasurementData -- just add it to
@@ -188,10 +332,7 @@ class OCLCClassifyXMLParser(XMLParser):
         :param work_tags: A list of preparsed <work> tags.
         :return: A list of MeasurementData objects
         """
-        # Start with all possible values set to zero.
-        data = dict()
-        for rel in set(cls.MEASUREMENT_MAPPING.values()):
-            data[rel] = 0
+        data = cls._empty_measurement_data()
         # In some cases, there are different versions of the book, each
         # listed under a different work tag with its own measurements; for each
         # type of measurement, we need to add up the numbers for each work tag.
@@ -201,6 +342,14 @@ class OCLCClassifyXMLParser(XMLParser):
         measurement_data_objects = cls.make_measurement_data(data)
         return measurement_data_objects
 
+    @classmethod
+    def _empty_measurement_data(cls):
+        """A dictionary of totals, with all possible values set to zero."""
+        data = dict()
+        for rel in set(cls.MEASUREMENT_MAPPING.values()):
+            data[rel] = 0
+        return data
+
     @classmethod
     def _update_data(cls, work_tag, data):
         """Update a dictionary based on integer values found in
@@ -237,6 +386,14 @@ class OCLCClassifyXMLParser(XMLParser):
         """
         classifiers = cls.get_classifier_names_and_parent_tags(tree)
         subjects = cls.get_subjects(classifiers)
+        cls._merge_subjects(subjects, metadata, existing_subjects)
+        return subjects
+
+    @classmethod
+    def _merge_subjects(cls, subjects, metadata, existing_subjects):
+        """Add a list of SubjectData to a Metadata, adding to the
+        weight of any SubjectData it already has.
+        """
         for subject in subjects:
             key = (subject.type, subject.identifier)
             if key in existing_subjects:
@@ -248,8 +405,6 @@ class OCLCClassifyXMLParser(XMLParser):
                 # Metadata.
                 metadata.subjects.append(subject)
 
-        return subjects
-
     @classmethod
     def get_classifier_names_and_parent_tags(cls, tree):
         """Extracts the <ddc>, <lcc>, and <fast> tags from an XML
@@ -260,7 +415,7 @@ class OCLCClassifyXMLParser(XMLParser):
         """
         mapping = dict()
         for name in cls.CLASSIFIERS.keys():
-            tags = cls._xpath(tree, "//oclc:%s" % name)
+            tags = cls._classifier_tags[name](tree)
             if tags:
                 mapping[name] = tags
         return mapping
@@ -299,9 +454,10 @@ class OCLCClassifyXMLParser(XMLParser):
         # Some classifier types use 'heading', some use 'mostPopular'.
         # Try it both ways and see which one works.
         matches = None
-        for item in ("heading", "mostPopular"):
-            search_term = "//oclc:%s//oclc:%s" % (classifier_name, item)
-            matches = cls._xpath(classifier_tag, search_term)
+        for item in cls.SUBJECT_TAG_NAMES:
+            matches = cls._subject_tags[(classifier_name, item)](
+                classifier_tag
+            )
             if matches:
                 break
         return matches
@@ -360,6 +516,10 @@ class NameParser(VIAFNameParser):
 
     ROLES = re.compile("\[([^]]+)\]$")
 
+    # Recently parsed author strings, shared by every lookup in this
+    # process.
+    _parsed = LRUCache(20000)
+
     # Map the roles defined in OCLC Classify to the constants
     # defined in Contributor.
     ROLE_MAPPING = {
@@ -475,14 +635,43 @@ class NameParser(VIAFNameParser):
         the default role, as opposed to that role being
         explicitly specified.
         """
-        string = string.strip()
-        name_without_roles, roles, default_role_used = cls._parse_roles(
+        sort_name, extra, roles, default_role_used = cls.parse_tuple(
             string, default_role
         )
-        contributor = VIAFNameParser.parse(name_without_roles)
-        contributor.roles = roles
+        contributor = ContributorData(sort_name=sort_name, extra=dict(extra))
+        contributor.roles = list(roles)
         return contributor, default_role_used
 
+    @classmethod
+    def parse_tuple(cls, string, default_role=Contributor.AUTHOR_ROLE):
+        """Parse a person's name as found in OCLC Classify, reusing the
+        result if the same string was parsed recently.
+
+        The same author strings show up in document after document,
+        so parse() calls this and builds a new ContributorData from
+        the result rather than running the regular expressions again.
+
+        :return: A 4-tuple (sort_name, extra, roles, default_role_used).
+            `extra` is a tuple of (key, value) 2-tuples, and `roles`
+            is a tuple of Contributor role constants. Nothing in the
+            return value can be modified, so it's safe to share.
+        """
+        key = (string, default_role)
+        parsed = cls._parsed.get(key)
+        if parsed is None:
+            name_without_roles, roles, default_role_used = cls._parse_roles(
+                string.strip(), default_role
+            )
+            contributor = VIAFNameParser.parse(name_without_roles)
+            parsed = (
+                contributor.sort_name,
+                tuple(sorted(contributor.extra.items())),
+                tuple(roles),
+                default_role_used,
+            )
+            cls._parsed.set(key, parsed)
+        return parsed
+
     @classmethod
     def _parse_roles(cls, name, default_role=Contributor.AUTHOR_ROLE):
         """Remove role information from a person's name.
@@ -1064,8 +1253,24 @@ class OCLCClassifyAPI(object):
 
     NO_SUMMARY = '&summary=false'
 
-    def __init__(self, _db):
+    # Remember this many ISBN and OWI documents in memory, so that
+    # an OWI reached through several different ISBNs only needs to
+    # be looked up once.
+    DOCUMENT_CACHE_SIZE = 1000
+
+    def __init__(self, _db, max_age=None):
+        """Constructor.
+
+        :param max_age: Look up an ISBN or OWI again if the document we
+            have for it is older than this (a timedelta or a number of
+            seconds). By default, a document is never looked up twice.
+        """
         self._db = _db
+        configure_from_database(_db)
+        if isinstance(max_age, datetime.timedelta):
+            max_age = max_age.total_seconds()
+        self.max_age = max_age
+        self.documents = LRUCache(self.DOCUMENT_CACHE_SIZE, ttl=max_age)
 
     @property
     def source(self):
@@ -1079,42 +1284,217 @@ class OCLCClassifyAPI(object):
             args[k] = v
         return urllib.urlencode(sorted(args.items()))
 
+    @classmethod
+    def normalize_query(cls, **kwargs):
+        """Remove insignificant differences between lookups, so that
+        the same question is always asked (and stored) the same way.
+
+        ISBN-10s are converted to ISBN-13s, and the summary flag is
+        always 'true' or 'false'.
+        """
+        query = dict(kwargs)
+        isbn = query.get('isbn')
+        if isbn:
+            query['isbn'] = isbnlib.to_isbn13(isbn) or isbn
+        owi = query.get('owi')
+        if owi:
+            query['owi'] = owi.strip()
+        if query.get('summary') is not None:
+            summary = str(query['summary']).lower()
+            if summary in ('false', '0', 'no'):
+                query['summary'] = 'false'
+            else:
+                query['summary'] = 'true'
+        return query
+
+    @classmethod
+    def cache_key(cls, **kwargs):
+        """The key under which the document for an ISBN or OWI lookup
+        is cached.
+
+        :return: A 3-tuple (query type, ISBN-13 or OWI, summary flag),
+            or None if this isn't an ISBN or OWI lookup.
+        """
+        query = cls.normalize_query(**kwargs)
+        summary = query.pop('summary', None)
+        if len(query) != 1:
+            return None
+        [(query_type, value)] = query.items()
+        if query_type not in ('isbn', 'owi'):
+            return None
+        return (query_type, value, summary)
+
+    def url_for(self, **kwargs):
+        """The URL to a Classify lookup."""
+        return self.BASE_URL + self.query_string(
+            **self.normalize_query(**kwargs)
+        )
+
+    def cached(self, **kwargs):
+        """Find the document for an ISBN or OWI lookup, if it was looked
+        up recently.
+
+        :return: A document, or None.
+        """
+        key = self.cache_key(**kwargs)
+        if not key:
+            return None
+        return self.documents.get(key)
+
     def lookup_by(self, **kwargs):
         """Perform an OCLC Classify lookup."""
-        query_string = self.query_string(**kwargs)
-        url = self.BASE_URL + query_string
-        return self._make_request(url)
+        return self._lookup(kwargs, self.url_for(**kwargs))
+
+    def _lookup(self, query, url, do_get=None):
+        """Perform a lookup, using the in-memory document cache when
+        possible.
+        """
+        key = self.cache_key(**query)
+        if key:
+            content = self.documents.get(key)
+            if content is not None:
+                return content
+        content = self._make_request(url, do_get)
+        if key and content is not None:
+            self.documents.set(key, content)
+        return content
+
+    def lookup_by_many(self, queries, workers=1):
+        """Perform a number of OCLC Classify lookups, with up to `workers`
+        requests in flight at once.
+
+        :param queries: A list of dictionaries, each containing the
+            keyword arguments for one call to lookup_by().
+        :return: A list of responses, in the same order as `queries`.
+        """
+        urls = [self.url_for(**query) for query in queries]
+        to_fetch = [
+            url for query, url in zip(queries, urls)
+            if self.cached(**query) is None
+        ]
+        prefetched = self.prefetch(to_fetch, workers)
+        return [
+            self._lookup(query, url, prefetched.get(url))
+            for query, url in zip(queries, urls)
+        ]
+
+    def prefetch(self, urls, workers, do_get=None):
+        """Concurrently fetch whichever of `urls` don't already have
+        Representations.
+
+        This happens outside the database session, so the responses
+        still need to be stored by passing them into
+        Representation.get.
+
+        :return: A dictionary mapping URLs to functions that can be
+            passed into Representation.get as `do_get`.
+        """
+        do_get = do_get or shared_pool().do_get
+        cached = self.stored_documents(urls)
+        to_fetch = []
+        for url in urls:
+            if url not in cached and url not in to_fetch:
+                to_fetch.append(url)
+
+        responses = run_concurrently(
+            lambda url: self.fetch(url, do_get), to_fetch, workers
+        )
 
-    def _make_request(self, url):
-        representation, cached = Representation.get(self._db, url)
+        prefetched = dict()
+        for url, (response, exception) in zip(to_fetch, responses):
+            prefetched[url] = self._prefetched_get(response, exception)
+        return prefetched
+
+    def stored_documents(self, urls):
+        """Find the documents already stored for any of `urls`, leaving
+        out any that are older than `self.max_age`.
+
+        :return: A dictionary mapping URLs to documents.
+        """
+        query = self._db.query(
+            Representation.url, Representation.content
+        ).filter(
+            Representation.url.in_(urls)
+        ).filter(Representation.content != None)
+        if self.max_age is not None:
+            cutoff = datetime.datetime.utcnow() - datetime.timedelta(
+                seconds=self.max_age
+            )
+            query = query.filter(Representation.fetched_at >= cutoff)
+        return dict(query)
+
+    def fetch(self, url, do_get=None):
+        """Make an HTTP request to Classify without going through the
+        database.
+
+        :return: A 2-tuple (response, exception). `response` is a
+            (status, headers, content) 3-tuple, or None if the request
+            raised `exception`.
+        """
+        do_get = do_get or shared_pool().do_get
+        try:
+            return do_get(url, {}), None
+        except Exception, e:
+            return None, e
+
+    def store(self, url, response, exception=None):
+        """Store a response obtained through fetch() as a
+        Representation, so lookup_by() will find it.
+        """
+        Representation.get(
+            self._db, url, do_get=self._prefetched_get(response, exception)
+        )
+
+    @classmethod
+    def _prefetched_get(cls, response, exception):
+        def do_get(*args, **kwargs):
+            if exception:
+                raise exception
+            return response
+        return do_get
+
+    def _make_request(self, url, do_get=None):
+        representation, cached = Representation.get(
+            self._db, url, do_get=do_get or shared_pool().do_get,
+            max_age=self.max_age
+        )
         return representation.content
 
 
 class MockOCLCClassifyAPI(OCLCClassifyAPI):
 
-    def __init__(self, _db):
-        super(MockOCLCClassifyAPI, self).__init__(_db)
+    def __init__(self, _db, max_age=None):
+        super(MockOCLCClassifyAPI, self).__init__(_db, max_age=max_age)
         self.requests = []
         self.responses = []
 
     def queue_response(self, content):
         self.responses.append(content)
 
-    def _make_request(self, url):
+    def prefetch(self, urls, workers, do_get=None):
+        return {}
+
+    def _make_request(self, url, do_get=None):
         self.requests.append(url)
         return self.responses.pop(0)
 
 
 class OCLCLookupCoverageProvider(MetadataWranglerBibliographicCoverageProvider):
 
-    def __init__(self, collection, api=None, **kwargs):
+    def __init__(self, collection, api=None, max_age=None, **kwargs):
+        """Constructor.
+
+        :param max_age: Look up an ISBN or OWI again if the Classify
+            document we have for it is older than this.
+        """
         super(OCLCLookupCoverageProvider, self).__init__(
             collection, registered_only=True, **kwargs
         )
-        self.api = api or OCLCClassifyAPI(self._db)
+        self.api = api or OCLCClassifyAPI(self._db, max_age=max_age)
 
 
-class IdentifierLookupCoverageProvider(OCLCLookupCoverageProvider):
+class IdentifierLookupCoverageProvider(PrefetchesMetadata,
+                                       OCLCLookupCoverageProvider):
     """Does identifier (specifically, ISBN) lookups using OCLC Classify.
     """
     SERVICE_NAME = "OCLC Classify Identifier Lookup"
@@ -1123,11 +1503,186 @@ class IdentifierLookupCoverageProvider(OCLCLookupCoverageProvider):
 
     parser = OCLCClassifyXMLParser()
 
+    # Look up this many OWIs at once when an ISBN turns out to be
+    # associated with more than one.
+    OWI_WORKERS = 5
+
+    # By default, ISBNs are looked up one at a time.
+    DEFAULT_WORKERS = 1
+
+    def __init__(self, collection, api=None, workers=None, **kwargs):
+        """Constructor.
+
+        :param workers: Download the Classify documents for this
+            many ISBNs at once. If this is more than 1, each batch is
+            processed as a pipeline: documents for later ISBNs are
+            downloaded while documents for earlier ISBNs are parsed and
+            applied to the database.
+        """
+        super(IdentifierLookupCoverageProvider, self).__init__(
+            collection, api=api, **kwargs
+        )
+        self.workers = workers or self.DEFAULT_WORKERS
+        self._downloads = None
+        self._owi_lock = threading.Lock()
+
+    def process_batch(self, identifiers):
+        """Process a batch of ISBNs, downloading documents for up to
+        `self.workers` of them in the background.
+
+        All database work still happens in this thread, in the same
+        order and the same transaction as it would otherwise.
+        """
+        if self.workers > 1 and len(identifiers) > 1:
+            self._downloads = self.start_downloads(identifiers)
+        try:
+            return super(IdentifierLookupCoverageProvider, self).process_batch(
+                identifiers
+            )
+        finally:
+            self._downloads = None
+
+    def start_downloads(self, identifiers):
+        """Start downloading the Classify documents for `identifiers`
+        in background threads.
+
+        The download threads are only given (type, identifier)
+        2-tuples and URLs, never the Identifiers themselves, so they
+        can't trigger a lazy load through this thread's session.
+
+        :return: A generator of ((type, identifier), responses)
+            2-tuples, in the same order as `identifiers`. `responses`
+            maps URLs to the (status, headers, content) responses
+            downloaded from them.
+        """
+        jobs = [
+            ((identifier.type, identifier.identifier),
+             self.api.url_for(isbn=identifier.identifier))
+            for identifier in identifiers
+        ]
+
+        # Documents we've already got don't need to be downloaded
+        # again, but multi-work documents still need to be read to
+        # find out which OWIs to download.
+        cached = self.api.stored_documents([url for key, url in jobs])
+
+        # OWIs that one of the download threads has already taken
+        # responsibility for.
+        claimed_owis = set()
+
+        def download(job):
+            key, url = job
+            return key, self.download(url, cached.get(url), claimed_owis)
+        return run_pipelined(download, jobs, self.workers)
+
+    def claim_owi(self, owi, claimed_owis):
+        """Make sure only one download thread fetches the document for
+        a given OWI.
+
+        :param claimed_owis: A set of the OWIs already claimed, shared
+            between threads.
+        :return: True if the calling thread should fetch the document;
+            False if another thread has claimed it, or it's already
+            known.
+        """
+        with self._owi_lock:
+            if owi in claimed_owis:
+                return False
+            claimed_owis.add(owi)
+        return self.api.cached(owi=owi) is None
+
+    def download(self, url, content=None, claimed_owis=None):
+        """Download the Classify document at `url`, and the document for
+        each OWI it mentions, if it turns out to be a multi-work
+        response. This doesn't touch the database.
+
+        :param content: The document at `url`, if it's already known.
+        :param claimed_owis: A set of OWIs that other download threads
+            have already fetched or are fetching. OWIs fetched by this
+            call will be added to it.
+        :return: A dictionary mapping URLs to the (status, headers,
+            content) responses successfully downloaded from them.
+            Anything that can't be downloaded here is left for
+            process_item() to deal with.
+        """
+        responses = {}
+        if content is None:
+            response, exception = self.api.fetch(url)
+            if exception or response[0] != 200:
+                return responses
+            responses[url] = response
+            content = response[2]
+
+        try:
+            tree = etree.fromstring(
+                content, parser=etree.XMLParser(recover=True)
+            )
+            code, owi_data = self.parser.initial_look_up(tree)
+        except Exception, e:
+            return responses
+        if code != self.parser.MULTI_WORK_STATUS:
+            return responses
+
+        if claimed_owis is None:
+            claimed_owis = set()
+        for item in owi_data:
+            if not self.claim_owi(item.identifier, claimed_owis):
+                # Another ISBN already led us to this OWI.
+                continue
+            owi_url = self.api.url_for(owi=item.identifier)
+            response, exception = self.api.fetch(owi_url)
+            if not exception and response[0] == 200:
+                responses[owi_url] = response
+        return responses
+
+    def fetch(self, identifier):
+        """Download the Classify documents for an ISBN, without touching
+        the database.
+
+        Only the in-memory document cache is consulted, so a document
+        that's only stored as a Representation may be downloaded
+        again.
+
+        :return: A dictionary mapping URLs to responses, as download()
+            returns.
+        """
+        isbn = identifier.identifier
+        return self.download(
+            self.api.url_for(isbn=isbn), self.api.cached(isbn=isbn)
+        )
+
+    def store_downloads(self, identifier):
+        """Store any documents downloaded in the background for
+        `identifier` as Representations, so that looking up the
+        identifier won't have to wait on the network.
+        """
+        for url, response in (self.prefetched_data(identifier) or {}).items():
+            self.api.store(url, response)
+
+        if not self._downloads:
+            return
+        key = (identifier.type, identifier.identifier)
+        for downloaded_for, responses in self._downloads:
+            for url, response in responses.items():
+                self.api.store(url, response)
+            if downloaded_for == key:
+                break
+
     def _get_tree(self, **kwargs):
         """Look up either an ISBN or an OWI, and return a tree generated from the resulting XML."""
         xml = self.api.lookup_by(**kwargs)
         return etree.fromstring(xml, parser=etree.XMLParser(recover=True))
 
+    def _get_trees(self, queries):
+        """Perform several lookups concurrently, and return the trees
+        generated from the resulting XML in the same order as `queries`.
+        """
+        documents = self.api.lookup_by_many(queries, self.OWI_WORKERS)
+        return [
+            etree.fromstring(xml, parser=etree.XMLParser(recover=True))
+            for xml in documents
+        ]
+
     def process_item(self, identifier):
         """Ask OCLC Classify about a single ISBN. Create an Edition based on
         what it says. This may involve consolidating information from
@@ -1143,6 +1698,8 @@ class IdentifierLookupCoverageProvider(OCLCLookupCoverageProvider):
         """
         metadata_list = []
         failure = None
+        self.store_downloads(identifier)
+
 
         # Start with an empty Metadata. We're going to fill this out.
         metadata = Metadata(
@@ -1177,10 +1734,13 @@ class IdentifierLookupCoverageProvider(OCLCLookupCoverageProvider):
 
         Instead, for each <work> tag, we get a more complete document
         by looking up the OWI, and annotate `metadata` based on
-        that.
+        that. The lookups happen concurrently, but the documents are
+        applied to `metadata` in the order the OWIs were listed.
         """
-        for item in owi_data:
-            tree_from_owi = self._get_tree(owi=item.identifier)
+        trees = self._get_trees(
+            [dict(owi=item.identifier) for item in owi_data]
+        )
+        for tree_from_owi in trees:
             metadata = self.parser.parse(tree_from_owi, metadata)
         return metadata
 
@@ -39,6 +39,10 @@ from core.util import (
 )
 
 from coverage_utils import ResolveVIAFOnSuccessCoverageProvider
+from http_pool import (
+    configure_from_database,
+    shared_pool,
+)
 from viaf import VIAFClient
 
 
@@ -176,6 +180,7 @@ class OCLCLinkedData(object):
 
     def __init__(self, _db):
         self._db = _db
+        configure_from_database(_db)
         self.log = logging.getLogger("OCLC Linked Data")
 
 
@@ -222,7 +227,10 @@ class OCLCLinkedData(object):
         return self.get_jsonld(url)
 
     def get_jsonld(self, url):
-        representation, cached = Representation.get(self._db, url)
+        do_get = shared_pool().do_get
+        representation, cached = Representation.get(
+            self._db, url, do_get=do_get
+        )
         try:
             data = jsonld.load_document(url)
         except Exception as e:
@@ -231,7 +239,7 @@ class OCLCLinkedData(object):
 
         if cached and not representation.content:
             representation, cached = Representation.get(
-                self._db, url, max_age=0)
+                self._db, url, do_get=do_get, max_age=0)
 
         if not representation.content:
             return None, False
@@ -247,7 +255,7 @@ class OCLCLinkedData(object):
         """Turn an ISBN identifier into an OCLC Number identifier."""
         url = self.ISBN_BASE_URL % dict(id=isbn.identifier)
         representation, cached = Representation.get(
-            self._db, url, Representation.http_get_no_redirect)
+            self._db, url, shared_pool().do_get_no_redirect)
         if not representation.location:
             raise IOError(
                 "Expected %s to redirect, but couldn't find location." % url
@@ -1,3 +1,6 @@
+import json
+from collections import namedtuple
+
 from nose.tools import set_trace
 from sqlalchemy.orm.session import Session
 
@@ -13,14 +16,26 @@ from core.model import (
 from core.metadata_layer import ReplacementPolicy
 from core.overdrive import (
     OverdriveBibliographicCoverageProvider as BaseOverdriveBibliographicCoverageProvider,
-    OverdriveAPI
+    OverdriveAPI,
+    OverdriveRepresentationExtractor,
 )
 from core.mirror import MirrorUploader
 
-from coverage_utils import ResolveVIAFOnSuccessCoverageProvider
+from coverage_utils import (
+    PrefetchesMetadata,
+    ResolveVIAFOnSuccessCoverageProvider,
+)
 from viaf import VIAFClient
 
+# Everything needed to look up an Overdrive ID without going through
+# the database.
+OverdriveMetadataLookup = namedtuple(
+    "OverdriveMetadataLookup",
+    ["type", "identifier", "collection_token", "token"]
+)
+
 class OverdriveBibliographicCoverageProvider(
+        PrefetchesMetadata,
         ResolveVIAFOnSuccessCoverageProvider,
         BaseOverdriveBibliographicCoverageProvider,
 ):
@@ -108,6 +123,64 @@ class OverdriveBibliographicCoverageProvider(
         )
         return qu
 
+    def prefetch_arguments(self, identifier):
+        """Make sure the API has a current bearer token and knows its
+        collection token, so fetch() doesn't need the database to
+        find them.
+        """
+        self.api.check_creds()
+        return OverdriveMetadataLookup(
+            identifier.type, identifier.identifier,
+            self.api.collection_token, self.api.token
+        )
+
+    def fetch(self, lookup):
+        """Ask Overdrive for the metadata about a book.
+
+        :param lookup: An OverdriveMetadataLookup.
+        :return: A dictionary of book info, or None if Overdrive
+            didn't provide any. In that case process_item() will look
+            the book up again through the API, which knows how to
+            handle errors and expired credentials.
+        """
+        url = self.api.METADATA_ENDPOINT % dict(
+            collection_token=lookup.collection_token,
+            item_id=lookup.identifier
+        )
+        status, headers, content = self.api._do_get(
+            url, dict(Authorization="Bearer %s" % lookup.token)
+        )
+        if status != 200:
+            return None
+        info = json.loads(content)
+        if info.get('errorCode'):
+            return None
+        return info
+
+    def process_item(self, identifier):
+        """Apply the metadata prefetched for an Overdrive ID, or look it
+        up the usual way if there isn't any.
+        """
+        try:
+            info = self.prefetched_data(identifier)
+        except Exception, e:
+            self.log.error(
+                "Could not prefetch Overdrive data for %r", identifier,
+                exc_info=e
+            )
+            info = None
+        if not info:
+            return super(
+                OverdriveBibliographicCoverageProvider, self
+            ).process_item(identifier)
+
+        metadata = OverdriveRepresentationExtractor.book_info_to_metadata(info)
+        if not metadata:
+            e = "Could not extract metadata from Overdrive data: %r" % info
+            return self.failure(identifier, e)
+        self.metadata_pre_hook(metadata)
+        return self.set_metadata(identifier, metadata)
+
     def metadata_pre_hook(self, metadata):
         """If we happened to get any circulation data, because this item
         is in the default Overdrive collection, wipe it out. We're not
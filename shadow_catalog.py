@@ -1,7 +1,6 @@
 """Interface to NYPL's shadow catalog API."""
 from collections import defaultdict
 import json
-import requests
 import re
 from nose.tools import set_trace
 
@@ -20,6 +19,8 @@ from core.metadata_layer import (
     IdentifierData,
 )
 
+from http_pool import shared_pool
+
 class ShadowCatalogAPI(object):
 
     SERVICE_NAME = "Shadowcat"
@@ -121,7 +122,7 @@ class ShadowCatalogAPI(object):
 
     def lookup(self, type, identifier):
         url = self.url(type, identifier)
-        response = requests.get(url)
+        response = shared_pool().get(url)
         return Representation.to_metadata(json.loads(response.content))
 
 
@@ -7,6 +7,12 @@ from core.testing import (
     package_setup,
 )
 
+# Tables defined by this application must be registered before the
+# test database is created.
+import canonicalize
+import coverage_utils
+import viaf
+
 package_setup()
 
 def sample_data(filename, sample_data_dir):
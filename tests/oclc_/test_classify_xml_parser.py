@@ -105,3 +105,41 @@ class TestOCLCClassifyXMLParser(DatabaseTest):
         eq_([32058, 31482, 29933, 19086, 18913, 17294, 6893, 4512], [x.weight for x in fasts])
         eq_(['Whaling', 'Whales', 'Ahab, Captain (Fictitious character)', 'Ship captains', 'Whaling ships', 'Mentally ill', 'Sea stories', 'Moby Dick (Melville, Herman)'],
             [x.name for x in fasts])
+
+    def test_extract_matches_individual_lookups(self):
+        # The single-pass extract() finds the same information as the
+        # methods that look for each kind of information separately.
+        def subjects(l):
+            return [(x.type, x.identifier, x.name, x.weight) for x in l]
+        def measurements(l):
+            return sorted((x.quantity_measured, x.value) for x in l)
+
+        for filename in (
+            "jane_eyre.xml",
+            "missing_pswid.xml",
+            "multi_work_with_owis.xml",
+            "single_work_48446512.xml",
+            "single_work_48525129.xml",
+            "single_work_no_authors.xml",
+            "single_work_response.xml",
+            "single_work_with_isbn.xml",
+        ):
+            tree = self.tree(filename)
+            document = self.parser.extract(tree)
+
+            code, owis = self.parser.initial_look_up(tree)
+            eq_(code, document.code)
+            eq_([x.identifier for x in owis],
+                [x.identifier for x in document.owis])
+
+            eq_(self.parser._authors(tree), document.author_tags)
+
+            classifiers = self.parser.get_classifier_names_and_parent_tags(
+                tree
+            )
+            eq_(subjects(self.parser.get_subjects(classifiers)),
+                subjects(document.subjects))
+
+            eq_(measurements(
+                self.parser.get_measurements(self.parser._works(tree))
+            ), measurements(document.measurements))
@@ -1,17 +1,29 @@
 # encoding: utf-8
 
+import datetime
 import json
-from nose.tools import set_trace, eq_
+from nose.tools import (
+    assert_raises_regexp,
+    eq_,
+    set_trace,
+)
 from .. import (
     DatabaseTest,
     sample_data
 )
 from lxml import etree
 from core.coverage import CoverageFailure
-from core.model import Contributor, Identifier, Measurement
+from core.model import (
+    get_one,
+    Contributor,
+    Identifier,
+    Measurement,
+    Representation,
+)
 from core.metadata_layer import *
 from oclc.classify import (
     IdentifierLookupCoverageProvider,
+    OCLCClassifyAPI,
     OCLCClassifyXMLParser,
     MockOCLCClassifyAPI,
 )
@@ -132,6 +144,122 @@ class TestIdentifierLookupCoverageProvider(DatabaseTest):
         assert isinstance(failure, CoverageFailure)
         eq_(failure.exception, "The work with ISBN 9781429984171 was not found.")
 
+    def test_download(self):
+        # download() gets the document for an ISBN and, if it's a
+        # multi-work response, the documents for each of its OWIs.
+        class Mock(OCLCClassifyAPI):
+            fetched = []
+            def fetch(self, url, do_get=None):
+                self.fetched.append(url)
+                if 'isbn' in url:
+                    filename = "multi_work_with_owis.xml"
+                else:
+                    filename = "single_work_48446512.xml"
+                return (200, {}, sample_data(filename, "oclc_classify")), None
+
+        api = Mock(self._db)
+        provider = IdentifierLookupCoverageProvider(
+            self._default_collection, api=api, workers=2
+        )
+        url = api.url_for(isbn=self.MULTI_ISBN)
+        responses = provider.download(url)
+        owi_urls = [api.url_for(owi="48446512"), api.url_for(owi="48525129")]
+        eq_([url] + owi_urls, api.fetched)
+        eq_(set([url] + owi_urls), set(responses.keys()))
+
+        # If the ISBN document is already known, it's not downloaded
+        # again, but the OWIs it mentions still are.
+        api.fetched[:] = []
+        xml = sample_data("multi_work_with_owis.xml", "oclc_classify")
+        responses = provider.download(url, xml)
+        eq_(owi_urls, api.fetched)
+        eq_(set(owi_urls), set(responses.keys()))
+
+        # An OWI that another download has already claimed isn't
+        # downloaded again, even though its document hasn't made it
+        # to the API yet.
+        api.fetched[:] = []
+        claimed = set(["48446512"])
+        responses = provider.download(url, xml, claimed)
+        eq_([owi_urls[1]], api.fetched)
+        eq_(set(["48446512", "48525129"]), claimed)
+
+        # A second download that mentions the same OWIs doesn't fetch
+        # anything.
+        api.fetched[:] = []
+        eq_({}, provider.download(url, xml, claimed))
+        eq_([], api.fetched)
+
+    def test_fetch(self):
+        # fetch() downloads the same documents as download(), so that
+        # they can be prefetched during immediate resolution.
+        class Mock(IdentifierLookupCoverageProvider):
+            def download(self, url, content=None, claimed_owis=None):
+                self.downloaded = (url, content)
+                return {url: (200, {}, "<doc/>")}
+        provider = Mock(self._default_collection)
+        data = IdentifierData(Identifier.ISBN, self.SINGLE_ISBN)
+        url = provider.api.url_for(isbn=self.SINGLE_ISBN)
+        eq_({url: (200, {}, "<doc/>")}, provider.fetch(data))
+        eq_((url, None), provider.downloaded)
+
+        # A document that's already in memory isn't downloaded again.
+        provider.api.documents.set(
+            provider.api.cache_key(isbn=self.SINGLE_ISBN), "<cached/>"
+        )
+        provider.fetch(data)
+        eq_((url, "<cached/>"), provider.downloaded)
+
+    def test_store_downloads_stores_prefetched_documents(self):
+        provider = IdentifierLookupCoverageProvider(self._default_collection)
+        identifier = self._id("single")
+        url = provider.api.url_for(isbn=identifier.identifier)
+        provider._prefetched[provider.prefetch_key(identifier)] = {
+            url: (200, {"content-type": "text/xml"}, "<one/>")
+        }
+        provider.store_downloads(identifier)
+        eq_("<one/>", get_one(self._db, Representation, url=url).content)
+        eq_({}, provider._prefetched)
+
+    def test_start_downloads(self):
+        # The download threads are given URLs and (type, identifier)
+        # 2-tuples, not Identifiers.
+        class Mock(IdentifierLookupCoverageProvider):
+            def download(self, url, content=None, claimed_owis=None):
+                return {url: (200, {}, "<doc/>")}
+        provider = Mock(self._default_collection, workers=2)
+        id1, id2 = self._id("single"), self._id("multi")
+        url1 = provider.api.url_for(isbn=id1.identifier)
+        url2 = provider.api.url_for(isbn=id2.identifier)
+
+        downloads = list(provider.start_downloads([id1, id2]))
+        eq_([((id1.type, id1.identifier), {url1: (200, {}, "<doc/>")}),
+             ((id2.type, id2.identifier), {url2: (200, {}, "<doc/>")})],
+            downloads)
+
+    def test_store_downloads(self):
+        # Documents downloaded in the background are stored as
+        # Representations before each identifier is processed.
+        provider = IdentifierLookupCoverageProvider(
+            self._default_collection, workers=2
+        )
+        id1, id2 = self._id("single"), self._id("multi")
+        url1 = provider.api.url_for(isbn=id1.identifier)
+        url2 = provider.api.url_for(isbn=id2.identifier)
+        provider._downloads = iter([
+            ((id1.type, id1.identifier),
+             {url1: (200, {"content-type": "text/xml"}, "<one/>")}),
+            ((id2.type, id2.identifier),
+             {url2: (200, {"content-type": "text/xml"}, "<two/>")}),
+        ])
+
+        provider.store_downloads(id1)
+        eq_("<one/>", get_one(self._db, Representation, url=url1).content)
+        eq_(None, get_one(self._db, Representation, url=url2))
+
+        provider.store_downloads(id2)
+        eq_("<two/>", get_one(self._db, Representation, url=url2).content)
+
     def test__apply_propagates_replacement_policy(self):
         # When IdentifierLookupCoverageProvider applies metadata
         # to the database, it uses the replacement policy associated with
@@ -346,3 +474,116 @@ class TestIdentifierLookupCoverageProvider(DatabaseTest):
             primary_identifier=identifier
         )
         return metadata
+
+
+class TestOCLCClassifyAPI(DatabaseTest):
+
+    def test_prefetch(self):
+        api = OCLCClassifyAPI(self._db)
+        cached_url = api.BASE_URL + api.query_string(owi="1")
+        new_url = api.BASE_URL + api.query_string(owi="2")
+        broken_url = api.BASE_URL + api.query_string(owi="3")
+        representation, ignore = self._representation(
+            url=cached_url, content="<cached/>"
+        )
+
+        fetched = []
+        def do_get(url, headers, **kwargs):
+            fetched.append(url)
+            if url == broken_url:
+                raise IOError("no luck")
+            return 200, {"content-type": "text/xml"}, "<new/>"
+
+        prefetched = api.prefetch(
+            [cached_url, new_url, broken_url, new_url], 3, do_get=do_get
+        )
+
+        # The URL that already had a Representation wasn't fetched,
+        # and the URL that was requested twice was only fetched once.
+        eq_(sorted([new_url, broken_url]), sorted(fetched))
+        eq_(set([new_url, broken_url]), set(prefetched.keys()))
+
+        # The responses are handed over through functions that can
+        # be passed into Representation.get.
+        eq_((200, {"content-type": "text/xml"}, "<new/>"),
+            prefetched[new_url](new_url, {}))
+        assert_raises_regexp(
+            IOError, "no luck", prefetched[broken_url], broken_url, {}
+        )
+
+    def test_normalize_query(self):
+        m = OCLCClassifyAPI.normalize_query
+        eq_(dict(isbn="9780345391834"), m(isbn="0345391837"))
+        eq_(dict(isbn="9780345391834"), m(isbn="9780345391834"))
+        eq_(dict(owi="48446512", summary="false"),
+            m(owi=" 48446512", summary=False))
+        eq_(dict(title="A Title"), m(title="A Title"))
+
+        # ISBN-10s and ISBN-13s for the same book are asked about
+        # the same way.
+        api = OCLCClassifyAPI(self._db)
+        eq_(api.url_for(isbn="9780345391834"), api.url_for(isbn="0345391837"))
+
+    def test_cache_key(self):
+        k = OCLCClassifyAPI.cache_key
+        eq_(("isbn", "9780345391834", None), k(isbn="0345391837"))
+        eq_(("owi", "48446512", "true"), k(owi="48446512", summary="True"))
+
+        # Other kinds of lookups aren't cached in memory.
+        eq_(None, k(title="A Title", author="An Author"))
+        eq_(None, k(wi="12345"))
+
+    def test_lookup_by_reuses_recent_documents(self):
+        api = MockOCLCClassifyAPI(self._db)
+        api.queue_response("<isbn/>")
+        api.queue_response("<owi/>")
+        eq_("<isbn/>", api.lookup_by(isbn="0345391837"))
+        eq_("<isbn/>", api.lookup_by(isbn="9780345391834"))
+
+        # Both lookups were for the same book, so only one request
+        # was made.
+        eq_([api.BASE_URL + "isbn=9780345391834"], api.requests)
+
+        # The same goes for an OWI looked up individually and as part
+        # of a group.
+        eq_("<owi/>", api.lookup_by(owi="48446512"))
+        eq_(["<owi/>"], api.lookup_by_many([dict(owi="48446512")]))
+        eq_(2, len(api.requests))
+
+    def test_max_age(self):
+        api = OCLCClassifyAPI(self._db, max_age=datetime.timedelta(days=1))
+        eq_(24*60*60, api.max_age)
+        eq_(24*60*60, api.documents.ttl)
+
+        # Stored documents that are too old are ignored.
+        fresh, ignore = self._representation(
+            url=api.url_for(owi="1"), content="<fresh/>"
+        )
+        stale, ignore = self._representation(
+            url=api.url_for(owi="2"), content="<stale/>"
+        )
+        fresh.fetched_at = datetime.datetime.utcnow()
+        stale.fetched_at = (
+            datetime.datetime.utcnow() - datetime.timedelta(days=2)
+        )
+        eq_({fresh.url: "<fresh/>"},
+            api.stored_documents([fresh.url, stale.url]))
+
+    def test_lookup_by_many(self):
+        class Mock(OCLCClassifyAPI):
+            def prefetch(self, urls, workers):
+                self.prefetched = (urls, workers)
+                return dict((url, "do_get for %s" % url) for url in urls)
+
+            def _make_request(self, url, do_get=None):
+                return (url, do_get)
+
+        api = Mock(self._db)
+        results = api.lookup_by_many([dict(owi="2"), dict(owi="1")], 4)
+
+        # Responses come back in the order the queries were made.
+        url2 = api.BASE_URL + "owi=2"
+        url1 = api.BASE_URL + "owi=1"
+        eq_(([url2, url1], 4), api.prefetched)
+        eq_([(url2, "do_get for %s" % url2), (url1, "do_get for %s" % url1)],
+            results)
@@ -158,3 +158,34 @@ class TestNameParser(object):
         )
         eq_(False, default_role_used)
         eq_([Contributor.UNKNOWN_ROLE], contributor.roles)
+
+    def test_parse_is_memoized(self):
+        NameParser._parsed.clear()
+        string = "Austen, Jane, 1775-1817 [Author]"
+        parsed = NameParser.parse_tuple(string)
+        eq_(("Austen, Jane",
+             ((Contributor.BIRTH_DATE, "1775"),
+              (Contributor.DEATH_DATE, "1817")),
+             (Contributor.AUTHOR_ROLE,),
+             False),
+            parsed)
+
+        # The second time the string is parsed, the same tuple comes
+        # back from the cache.
+        assert NameParser.parse_tuple(string) is parsed
+        eq_(1, len(NameParser._parsed))
+
+        # parse() always builds a fresh ContributorData, so changing
+        # one doesn't affect what the next caller gets.
+        austen, default_role_used = NameParser.parse(string)
+        austen.roles.append(Contributor.EDITOR_ROLE)
+        austen.extra['foo'] = 'bar'
+        austen2, default_role_used = NameParser.parse(string)
+        eq_([Contributor.AUTHOR_ROLE], austen2.roles)
+        eq_({Contributor.BIRTH_DATE: "1775", Contributor.DEATH_DATE: "1817"},
+            austen2.extra)
+
+        # The default role is part of what's remembered.
+        NameParser.parse_tuple("Austen, Jane", Contributor.AUTHOR_ROLE)
+        eq_((Contributor.EDITOR_ROLE,),
+            NameParser.parse_tuple("Austen, Jane", Contributor.EDITOR_ROLE)[2])
@@ -0,0 +1,90 @@
+from nose.tools import (
+    set_trace,
+    eq_,
+)
+import datetime
+
+from . import DatabaseTest
+
+from cache import (
+    AnnotatedEntryCache,
+    LRUCache,
+)
+
+
+class TestLRUCache(object):
+
+    def test_least_recently_used_item_is_discarded(self):
+        cache = LRUCache(2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+
+        # Using "a" makes "b" the least recently used item.
+        eq_(1, cache.get("a"))
+        cache.set("c", 3)
+        eq_(2, len(cache))
+        assert "a" in cache
+        assert "b" not in cache
+        eq_(3, cache.get("c"))
+
+    def test_items_expire(self):
+        cache = LRUCache(10, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2, ttl=-1)
+
+        # Expired items aren't counted.
+        eq_(1, len(cache))
+        eq_(1, cache.get("a"))
+        eq_(None, cache.get("b"))
+        eq_("default", cache.get("b", "default"))
+
+    def test_delete_and_clear(self):
+        cache = LRUCache(10)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.delete("a")
+        cache.delete("no such key")
+        eq_(None, cache.get("a"))
+        cache.clear()
+        eq_(0, len(cache))
+
+
+class TestAnnotatedEntryCache(DatabaseTest):
+
+    def test_get_set(self):
+        cache = AnnotatedEntryCache()
+        work = self._work(with_license_pool=True)
+        [pool] = work.license_pools
+        identifier = pool.identifier
+
+        eq_(None, cache.get(work, pool, identifier))
+        cache.set(work, pool, identifier, "<entry/>")
+        eq_("<entry/>", cache.get(work, pool, identifier))
+
+        # Entries are specific to an Identifier.
+        eq_(None, cache.get(work, pool, self._identifier()))
+
+        # A change to the Work's last_update_time makes the entry stale.
+        work.last_update_time = datetime.datetime(1999, 1, 1)
+        eq_(None, cache.get(work, pool, identifier))
+
+        # So does a change to the Work's own OPDS entry, even if
+        # last_update_time stays the same.
+        cache.set(work, pool, identifier, "<entry/>")
+        work.simple_opds_entry = "<new-entry/>"
+        eq_(None, cache.get(work, pool, identifier))
+
+        # A Work can be invalidated explicitly.
+        cache.set(work, pool, identifier, "<entry/>")
+        cache.invalidate(work)
+        eq_(None, cache.get(work, pool, identifier))
+
+    def test_entries_expire(self):
+        work = self._work(with_license_pool=True)
+        [pool] = work.license_pools
+        identifier = pool.identifier
+
+        eq_(AnnotatedEntryCache.DEFAULT_TTL, AnnotatedEntryCache().works.ttl)
+        cache = AnnotatedEntryCache(ttl=-1)
+        cache.set(work, pool, identifier, "<entry/>")
+        eq_(None, cache.get(work, pool, identifier))
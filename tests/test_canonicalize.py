@@ -9,6 +9,8 @@ from . import (
 )
 
 from core.metadata_layer import ContributorData
+from core.model import Contributor
+from core.util.titles import normalize_title_for_matching
 
 from test_viaf import MockVIAFClientLookup
 
@@ -47,6 +49,21 @@ class TestAuthorNameCanonicalizer(DatabaseTest):
     #    client.results = [lookup]
 
 
+    def test_in_session(self):
+        _db = object()
+        canonicalizer = self.canonicalizer.in_session(_db)
+
+        # The copy and its API clients use the new session...
+        eq_(_db, canonicalizer._db)
+        eq_(_db, canonicalizer.viaf._db)
+        eq_(_db, canonicalizer.oclcld._db)
+        assert isinstance(canonicalizer.viaf, MockVIAFClientLookup)
+
+        # ...and the original is unchanged.
+        eq_(self._db, self.canonicalizer._db)
+        eq_(self._db, self.canonicalizer.viaf._db)
+        eq_(self._db, self.canonicalizer.oclcld._db)
+
     def test_primary_author_name(self):
         # Test our ability to turn a freeform string that identifies
         # one or more people into the likely name of one person.
@@ -121,6 +138,72 @@ class TestAuthorNameCanonicalizer(DatabaseTest):
         eq_(canonicalized_author, contributor_1.sort_name)
 
 
+    def test_sort_names_from_database(self):
+        contributor, ignore = self._contributor(sort_name="Zebra, Ant")
+        contributor.display_name = "Ant Zebra"
+        identifier = self._identifier()
+
+        questions = [
+            (None, "Ant Zebra"),
+            # Only the first name counts.
+            (identifier, "Ant Zebra and Bloom Yarrow"),
+            (None, "Cher"),
+            # Not in the database.
+            (None, "Bloom Yarrow"),
+            (None, None),
+        ]
+        eq_({(None, "Ant Zebra"): "Zebra, Ant",
+             (identifier, "Ant Zebra and Bloom Yarrow"): "Zebra, Ant",
+             (None, "Cher"): "Cher"},
+            self.canonicalizer.sort_names_from_database(questions))
+
+    def test_sort_name_candidates(self):
+        edition = self._edition(title="The Ants")
+        contributor, ignore = self._contributor(sort_name="Zebra, Ant")
+        contributor.display_name = "Ant Zebra"
+        edition.add_contributor(contributor, Contributor.AUTHOR_ROLE)
+
+        # A second contributor with the same display name, but no
+        # known titles.
+        other, ignore = self._contributor(sort_name="Zebra, A.")
+        other.display_name = "Ant Zebra"
+
+        # A contributor with no sort name is ignored.
+        unknown, ignore = self._contributor()
+        unknown.display_name = "Ant Zebra"
+        unknown.sort_name = None
+        self._db.flush()
+
+        candidates = self.canonicalizer.sort_name_candidates(
+            ["Ant Zebra", "Bloom Yarrow"]
+        )
+        # Titles come back normalized, ready to be matched.
+        eq_({"Ant Zebra": [
+            ("Zebra, Ant", set([normalize_title_for_matching("The Ants")])),
+            ("Zebra, A.", set())]},
+            candidates)
+
+        # If there are no titles to compare against, titles aren't
+        # looked up.
+        eq_({"Ant Zebra": [("Zebra, Ant", set()), ("Zebra, A.", set())]},
+            self.canonicalizer.sort_name_candidates(
+                ["Ant Zebra"], with_titles=False
+            ))
+
+        # With no title match, the first candidate wins; a title
+        # match picks the contributor who worked on that title.
+        eq_("Zebra, A.", self.canonicalizer.sort_name_from_candidates(
+            list(reversed(candidates["Ant Zebra"])), ["Unrelated"]
+        ))
+        eq_("Zebra, Ant", self.canonicalizer.sort_name_from_candidates(
+            list(reversed(candidates["Ant Zebra"])), ["The Ants"]
+        ))
+
+        # Known titles are normalized before they're compared.
+        eq_("Zebra, Ant", self.canonicalizer.sort_name_from_candidates(
+            list(reversed(candidates["Ant Zebra"])), ["the ants"]
+        ))
+
     def test_oclc_contributor(self):
         # TODO: make sure isbn ids get directed to OCLC
         pass
@@ -0,0 +1,70 @@
+import threading
+from nose.tools import set_trace, eq_, assert_raises
+
+from . import DatabaseTest
+
+from concurrency import (
+    independent_session_factory,
+    run_concurrently,
+    run_pipelined,
+)
+
+
+class TestRunConcurrently(object):
+
+    def test_results_are_in_input_order(self):
+        eq_([2, 4, 6, 8], run_concurrently(lambda x: x*2, [1, 2, 3, 4], 3))
+
+    def test_single_worker_runs_in_current_thread(self):
+        current = threading.current_thread()
+        threads = run_concurrently(
+            lambda x: threading.current_thread(), [1, 2, 3], 1
+        )
+        eq_([current] * 3, threads)
+
+    def test_exception_is_propagated(self):
+        def explode(x):
+            if x == 2:
+                raise ValueError("boom")
+            return x
+        assert_raises(ValueError, run_concurrently, explode, [1, 2, 3], 3)
+
+    def test_earliest_exception_raised_after_every_call_finishes(self):
+        second_failed = threading.Event()
+        finished = []
+        def explode(x):
+            if x == 1:
+                # Don't fail until the call for a later item has
+                # already failed.
+                second_failed.wait(5)
+                raise KeyError("first")
+            if x == 2:
+                second_failed.set()
+                raise ValueError("second")
+            finished.append(x)
+            return x
+        assert_raises(KeyError, run_concurrently, explode, [1, 2, 3], 3)
+        eq_([3], finished)
+
+
+class TestRunPipelined(object):
+
+    def test_results_are_yielded_in_input_order(self):
+        results = run_pipelined(lambda x: x*2, [1, 2, 3, 4], 3)
+        eq_(2, next(results))
+        eq_([4, 6, 8], list(results))
+
+    def test_single_worker_runs_in_current_thread(self):
+        current = threading.current_thread()
+        threads = run_pipelined(
+            lambda x: threading.current_thread(), [1, 2, 3], 1
+        )
+        eq_([current] * 3, list(threads))
+
+
+class TestIndependentSessionFactory(DatabaseTest):
+
+    def test_connection_bound_session_has_no_factory(self):
+        # The test database session is bound to a single Connection,
+        # which can't be shared between threads.
+        eq_(None, independent_session_factory(self._db))
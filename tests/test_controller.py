@@ -2,19 +2,23 @@
 import os
 import base64
 import feedparser
+import hashlib
 import json
 import re
 import urllib
+import urlparse
 from Crypto.Cipher import PKCS1_OAEP
 from Crypto.Hash import SHA
 from Crypto.Signature import PKCS1_v1_5
 from Crypto.PublicKey import RSA
 from StringIO import StringIO
 from datetime import datetime, timedelta
+from flask import g
 from functools import wraps
 import jwt
 from lxml import etree
 from nose.tools import set_trace, eq_
+from sqlalchemy.orm import sessionmaker
 
 from . import (
     DatabaseTest,
@@ -48,6 +52,8 @@ from core.util.opds_writer import OPDSMessage
 
 from canonicalize import (
     AuthorNameCanonicalizer,
+    CanonicalAuthorName,
+    CanonicalizationCache,
     SimpleMockAuthorNameCanonicalizer,
 )
 from content_cafe import (
@@ -66,12 +72,16 @@ from controller import (
     HTTP_NOT_FOUND,
     HTTP_INTERNAL_SERVER_ERROR,
     authenticated_client_from_request,
+    authenticated_client_ids,
+    forget_shared_secrets,
     collection_from_details,
+    collection_ids,
 )
 from coverage import (
     IdentifierResolutionCoverageProvider,
 )
 from integration_client import IntegrationClientCoverImageCoverageProvider
+from oclc.classify import IdentifierLookupCoverageProvider
 from overdrive import (
     OverdriveBibliographicCoverageProvider,
 )
@@ -135,6 +145,39 @@ class TestIntegrationClientAuthentication(ControllerTest):
             result = authenticated_client_from_request(self._db, required=False)
             eq_(None, result)
 
+    def test_authenticated_client_is_cached(self):
+        key = hashlib.sha256(self.client.shared_secret).hexdigest()
+        with self.app.test_request_context('/', headers=self.valid_auth):
+            eq_(self.client, authenticated_client_from_request(self._db))
+
+            # The client is remembered for the rest of the request.
+            eq_(self.client, g.authenticated_clients[key])
+            eq_(self.client, authenticated_client_from_request(self._db))
+
+        # Its ID is remembered for a while longer.
+        eq_(self.client.id, authenticated_client_ids.get(key))
+
+        # If the secret changes, the old one stops working, even
+        # though it was cached.
+        old_auth = self.valid_auth
+        self.client.randomize_secret()
+        with self.app.test_request_context('/', headers=old_auth):
+            result = authenticated_client_from_request(self._db)
+            eq_(True, isinstance(result, ProblemDetail))
+        eq_(None, authenticated_client_ids.get(key))
+
+        # forget_shared_secrets() clears out everything cached for a
+        # client.
+        new_auth = 'Bearer ' + base64.b64encode(self.client.shared_secret)
+        new_key = hashlib.sha256(self.client.shared_secret).hexdigest()
+        with self.app.test_request_context(
+            '/', headers=dict(Authorization=new_auth)
+        ):
+            eq_(self.client, authenticated_client_from_request(self._db))
+            forget_shared_secrets(self.client)
+            eq_({}, g.authenticated_clients)
+        eq_(None, authenticated_client_ids.get(new_key))
+
 
 class TestCollectionHandling(ControllerTest):
 
@@ -171,6 +214,22 @@ class TestCollectionHandling(ControllerTest):
             # It has a DataSource.
             eq_(DataSource.OA_CONTENT_SERVER, collection.data_source.name)
 
+    def test_collection_from_details_is_cached(self):
+        collection = self._collection(external_account_id=self._url)
+        details = collection.metadata_identifier
+        key = (self.client.id, details, None)
+
+        with self.app.test_request_context('/'):
+            eq_(collection, collection_from_details(self._db, self.client, details))
+        eq_(collection.id, collection_ids.get(key))
+
+        # If the cached ID turns out to be bad, the Collection is
+        # looked up again.
+        collection_ids.set(key, -1)
+        with self.app.test_request_context('/'):
+            eq_(collection, collection_from_details(self._db, self.client, details))
+        eq_(collection.id, collection_ids.get(key))
+
 
 class TestIndexController(ControllerTest):
 
@@ -449,6 +508,140 @@ class TestCatalogController(ControllerTest):
             assert any([link['rel'] == 'first' for link in links])
             assert not any([link['rel'] == 'next'for link in links])
 
+    def test_updates_feed_keyset_pagination(self):
+        identifiers = [
+            work.license_pools[0].identifier
+            for work in [self.work1, self.work2]
+        ]
+        for identifier in identifiers:
+            self.collection.catalog_identifier(identifier)
+
+        with self.app.test_request_context('/?size=1',
+            headers=self.valid_auth):
+            response = self.controller.updates_feed(self.collection.name)
+            feed = feedparser.parse(response.get_data())
+            [entry] = feed['entries']
+            eq_(identifiers[0].urn, entry['id'])
+            [next_link] = [
+                x['href'] for x in feed['feed']['links'] if x['rel'] == 'next'
+            ]
+
+        # The 'next' link picks up where the first page left off.
+        query = urlparse.urlparse(next_link).query
+        key = urlparse.parse_qs(query)['key'][0]
+        with self.app.test_request_context(
+            '/?size=1&key=%s' % key, headers=self.valid_auth
+        ):
+            response = self.controller.updates_feed(self.collection.name)
+            feed = feedparser.parse(response.get_data())
+            [entry] = feed['entries']
+            eq_(identifiers[1].urn, entry['id'])
+            rels = [x['rel'] for x in feed['feed']['links']]
+            assert 'first' in rels
+            assert 'next' not in rels
+
+        # A key that doesn't make sense is rejected.
+        with self.app.test_request_context(
+            '/?key=nonsense', headers=self.valid_auth
+        ):
+            response = self.controller.updates_feed(self.collection.name)
+            eq_(INVALID_INPUT.uri, response.uri)
+
+    def test_updates_feed_keyset_pagination_null_timestamp(self):
+        # work1 has never been updated.
+        self.work1.last_update_time = None
+        identifiers = [
+            work.license_pools[0].identifier
+            for work in [self.work1, self.work2]
+        ]
+        for identifier in identifiers:
+            self.collection.catalog_identifier(identifier)
+
+        # Works with no last_update_time come first, and the key that
+        # points past them uses null for the timestamp.
+        with self.app.test_request_context('/?size=1',
+            headers=self.valid_auth):
+            response = self.controller.updates_feed(self.collection.name)
+            feed = feedparser.parse(response.get_data())
+            [entry] = feed['entries']
+            eq_(identifiers[0].urn, entry['id'])
+            [next_link] = [
+                x['href'] for x in feed['feed']['links'] if x['rel'] == 'next'
+            ]
+        query = urlparse.urlparse(next_link).query
+        key = urlparse.parse_qs(query)['key'][0]
+        eq_([None, self.work1.id, identifiers[0].id],
+            json.loads(base64.urlsafe_b64decode(key)))
+
+        # The next page isn't empty.
+        with self.app.test_request_context(
+            '/?size=1&key=%s' % key, headers=self.valid_auth
+        ):
+            response = self.controller.updates_feed(self.collection.name)
+            feed = feedparser.parse(response.get_data())
+            [entry] = feed['entries']
+            eq_(identifiers[1].urn, entry['id'])
+
+    def test_updates_feed_keyset_pagination_rejects_malformed_keys(self):
+        def encode(value):
+            return base64.urlsafe_b64encode(json.dumps(value))
+
+        for bad_key in [
+            encode({"a": 1}),
+            encode([[1], 2, 3]),
+            encode([None, 1]),
+            encode([None, 1, 2, 3]),
+            encode(["2018-01-01T00:00:00.000000", "1", 2]),
+            encode(["2018-01-01T00:00:00.000000", 1, True]),
+            encode([1, 1, 2]),
+            encode(["yesterday", 1, 2]),
+        ]:
+            with self.app.test_request_context(
+                '/?key=%s' % bad_key, headers=self.valid_auth
+            ):
+                response = self.controller.updates_feed(self.collection.name)
+                eq_(INVALID_INPUT.uri, response.uri)
+
+        # A well-formed key is accepted.
+        with self.app.test_request_context(
+            '/?key=%s' % encode([None, 1, 2]), headers=self.valid_auth
+        ):
+            response = self.controller.updates_feed(self.collection.name)
+            eq_(HTTP_OK, response.status_code)
+
+    def test_updates_feed_streamed(self):
+        for work in [self.work1, self.work2]:
+            self.collection.catalog_identifier(work.license_pools[0].identifier)
+
+        # work1 has a cached OPDS entry; work2 doesn't.
+        self.work1.calculate_opds_entries()
+        self.work2.verbose_opds_entry = self.work2.simple_opds_entry = None
+
+        with self.app.test_request_context(
+            '/?stream=true&size=1', headers=self.valid_auth
+        ):
+            response = self.controller.updates_feed(self.collection.name)
+            eq_(HTTP_OK, response.status_code)
+            assert response.is_streamed
+            feed = feedparser.parse(response.get_data())
+
+        eq_(feed.feed.title,
+            u"%s Collection Updates for %s" % (self.collection.protocol, self.client.url))
+        eq_(1, len(feed['entries']))
+
+        # The next page is also streamed.
+        [next_link] = [x for x in feed['feed']['links'] if x['rel'] == 'next']
+        assert 'stream=true' in next_link['href']
+
+        # Both Works show up, whether or not they had a cached entry.
+        with self.app.test_request_context(
+            '/?stream=true&size=2', headers=self.valid_auth
+        ):
+            response = self.controller.updates_feed(self.collection.name)
+            feed = feedparser.parse(response.get_data())
+        eq_(set([self.work1.title, self.work2.title]),
+            set([x['title'] for x in feed['entries']]))
+
     def test_updates_feed_bad_last_update_time(self):
         """Passing in a malformed timestamp for last_update_time
         results in a problem detail document.
@@ -501,6 +694,25 @@ class TestCatalogController(ControllerTest):
         # Invalid identifier return 400 errors.
         self.assert_message(m, invalid_urn, 400, 'Could not parse identifier.')
 
+    def test_add_items_from_request_body(self):
+        # Too many URNs to fit in a query string can be sent as a
+        # form-encoded request body instead.
+        query_id = self._identifier()
+        body_id = self._identifier()
+        self.collection.catalog_identifier(body_id)
+
+        with self.app.test_request_context(
+                '/?urn=%s' % query_id.urn, method='POST',
+                headers=self.valid_auth, data=dict(urn=[body_id.urn])
+        ):
+            response = self.controller.add_items(self.collection.name)
+
+        m = self.get_messages(response.get_data())
+        eq_(2, len(m))
+        self.assert_message(m, query_id, 201, 'Successfully added')
+        self.assert_message(m, body_id, 200, 'Already in catalog')
+        eq_(set([query_id, body_id]), set(self.collection.catalog))
+
     def test_add_with_metadata(self):
         # Pretend this OPDS came from a circulation manager.
         base_path = os.path.split(__file__)[0]
@@ -1206,16 +1418,90 @@ class TestURNLookupController(ControllerTest):
 
     @authenticated_request_context_resolve_now
     def test_process_urn_registration_failure_resolving_too_much(self):
-        """Even when you authenticate, you can only ask that one identifier at
-        a time be immediately resolved.
+        """Even when you authenticate, there's a lower limit on how many
+        identifiers you can ask to be immediately resolved.
         """
         urn = self._identifier(identifier_type=Identifier.ISBN).urn
         name = self.overdrive_collection.metadata_identifier
-        result = self.controller.process_urns([urn] * 2, collection_details=name)
+        eq_(URNLookupController.DEFAULT_IMMEDIATE_RESOLUTION_LIMIT,
+            self.controller.immediate_resolution_limit)
+        result = self.controller.process_urns([urn] * 11, collection_details=name)
         eq_(INVALID_INPUT.uri, result.uri)
-        eq_(u"The maximum number of URNs you can provide at once is 1. (You sent 2)",
+        eq_(u"The maximum number of URNs you can provide at once is 10. (You sent 11)",
             result.detail)
 
+    @authenticated_request_context_resolve_now
+    def test_process_urn_immediate_resolution_limit_is_configurable(self):
+        ConfigurationSetting.sitewide(
+            self._db, URNLookupController.IMMEDIATE_RESOLUTION_LIMIT
+        ).value = 2
+        eq_(2, self.controller.immediate_resolution_limit)
+
+        urn = self._identifier(identifier_type=Identifier.ISBN).urn
+        name = self.overdrive_collection.metadata_identifier
+        result = self.controller.process_urns([urn] * 3, collection_details=name)
+        eq_(INVALID_INPUT.uri, result.uri)
+        eq_(u"The maximum number of URNs you can provide at once is 2. (You sent 3)",
+            result.detail)
+
+    def test_resolve_concurrently(self):
+        # When several Identifiers need to be resolved immediately,
+        # data about all of them is fetched from third parties at
+        # once, in the background. The Identifiers are then resolved
+        # one at a time in the controller's own session.
+        fetched = []
+        def create_metadata(identifier):
+            fetched.append(identifier.identifier)
+        self.content_cafe.create_metadata = create_metadata
+
+        isbn1 = self._identifier(identifier_type=Identifier.ISBN)
+        isbn2 = self._identifier(identifier_type=Identifier.ISBN)
+        resolver = IdentifierResolutionCoverageProvider(
+            self.overdrive_collection, provide_coverage_immediately=True,
+            **self.controller.coverage_provider_kwargs
+        )
+
+        # OCLC Classify prefetches its documents too.
+        [oclc] = [x for x in resolver.providers
+                  if isinstance(x, IdentifierLookupCoverageProvider)]
+        classified = []
+        def download(url, content=None, claimed_owis=None):
+            classified.append(url)
+            return {}
+        oclc.download = download
+
+        # Nothing is committed behind the request's back.
+        def no_commit():
+            raise Exception("The request's session was committed!")
+        self._db.commit = no_commit
+        try:
+            self.controller.resolve_concurrently(resolver, [isbn1, isbn2])
+        finally:
+            del self._db.commit
+
+        for identifier in (isbn1, isbn2):
+            providers, wait = resolver._prefetching[identifier]
+            wait()
+            eq_(set([ContentCafeCoverageProvider,
+                     IdentifierLookupCoverageProvider]),
+                set(x.__class__ for x in providers))
+        eq_(sorted([isbn1.identifier, isbn2.identifier]), sorted(fetched))
+        eq_(2, len(classified))
+
+        # When an Identifier is resolved, the data fetched for it is
+        # used instead of asking Content Cafe again.
+        [content_cafe] = [x for x in resolver._prefetching[isbn1][0]
+                          if isinstance(x, ContentCafeCoverageProvider)]
+        eq_(None, content_cafe.fetched_data(isbn1))
+        eq_(2, len(fetched))
+
+        # Even a single Identifier has its data fetched in the
+        # background.
+        isbn3 = self._identifier(identifier_type=Identifier.ISBN)
+        self.controller.resolve_concurrently(resolver, [isbn3])
+        resolver._prefetching[isbn3][1]()
+        eq_(3, len(fetched))
+
     @basic_request_context
     def test_process_urn_default_collection(self):
         # It's possible to look up individual URNs anonymously.
@@ -1314,6 +1600,7 @@ class TestCanonicalizationController(ControllerTest):
 
     def setup(self):
         super(TestCanonicalizationController, self).setup()
+        CanonicalizationCache.recent.clear()
         self.canonicalizer = SimpleMockAuthorNameCanonicalizer()
         self.controller = CanonicalizationController(
             self._db, self.canonicalizer
@@ -1378,3 +1665,168 @@ class TestCanonicalizationController(ControllerTest):
             # we get a 404 error.
             eq_(404, response.status_code)
             eq_("", response.data)
+
+    def test_canonicalize_author_names(self):
+        identifier = self._identifier()
+        self.canonicalizer.register(identifier, "Bell Hooks", "hooks, bell")
+        self.canonicalizer.register(None, "Cher", "Cher")
+
+        questions = [
+            dict(urn=identifier.urn, display_name="Bell Hooks"),
+            dict(display_name="Cher"),
+            dict(display_name="nobody"),
+            # Duplicate questions are only answered once.
+            dict(urn=identifier.urn, display_name="Bell Hooks"),
+        ]
+        with self.app.test_request_context(
+            '/', method='POST', data=json.dumps(questions)
+        ):
+            response = self.controller.canonicalize_author_names()
+        eq_(200, response.status_code)
+        eq_("application/json", response.headers['Content-Type'])
+        eq_([dict(urn=identifier.urn, display_name="Bell Hooks",
+                  sort_name="hooks, bell"),
+             dict(urn=None, display_name="Cher", sort_name="Cher"),
+             dict(urn=None, display_name="nobody", sort_name=None)],
+            json.loads(response.data))
+        eq_(3, len(self.canonicalizer.canonicalize_author_name_calls))
+
+        # The answers were cached.
+        with self.app.test_request_context(
+            '/', method='POST', data=json.dumps(questions)
+        ):
+            response = self.controller.canonicalize_author_names()
+        eq_(3, len(json.loads(response.data)))
+        eq_(3, len(self.canonicalizer.canonicalize_author_name_calls))
+
+        # Bad input is rejected.
+        for data in (
+            "not json", json.dumps(dict(a=1)), json.dumps([1]),
+            json.dumps([dict(urn=["a"], display_name="Cher")]),
+            json.dumps([dict(display_name=dict(a=1))]),
+            json.dumps([dict(display_name=5)]),
+        ):
+            with self.app.test_request_context(
+                '/', method='POST', data=data
+            ):
+                response = self.controller.canonicalize_author_names()
+            eq_(INVALID_INPUT.uri, response.uri)
+
+        # So are too many questions.
+        questions = [
+            dict(display_name="Name %d" % i)
+            for i in range(self.controller.MAX_BATCH_SIZE + 1)
+        ]
+        with self.app.test_request_context(
+            '/', method='POST', data=json.dumps(questions)
+        ):
+            response = self.controller.canonicalize_author_names()
+        eq_(INVALID_INPUT.uri, response.uri)
+
+    def test_canonicalize_concurrently(self):
+        # Pretend worker threads can use their own database sessions.
+        sessions = []
+        class MockSession(object):
+            def __init__(self):
+                self.committed = self.closed = False
+                sessions.append(self)
+            def commit(self):
+                self.committed = True
+            def rollback(self):
+                pass
+            def close(self):
+                self.closed = True
+
+        class Mock(CanonicalizationController):
+            def session_factory(self):
+                return MockSession
+        controller = Mock(self._db, self.canonicalizer)
+
+        self.canonicalizer.register(None, "Cher", "Cher")
+        self.canonicalizer.register(None, "Bell Hooks", "hooks, bell")
+        questions = [(None, "Cher"), (None, "nobody"), (None, "Bell Hooks")]
+        eq_(["Cher", None, "hooks, bell"],
+            controller.canonicalize_concurrently(questions))
+
+        # The injected canonicalizer answered every question, each in
+        # its own session, which was committed and closed.
+        eq_(set([(None, "Cher"), (None, "nobody"), (None, "Bell Hooks")]),
+            set(self.canonicalizer.canonicalize_author_name_calls))
+        eq_(3, len(sessions))
+        assert all(x.committed and x.closed for x in sessions)
+
+    def test_canonicalize_concurrently_with_independent_sessions(self):
+        # Use a session that's bound to the database engine rather
+        # than the test's connection, so worker threads really do get
+        # sessions of their own.
+        session = sessionmaker(bind=self.engine)()
+
+        class Recorder(AuthorNameCanonicalizer):
+            def __init__(self):
+                self.calls = []
+            def canonicalize_author_name(self, identifier, display_name):
+                self.calls.append(
+                    (identifier and identifier.urn, display_name)
+                )
+                return display_name.upper()
+        canonicalizer = Recorder()
+        controller = CanonicalizationController(session, canonicalizer)
+
+        # This ISBN isn't in the database yet.
+        isbn = "9781234567897"
+        urn = "urn:isbn:" + isbn
+        questions = [
+            (urn, "Someone New"), (urn, "Someone Else"), (None, "Nobody")
+        ]
+        try:
+            eq_(["SOMEONE NEW", "SOMEONE ELSE", "NOBODY"],
+                controller.canonicalize_concurrently(questions))
+
+            # The Identifier was created and committed before the
+            # workers started, so every worker found it rather than
+            # trying to create it.
+            eq_(set(questions), set(canonicalizer.calls))
+        finally:
+            session.rollback()
+            identifier = get_one(
+                session, Identifier, type=Identifier.ISBN, identifier=isbn
+            )
+            if identifier:
+                session.delete(identifier)
+                session.commit()
+            session.close()
+
+    def test_canonicalize_author_name_is_cached(self):
+        identifier = self._identifier()
+        self.canonicalizer.register(identifier, "Bell Hooks", "hooks, bell")
+        url = '/?urn=%s&display_name=%s' % (identifier.urn, "Bell Hooks")
+
+        with self.app.test_request_context(url):
+            response = self.controller.canonicalize_author_name()
+            eq_("hooks, bell", response.data)
+        eq_(1, len(self.canonicalizer.canonicalize_author_name_calls))
+
+        # The second time, the canonicalizer isn't consulted.
+        with self.app.test_request_context(url):
+            response = self.controller.canonicalize_author_name()
+            eq_("hooks, bell", response.data)
+        eq_(1, len(self.canonicalizer.canonicalize_author_name_calls))
+
+        # The answer was also stored in the database, so it's
+        # available even once the in-memory cache is cleared.
+        CanonicalizationCache.recent.clear()
+        cache = CanonicalizationCache(self._db)
+        eq_((True, "hooks, bell"), cache.get(identifier, "Bell  Hooks"))
+
+        # Failures are cached too, but not for as long.
+        cache.set(None, "nobody", None)
+        eq_((True, None), cache.get(None, "nobody"))
+        CanonicalizationCache.recent.clear()
+        answer = get_one(
+            self._db, CanonicalAuthorName, urn=u"", display_name=u"nobody"
+        )
+        eq_(None, answer.author_name)
+        answer.timestamp = (
+            datetime.utcnow() - CanonicalizationCache.NEGATIVE_MAX_AGE
+        )
+        eq_((False, None), cache.get(None, "nobody"))
@@ -1,14 +1,18 @@
+import datetime
 from nose.tools import (
+    assert_raises_regexp,
     eq_,
     set_trace,
 )
 
 from . import DatabaseTest
 
+from core.metadata_layer import IdentifierData
 from core.model import (
     CoverageRecord,
     DataSource,
     ExternalIntegration,
+    Identifier,
 )
 
 from core.s3 import S3Uploader
@@ -17,6 +21,7 @@ from core.overdrive import MockOverdriveAPI
 
 from content_cafe import ContentCafeCoverageProvider
 from coverage import IdentifierResolutionCoverageProvider
+from coverage_utils import PrefetchesMetadata
 from integration_client import IntegrationClientCoverImageCoverageProvider
 from oclc.classify import IdentifierLookupCoverageProvider
 from overdrive import OverdriveBibliographicCoverageProvider
@@ -306,6 +311,253 @@ class TestIdentifierResolutionCoverageProvider(DatabaseTest):
         eq_(result, identifier)
         eq_(None, identifier.work)
 
+    def test_process_all_providers(self):
+        """When providing coverage immediately, a provider that can
+        prefetch its data does so, and is processed after the others.
+        """
+        class Prefetcher(PrefetchesMetadata):
+            fetched = []
+
+            def can_cover(self, identifier):
+                return True
+
+            def fetch(self, identifier):
+                self.fetched.append(identifier)
+                return "data for %s" % identifier.identifier
+
+        prefetcher = Prefetcher()
+        other = object()
+
+        class Mock(IdentifierResolutionCoverageProvider):
+            def gather_providers(self, provider_kwargs):
+                return [prefetcher, other]
+
+            def process_one_provider(self, identifier, provider):
+                if provider is prefetcher:
+                    return provider.fetched_data(identifier)
+                return "processed"
+
+        identifier = self._identifier()
+        expect = "data for %s" % identifier.identifier
+
+        # When we're only registering identifiers, nothing is
+        # prefetched, and the providers are processed in order.
+        provider = Mock(self._default_collection)
+        eq_([expect, "processed"], provider.process_all_providers(identifier))
+        eq_({}, prefetcher._prefetched)
+
+        # When we're providing coverage immediately, the prefetcher's
+        # data is fetched in the background and used later.
+        provider = Mock(
+            self._default_collection, provide_coverage_immediately=True
+        )
+        eq_(["processed", expect], provider.process_all_providers(identifier))
+        eq_({}, prefetcher._prefetched)
+
+        # The background thread was given an IdentifierData rather
+        # than the Identifier itself.
+        from_main_thread, from_background = prefetcher.fetched
+        eq_(identifier, from_main_thread)
+        assert isinstance(from_background, IdentifierData)
+        eq_((identifier.type, identifier.identifier),
+            (from_background.type, from_background.identifier))
+
+        # An exception raised while prefetching is raised again when
+        # the data is used.
+        class Explodes(Prefetcher):
+            def fetch(self, identifier):
+                raise IOError("Oops")
+        explodes = Explodes()
+        explodes.prefetch(identifier)
+        assert_raises_regexp(
+            IOError, "Oops", explodes.fetched_data, identifier
+        )
+
+        # prefetched_data() never calls fetch() itself.
+        prefetcher.fetched[:] = []
+        eq_(None, prefetcher.prefetched_data(identifier))
+        prefetcher.prefetch(identifier)
+        eq_(expect, prefetcher.prefetched_data(identifier))
+        eq_(None, prefetcher.prefetched_data(identifier))
+        eq_([identifier], prefetcher.fetched)
+
+    def test_start_prefetching(self):
+        oclc = DataSource.lookup(self._db, DataSource.OCLC)
+
+        class Prefetcher(PrefetchesMetadata):
+            COVERAGE_COUNTS_FOR_EVERY_COLLECTION = True
+            data_source = oclc
+            operation = None
+
+            def __init__(self):
+                super(Prefetcher, self).__init__()
+                self.fetched = []
+
+            def can_cover(self, identifier):
+                return True
+
+            def should_update(self, record):
+                return record is None
+
+            def fetch(self, identifier):
+                self.fetched.append(identifier.identifier)
+                return "data"
+
+        prefetcher = Prefetcher()
+
+        class Mock(IdentifierResolutionCoverageProvider):
+            def gather_providers(self, provider_kwargs):
+                return [prefetcher]
+
+        provider = Mock(
+            self._default_collection, provide_coverage_immediately=True
+        )
+        provider.force = False
+
+        # One Identifier has already been covered by the prefetching
+        # provider, so there's no need to fetch data for it.
+        covered = self._identifier()
+        CoverageRecord.add_for(covered, oclc)
+        uncovered = self._identifier()
+
+        provider.start_prefetching([covered, uncovered])
+        eq_(set([covered, uncovered]), set(provider._prefetching.keys()))
+        providers, wait = provider._prefetching[uncovered]
+        wait()
+        eq_([prefetcher], providers)
+        eq_([], provider._prefetching[covered][0])
+        eq_([uncovered.identifier], prefetcher.fetched)
+
+        # Prefetched data that never gets used is discarded once the
+        # Identifier has been processed, even if processing failed.
+        def explode(identifier, provider):
+            raise Exception("Oops")
+        provider.process_one_provider = explode
+        assert_raises_regexp(
+            Exception, "Oops", provider.process_all_providers, uncovered
+        )
+        eq_({}, prefetcher._prefetched)
+        eq_({covered: provider._prefetching[covered]}, provider._prefetching)
+
+        # Whatever prefetch_arguments() finds out in this thread is
+        # passed into fetch() in the background.
+        class WithArguments(Prefetcher):
+            def prefetch_arguments(self, identifier):
+                return IdentifierData(identifier.type, "arguments")
+        prefetcher = WithArguments()
+        provider.providers = [prefetcher]
+        another = self._identifier()
+        provider.start_prefetching([another])
+        provider._prefetching[another][1]()
+        eq_(["arguments"], prefetcher.fetched)
+
+        # If prefetch_arguments() fails, the provider doesn't
+        # prefetch, and will get its data when it's processed.
+        class CantPrefetch(Prefetcher):
+            def prefetch_arguments(self, identifier):
+                raise IOError("Oops")
+        prefetcher = CantPrefetch()
+        provider.providers = [prefetcher]
+        yet_another = self._identifier()
+        provider.start_prefetching([yet_another])
+        eq_([], provider._prefetching[yet_another][0])
+        eq_([], prefetcher.fetched)
+
+    def test_process_batch_registers_in_bulk(self):
+        oclc = DataSource.lookup(self._db, DataSource.OCLC)
+
+        class ISBNProvider(object):
+            """Just enough of a CoverageProvider to be registered with."""
+            COVERAGE_COUNTS_FOR_EVERY_COLLECTION = True
+            data_source = oclc
+            operation = None
+
+            def can_cover(self, identifier):
+                return identifier.type == Identifier.ISBN
+
+        class Mock(IdentifierResolutionCoverageProvider):
+            def gather_providers(self, provider_kwargs):
+                return [ISBNProvider()]
+
+        new_isbn = self._identifier(identifier_type=Identifier.ISBN)
+        old_isbn = self._identifier(identifier_type=Identifier.ISBN)
+        old_record = self._coverage_record(
+            old_isbn, oclc, status=CoverageRecord.TRANSIENT_FAILURE
+        )
+        overdrive = self._identifier(identifier_type=Identifier.OVERDRIVE_ID)
+        batch = [new_isbn, old_isbn, overdrive]
+
+        provider = Mock(self._default_collection)
+        eq_(batch, provider.process_batch(batch))
+
+        # A CoverageRecord was created for the new ISBN.
+        [record] = new_isbn.coverage_records
+        eq_(oclc, record.data_source)
+        eq_(CoverageRecord.REGISTERED, record.status)
+        eq_(None, record.collection)
+
+        # The old ISBN's CoverageRecord was left alone.
+        eq_([old_record], old_isbn.coverage_records)
+        eq_(CoverageRecord.TRANSIENT_FAILURE, old_record.status)
+
+        # The Overdrive ID can't be covered by this provider.
+        eq_([], overdrive.coverage_records)
+
+        # Every Identifier got a stub LicensePool.
+        for identifier in batch:
+            [lp] = identifier.licensed_through
+            eq_(provider.collection, lp.collection)
+
+        # With force=True, the old CoverageRecord is registered anew.
+        provider = Mock(self._default_collection, force=True)
+        provider.process_batch(batch)
+        eq_([old_record], old_isbn.coverage_records)
+        eq_(CoverageRecord.REGISTERED, old_record.status)
+
+    def test_bulk_register_survives_concurrent_registration(self):
+        oclc = DataSource.lookup(self._db, DataSource.OCLC)
+        collection = self._default_collection
+
+        class Provider(object):
+            COVERAGE_COUNTS_FOR_EVERY_COLLECTION = False
+            data_source = oclc
+            operation = u"lookup"
+
+        provider = Provider()
+        provider.collection = collection
+        identifier = self._identifier()
+        _db = self._db
+
+        class Mock(IdentifierResolutionCoverageProvider):
+            def gather_providers(self, provider_kwargs):
+                return []
+
+            @property
+            def force(self):
+                # Another request registers the Identifier after
+                # bulk_register has looked for existing records, but
+                # before it inserts the missing ones.
+                _db.execute(CoverageRecord.__table__.insert().values(
+                    identifier_id=identifier.id, data_source_id=oclc.id,
+                    operation=provider.operation,
+                    collection_id=collection.id,
+                    status=CoverageRecord.TRANSIENT_FAILURE,
+                    timestamp=datetime.datetime.utcnow(),
+                ))
+                return False
+
+            @force.setter
+            def force(self, value):
+                pass
+
+        resolver = Mock(collection)
+        [record] = resolver.bulk_register(provider, [identifier])
+
+        # The INSERT skipped the Identifier instead of failing, and
+        # the other request's CoverageRecord was returned.
+        eq_(identifier, record.identifier)
+        eq_(CoverageRecord.TRANSIENT_FAILURE, record.status)
+
     def test_process_one_provider(self):
         """Test what happens when IdentifierResolutionCoverageProvider
         tells a subprovider to do something.
@@ -1,3 +1,5 @@
+import datetime
+
 from nose.tools import (
     eq_,
     set_trace,
@@ -17,6 +19,7 @@ from core.mirror import MirrorUploader
 from core.tests.test_s3 import S3UploaderTest
 
 from coverage_utils import (
+    ContributorVIAFResolution,
     MetadataWranglerBibliographicCoverageProvider,
     ResolveVIAFOnSuccessCoverageProvider,
 )
@@ -214,3 +217,89 @@ class TestResolveVIAFOnSuccessCoverageProvider(DatabaseTest):
         # display names of the two contributors.
         eq_("Author 1", c1.display_name)
         eq_("Author 2", c2.display_name)
+
+    def test_resolve_viaf_skips_recently_resolved_contributors(self):
+        class MockVIAF(object):
+            def __init__(self):
+                self.processed = []
+            def process_contributor(self, contributor):
+                self.processed.append(contributor)
+
+        work = self._work(authors=['Author 1'], with_license_pool=True)
+        [contributor] = work.presentation_edition.contributors
+
+        # A second license pool whose presentation edition has the
+        # same contributor.
+        edition, pool = self._edition(
+            authors=['Author 1'], with_license_pool=True
+        )
+        work.license_pools.append(pool)
+        eq_(set([contributor]), edition.contributors)
+
+        provider = MockResolveVIAF(self._default_collection)
+        provider.viaf = MockVIAF()
+        eq_(True, provider.needs_viaf(contributor))
+
+        # The contributor is processed once, even though they show
+        # up on two editions.
+        provider.resolve_viaf(work)
+        eq_([contributor], provider.viaf.processed)
+        eq_(False, provider.needs_viaf(contributor))
+        [resolution] = self._db.query(ContributorVIAFResolution).all()
+        eq_(contributor.id, resolution.contributor_id)
+
+        # Resolving the work again doesn't send the contributor to
+        # VIAF again.
+        provider.resolve_viaf(work)
+        eq_([contributor], provider.viaf.processed)
+
+        # But once enough time has passed, it does.
+        later = (
+            datetime.datetime.utcnow() + provider.VIAF_MAX_AGE
+            + datetime.timedelta(days=1)
+        )
+        eq_(True, provider.needs_viaf(contributor, now=later))
+        provider.mark_viaf_resolved(
+            contributor, now=datetime.datetime.utcnow() - provider.VIAF_MAX_AGE
+        )
+        provider.resolve_viaf(work)
+        eq_([contributor, contributor], provider.viaf.processed)
+
+    def test_recently_resolved(self):
+        c1, ignore = self._contributor()
+        c2, ignore = self._contributor()
+        c3, ignore = self._contributor()
+        provider = MockResolveVIAF(self._default_collection)
+        eq_(set(), provider.recently_resolved([]))
+
+        now = datetime.datetime.utcnow()
+        provider.mark_viaf_resolved(c1, now=now)
+        provider.mark_viaf_resolved(
+            c2, now=now - provider.VIAF_MAX_AGE - datetime.timedelta(days=1)
+        )
+
+        # Only the contributor resolved within VIAF_MAX_AGE counts.
+        eq_(set([c1.id]), provider.recently_resolved([c1, c2, c3]))
+
+        # Marking a contributor again updates the existing record.
+        provider.mark_viaf_resolved(c2, now=now)
+        eq_(set([c1.id, c2.id]), provider.recently_resolved([c1, c2, c3]))
+        eq_(2, self._db.query(ContributorVIAFResolution).count())
+
+    def test_resolve_viaf_for_contributors_skips_merged_contributors(self):
+        class MockVIAF(object):
+            def __init__(self, _db):
+                self._db = _db
+            def process_contributor(self, contributor):
+                # Pretend the contributor was merged into a duplicate,
+                # and the deletion has already been flushed.
+                self._db.delete(contributor)
+                self._db.flush()
+
+        contributor, ignore = self._contributor()
+        provider = MockResolveVIAF(self._default_collection)
+        provider.viaf = MockVIAF(self._db)
+        provider.resolve_viaf_for_contributors([contributor])
+
+        # The deleted contributor wasn't marked as resolved.
+        eq_([], self._db.query(ContributorVIAFResolution).all())
@@ -0,0 +1,159 @@
+import json
+import threading
+from nose.tools import set_trace, eq_
+
+from . import DatabaseTest
+
+from core.model import ConfigurationSetting
+
+import http_pool
+from concurrency import run_in_background
+from http_pool import (
+    HTTPPool,
+    configure,
+    configure_from_database,
+    shared_pool,
+)
+
+
+class MockResponse(object):
+    def __init__(self, status_code=200, headers=None, content="content"):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.content = content
+
+
+class MockSession(object):
+    """Stands in for a requests Session, keeping track of the requests
+    made through it.
+    """
+
+    def __init__(self, blocking=False):
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+        # If the session is blocking, each request is released once it
+        # starts, and then waits until `finish` is set.
+        self.started = threading.Semaphore(0)
+        self.finish = threading.Event()
+        if not blocking:
+            self.finish.set()
+
+    def request(self, http_method, url, **kwargs):
+        with self.lock:
+            self.requests.append((http_method, url, kwargs))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        self.started.release()
+        self.finish.wait()
+        with self.lock:
+            self.in_flight -= 1
+        return MockResponse()
+
+
+class TestHTTPPool(object):
+
+    def test_default_timeout(self):
+        pool = HTTPPool(timeout=5)
+        pool.session = MockSession()
+        pool.get("http://example.com/")
+        pool.get("http://example.com/", timeout=1)
+        [(method1, url1, kwargs1), (method2, url2, kwargs2)] = pool.session.requests
+        eq_("GET", method1)
+        eq_(5, kwargs1['timeout'])
+        eq_(True, kwargs1['allow_redirects'])
+        eq_(1, kwargs2['timeout'])
+
+    def test_do_get(self):
+        pool = HTTPPool()
+        pool.session = MockSession()
+        eq_((200, {}, "content"),
+            pool.do_get("http://example.com/", {"Accept": "text/xml"}))
+        pool.do_get_no_redirect("http://example.com/", {})
+        [(m1, u1, kwargs1), (m2, u2, kwargs2)] = pool.session.requests
+        eq_({"Accept": "text/xml"}, kwargs1['headers'])
+        eq_(True, kwargs1['allow_redirects'])
+        eq_(False, kwargs2['allow_redirects'])
+
+    def test_concurrent_requests_limited_per_host(self):
+        pool = HTTPPool(
+            max_concurrent_requests=2, host_limits={"slow.example.com": 1}
+        )
+
+        def check(url, requests, limit):
+            session = MockSession(blocking=True)
+            pool.session = session
+            wait = run_in_background(
+                lambda i: pool.get(url % i), range(requests), requests
+            )
+            # Wait until as many requests as are allowed have started.
+            for i in range(limit):
+                session.started.acquire()
+            eq_(limit, session.in_flight)
+
+            # Let them all finish. No more than `limit` were ever in
+            # flight at once.
+            session.finish.set()
+            wait()
+            eq_(requests, len(session.requests))
+            eq_(limit, session.max_in_flight)
+
+        check("http://example.com/%d", 6, 2)
+        check("http://slow.example.com/%d", 4, 1)
+
+    def test_configure(self):
+        old = shared_pool()
+        old_configured = http_pool.configured
+        try:
+            new = configure(timeout=3, pool_size=2)
+            eq_(new, shared_pool())
+            eq_(True, http_pool.configured)
+            eq_(3, new.timeout)
+            eq_(2, new.pool_size)
+        finally:
+            http_pool.shared = old
+            http_pool.configured = old_configured
+
+
+class TestConfigureFromDatabase(DatabaseTest):
+
+    def setup(self):
+        super(TestConfigureFromDatabase, self).setup()
+        self.old_pool = http_pool.shared
+        self.old_configured = http_pool.configured
+        http_pool.configured = False
+
+    def teardown(self):
+        http_pool.shared = self.old_pool
+        http_pool.configured = self.old_configured
+        super(TestConfigureFromDatabase, self).teardown()
+
+    def test_configure_from_database(self):
+        setting = lambda key: ConfigurationSetting.sitewide(self._db, key)
+        setting(http_pool.POOL_SIZE).value = "3"
+        setting(http_pool.TIMEOUT).value = "7"
+        setting(http_pool.MAX_CONCURRENT_REQUESTS).value = "4"
+        setting(http_pool.HOST_LIMITS).value = json.dumps(
+            {"viaf.org": 2}
+        )
+
+        pool = configure_from_database(self._db)
+        eq_(pool, shared_pool())
+        eq_(3, pool.pool_size)
+        eq_(7, pool.timeout)
+        eq_(4, pool.max_concurrent_requests)
+        eq_({"viaf.org": 2}, pool.host_limits)
+
+        # Once the pool has been configured, it's not replaced.
+        setting(http_pool.TIMEOUT).value = "1"
+        eq_(pool, configure_from_database(self._db))
+        eq_(7, shared_pool().timeout)
+
+    def test_defaults(self):
+        pool = configure_from_database(self._db)
+        eq_(HTTPPool.DEFAULT_TIMEOUT, pool.timeout)
+        eq_(HTTPPool.DEFAULT_MAX_CONCURRENT_REQUESTS,
+            pool.max_concurrent_requests)
+        eq_({}, pool.host_limits)
@@ -12,15 +12,19 @@ from core.coverage import CoverageFailure
 from core.metadata_layer import ReplacementPolicy
 from core.model import (
     CoverageRecord,
+    DataSource,
     ExternalIntegration,
+    Hyperlink,
     PresentationCalculationPolicy,
     Work,
 )
 from core.s3 import MockS3Uploader
 from core.testing import AlwaysSuccessfulCoverageProvider
 
+from cache import annotated_entries
 from integration_client import (
     CalculatesWorkPresentation,
+    CoverImageDownloads,
     IntegrationClientCoverImageCoverageProvider,
     WorkPresentationCoverageProvider,
 )
@@ -68,6 +72,15 @@ class TestWorkPresentationCoverageProvider(DatabaseTest):
         # The work has been made presentation-ready.
         eq_(True, work.presentation_ready)
 
+    def test_process_item_invalidates_annotated_entries(self):
+        work = self._work(with_license_pool=True)
+        [pool] = work.license_pools
+        annotated_entries.set(work, pool, pool.identifier, "<entry/>")
+
+        self.provider.process_item(work)
+        eq_(None, annotated_entries.get(work, pool, pool.identifier))
+        eq_(None, annotated_entries.works.get(work.id))
+
 class TestCalculatesWorkPresentation(DatabaseTest):
 
     # Create a mock provider that uses the mixin.
@@ -178,3 +191,55 @@ class TestIntegrationClientCoverImageCoverageProvider(DatabaseTest):
         [record] = [r for r in work.coverage_records if (
                     r.operation==WorkPresentationCoverageProvider.OPERATION
                     and r.status==CoverageRecord.REGISTERED)]
+
+    def test_prefetch(self):
+        edition, lp = self._edition(with_license_pool=True)
+        identifier = edition.primary_identifier
+        source = DataSource.lookup(self._db, DataSource.GUTENBERG)
+        image, ignore = identifier.add_link(
+            Hyperlink.IMAGE, "http://example.com/cover.png", source
+        )
+        identifier.add_link(
+            Hyperlink.DESCRIPTION, "http://example.com/about", source
+        )
+
+        # Only the cover image needs to be downloaded.
+        downloads = self.provider.prefetch_arguments(identifier)
+        eq_(CoverImageDownloads(
+            identifier.type, identifier.identifier,
+            ["http://example.com/cover.png"]
+        ), downloads)
+
+        requests = []
+        def http_get(url, headers, **kwargs):
+            requests.append(url)
+            if "broken" in url:
+                raise IOError("no luck")
+            return 200, {"content-type": "image/png"}, "an image"
+        self.provider.replacement_policy.http_get = http_get
+        broken = downloads._replace(
+            urls=downloads.urls + ["http://example.com/broken.png"]
+        )
+        self.provider.prefetch(broken)
+        eq_(["http://example.com/cover.png",
+             "http://example.com/broken.png"], requests)
+
+        # When the metadata is applied, the downloaded image is used
+        # instead of being requested again. Anything else is
+        # requested as usual.
+        policy = self.provider.policy_for(identifier)
+        assert policy is not self.provider.replacement_policy
+        eq_(self.provider.replacement_policy.mirror, policy.mirror)
+        eq_((200, {"content-type": "image/png"}, "an image"),
+            policy.http_get("http://example.com/cover.png", {}))
+        eq_(2, len(requests))
+        policy.http_get("http://example.com/cover.png", {})
+        eq_(3, len(requests))
+
+        # Once the prefetched data is used up, the usual policy is used.
+        eq_(self.provider.replacement_policy,
+            self.provider.policy_for(identifier))
+
+        # Without a mirror, cover images aren't downloaded at all.
+        self.provider.replacement_policy.mirror = None
+        eq_([], self.provider.prefetch_arguments(identifier).urls)
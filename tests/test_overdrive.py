@@ -13,8 +13,14 @@ from core.model import (
     ExternalIntegration,
     Identifier,
 )
-from core.overdrive import MockOverdriveAPI
-from overdrive import OverdriveBibliographicCoverageProvider
+from core.overdrive import (
+    MockOverdriveAPI,
+    OverdriveAPI,
+)
+from overdrive import (
+    OverdriveBibliographicCoverageProvider,
+    OverdriveMetadataLookup,
+)
 
 class TestOverdriveBibliographicCoverageProvider(DatabaseTest):
 
@@ -100,3 +106,64 @@ class TestOverdriveBibliographicCoverageProvider(DatabaseTest):
         result = m(self._db, MockOverdriveAPI)
         assert isinstance(result, MockOverdriveAPI)
         eq_(collection2, result.collection)
+
+    def test_prefetch(self):
+        class StubAPI(object):
+            """Just enough of an OverdriveAPI to look up metadata."""
+            METADATA_ENDPOINT = OverdriveAPI.METADATA_ENDPOINT
+            collection_token = "a-collection"
+            token = "a-token"
+
+            def __init__(self):
+                self.creds_checked = False
+                self.requests = []
+                self.responses = []
+
+            def check_creds(self):
+                self.creds_checked = True
+
+            def _do_get(self, url, headers):
+                self.requests.append((url, headers))
+                return self.responses.pop(0)
+
+        collection = MockOverdriveAPI.mock_collection(self._db)
+        api = MockOverdriveAPI(self._db, collection)
+        api.queue_collection_token()
+        provider = OverdriveBibliographicCoverageProvider(
+            collection, api_class=api
+        )
+        provider.api = StubAPI()
+        identifier = self._identifier(
+            Identifier.OVERDRIVE_ID, "3896665d-9d81-4cac-bd43-ffc5066de1f5"
+        )
+
+        # The credentials are found before the background thread
+        # takes over.
+        lookup = provider.prefetch_arguments(identifier)
+        eq_(True, provider.api.creds_checked)
+        eq_(OverdriveMetadataLookup(
+            identifier.type, identifier.identifier, "a-collection", "a-token"
+        ), lookup)
+
+        # Anything but a successful lookup is left for process_item()
+        # to deal with the usual way.
+        provider.api.responses.append((404, {}, '{"errorCode": "NotFound"}'))
+        eq_(None, provider.fetch(lookup))
+        provider.api.responses.append((200, {}, '{"errorCode": "NotFound"}'))
+        eq_(None, provider.fetch(lookup))
+
+        body = self.data_file("overdrive/overdrive_metadata.json")
+        provider.api.requests = []
+        provider.api.responses.append((200, {}, body))
+        provider.prefetch(lookup)
+        [(url, headers)] = provider.api.requests
+        assert "a-collection" in url
+        assert identifier.identifier in url
+        eq_("Bearer a-token", headers['Authorization'])
+
+        # process_item() uses the prefetched data instead of asking
+        # Overdrive again.
+        eq_(identifier, provider.process_item(identifier))
+        eq_(1, len(provider.api.requests))
+        [edition] = identifier.primarily_identifies
+        eq_(u"Agile Documentation", edition.title)
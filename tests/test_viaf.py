@@ -2,6 +2,7 @@
 import logging
 
 from nose.tools import set_trace, eq_
+from lxml import etree
 
 from . import (
     DatabaseTest,
@@ -11,10 +12,18 @@ from . import (
 
 from core.metadata_layer import ContributorData
 from core.model import Contributor
+from core.util.titles import (
+    title_match_ratio,
+    unfluff_title,
+)
 
 from testing import MockVIAFClient
+import viaf
 from viaf import (
     NameParser,
+    VIAFCluster,
+    VIAFClusterRecord,
+    VIAFClusterStore,
     VIAFParser,
     VIAFClient
 )
@@ -98,6 +107,7 @@ class TestVIAFNameParser(DatabaseTest):
 
     def setup(self):
         super(TestVIAFNameParser, self).setup()
+        VIAFParser.clusters.clear()
         self.parser = VIAFParser()
 
     def sample_data(self, filename):
@@ -265,6 +275,170 @@ class TestVIAFNameParser(DatabaseTest):
         eq_(match_confidences['library_popularity'], 4)
 
 
+    def test_parse_cluster(self):
+        xml = self.sample_data("mindy_kaling.xml")
+        tree = etree.fromstring(xml, parser=etree.XMLParser(recover=True))
+        cluster = self.parser.parse_cluster(tree)
+        eq_("9581122", cluster.viaf)
+        assert "Kaling, Mindy" in cluster.sort_names
+        eq_(cluster.sort_names.count("Kaling, Mindy"),
+            cluster.sort_name_popularity["Kaling, Mindy"])
+        assert len(cluster.titles) > 0
+
+        # The parsed cluster is kept around...
+        eq_(cluster, VIAFParser.clusters.get("9581122"))
+
+        # ...and reused the next time the same cluster is parsed.
+        eq_(cluster, VIAFParser().parse_cluster(tree))
+
+        # Passing in a parsed cluster is a no-op.
+        eq_(cluster, self.parser.parse_cluster(cluster))
+
+        # Extracting information from the parsed cluster gives the same
+        # results as extracting it from the XML.
+        from_xml = self.parser.parse(xml, "Kaling, Mindy")
+        from_cluster = self.parser.extract_viaf_info(cluster, "Kaling, Mindy")
+        eq_(from_xml[0].sort_name, from_cluster[0].sort_name)
+        eq_(from_xml[0].display_name, from_cluster[0].display_name)
+        eq_(from_xml[1], from_cluster[1])
+        eq_(from_xml[2], from_cluster[2])
+
+    def test_extract_cluster(self):
+        # The single-pass extractor finds the same information as the
+        # methods that search a cluster for one thing at a time.
+        for filename in (
+            "mindy_kaling.xml", "will_eisner.xml", "mark_twain.xml",
+            "michelle_belanger.xml", "palmer.xml", "howard_j_j.xml",
+        ):
+            xml = self.sample_data(filename)
+            tree = etree.fromstring(xml, parser=etree.XMLParser(recover=True))
+            for cluster in self.parser._clusters(tree):
+                parsed = self.parser.extract_cluster(cluster)
+                eq_(self.parser.viaf_id_for_cluster(cluster), parsed.viaf)
+                eq_(self.parser.extract_wikipedia_name(cluster),
+                    parsed.wikipedia_name)
+                eq_(list(self.parser.sort_names_for_cluster(cluster)),
+                    parsed.sort_names)
+                eq_(list(self.parser.name_titles_for_cluster(cluster)),
+                    parsed.name_titles)
+                eq_(list(self.parser.alternate_name_forms_for_cluster(cluster)),
+                    parsed.alternate_names)
+                unimarcs = cluster.xpath(
+                    './/*[local-name()="datafield"][@dtype="UNIMARC"]'
+                )
+                eq_([self.parser.extract_name_from_unimarc(x)
+                     for x in unimarcs],
+                    parsed.unimarc_names)
+                eq_([x.text for x in cluster.xpath(
+                    './/*[local-name()="titles"]/*[local-name()="work"]/*[local-name()="title"]'
+                )], parsed.titles)
+
+    def test_parse_multiple_iter(self):
+        xml = self.sample_data("amy_levin_all_viaf.xml")
+        name = "Levin, Amy"
+
+        # Candidates are yielded one at a time, as their clusters are
+        # parsed.
+        candidates = self.parser.parse_multiple_iter(
+            xml, working_sort_name=name, page=2
+        )
+        contributor_data, match_confidences, titles = candidates.next()
+        eq_(11, match_confidences['library_popularity'])
+
+        # The streaming parser finds the same candidates as a parser
+        # that builds the whole tree first.
+        VIAFParser.clusters.clear()
+        tree = etree.fromstring(xml, parser=etree.XMLParser(recover=True))
+        expect = [
+            self.parser.extract_viaf_info(cluster, name)
+            for cluster in self.parser._clusters(tree)
+        ]
+        streamed = list(self.parser.parse_multiple_iter(xml, name))
+        eq_([c[0].viaf for c in expect], [c[0].viaf for c in streamed])
+        eq_([c[0].sort_name for c in expect],
+            [c[0].sort_name for c in streamed])
+        eq_([c[2] for c in expect], [c[2] for c in streamed])
+        eq_(range(1, len(streamed)+1),
+            [c[1]['library_popularity'] for c in streamed])
+
+        # Nothing to parse, nothing to yield.
+        eq_([], list(self.parser.parse_multiple_iter(None)))
+
+        # The number of clusters read can be kept track of, whether or
+        # not they turned into candidates.
+        class Picky(VIAFParser):
+            def extract_viaf_info(self, *args, **kwargs):
+                return None, {}, []
+        counts = {}
+        eq_([], list(Picky().parse_multiple_iter(xml, name, counts=counts)))
+        eq_(10, counts['clusters'])
+
+        # Each cluster is parsed with nothing left over from the
+        # clusters that came before it, including the <record> tags
+        # that enclosed them.
+        class Observant(VIAFParser):
+            preceding = []
+            def extract_viaf_info(self, cluster, *args, **kwargs):
+                self.preceding.append(cluster.xpath('count(preceding::*)'))
+                return None, {}, []
+        list(Observant().parse_multiple_iter(xml, name))
+        eq_(10, len(Observant.preceding))
+        eq_(1, len(set(Observant.preceding[1:])))
+        assert Observant.preceding[-1] < 10
+
+    def test_discard(self):
+        root = etree.fromstring(
+            "<records><version/><record><a/><b/></record>"
+            "<record><c/><d/></record><record><e/></record></records>"
+        )
+        d = root.xpath("//d")[0]
+        VIAFParser._discard(d)
+
+        # The element, its earlier siblings, and its ancestors'
+        # earlier siblings are all gone. What comes after is left
+        # alone.
+        eq_('<records><record><d/></record><record><e/></record></records>',
+            etree.tostring(root))
+
+    def test_number_of_records(self):
+        m = VIAFParser.number_of_records
+        eq_(13, m(self.sample_data("amy_levin_all_viaf.xml")))
+        eq_(1, m(self.sample_data("mindy_kaling.xml")))
+        eq_(None, m(self.sample_data("will_eisner.xml")))
+        eq_(None, m(None))
+
+    def test_normalize_title(self):
+        title = "Pride and Prejudice (Unabridged)"
+        normalized = VIAFParser.normalize_title(title)
+
+        # Normalized titles are equal exactly when name_matches()
+        # would say the unfluffed titles match.
+        eq_(VIAFParser.name_matches(
+            unfluff_title(title), unfluff_title("Pride and prejudice")),
+            normalized == VIAFParser.normalize_title("Pride and prejudice")
+        )
+
+    def test_weigh_titles_memo(self):
+        memo = {}
+        match_confidences = dict(total=0)
+        VIAFParser.weigh_titles(
+            ["Emma"], ["Emma: A Novel", "Persuasion"], match_confidences,
+            memo=memo
+        )
+
+        # The known title was normalized once, and each comparison's
+        # result was remembered for the next candidate.
+        eq_(VIAFParser.normalize_title("Emma"), memo[("normalized", "Emma")])
+        eq_(title_match_ratio("Emma", "Emma: A Novel"),
+            memo[("ratio", "Emma", "Emma: A Novel")])
+
+        # The memo doesn't change the outcome.
+        without_memo = dict(total=0)
+        VIAFParser.weigh_titles(
+            ["Emma"], ["Emma: A Novel", "Persuasion"], without_memo
+        )
+        eq_(without_memo, match_confidences)
+
     def test_birthdates(self):
         # TODO: waiting on https://github.com/NYPL-Simplified/Simplified/issues/61
         # Good for testing separating authors by birth dates -- VIAF has several Amy Levins, with different birthdates.
@@ -286,6 +460,111 @@ class TestVIAFNameParser(DatabaseTest):
         # make sure birthdate is 1986
 
 
+class TestBatchScoring(object):
+    """Test that VIAFParser's batch scoring API weighs and orders
+    candidates exactly the way weigh_contributor would.
+    """
+
+    # (sample file, working sort name, known titles)
+    LOOKUPS = [
+        ("amy_levin_all_viaf.xml", "Levin, Amy", None),
+        ("amy_levin_all_viaf.xml", "Levin, Amy", ["Faithfully Feminist"]),
+        ("john_jewel_all_viaf.xml", "Jewel, John",
+         ["The Apology of the Church of England"]),
+        ("john_jewel_all_viaf.xml", "Jewel, John", None),
+        ("howard_j_j.xml", "Howard, J. J.", None),
+        ("lancelyn_green.xml", "Green, Roger Lancelyn", ["The Hobbit"]),
+        ("mindy_kaling.xml", "Kaling, Mindy", None),
+    ]
+
+    def setup(self):
+        self.parser = VIAFParser()
+
+    def lookups(self):
+        """Parse a fresh set of candidates for every lookup."""
+        lookups = []
+        for filename, name, known_titles in self.LOOKUPS:
+            xml = sample_data(filename, "viaf")
+            candidates = self.parser.parse_multiple(
+                xml, working_sort_name=name
+            )
+            lookups.append((candidates, name, known_titles))
+        return lookups
+
+    def one_at_a_time(self, strict):
+        """Weigh and order every lookup with weigh_contributor."""
+        weights = []
+        orders = []
+        for candidates, name, known_titles in self.lookups():
+            by_popularity = sorted(
+                candidates, key=lambda c: c[1].get('library_popularity')
+            )
+            ignore_popularity = self.parser.should_ignore_popularity(
+                by_popularity[0]
+            )
+            weight = lambda c: self.parser.weigh_contributor(
+                c, name, known_titles=known_titles, strict=strict,
+                ignore_popularity=ignore_popularity
+            )
+            weights.append([weight(c) for c in candidates])
+            ordered = sorted(by_popularity, key=weight, reverse=True)
+            orders.append([c[0].viaf for c in ordered])
+        return weights, orders
+
+    def check_parity(self, strict=False):
+        expect_weights, expect_orders = self.one_at_a_time(strict)
+
+        weights = self.parser.weigh_candidate_lists(
+            self.lookups(), strict=strict
+        )
+        eq_(expect_weights, [list(x) for x in weights])
+
+        ordered = self.parser.order_candidate_lists(
+            self.lookups(), strict=strict
+        )
+        eq_(expect_orders, [[c[0].viaf for c in x] for x in ordered])
+
+        # order_candidates goes through the batch API.
+        eq_(expect_orders, [
+            [c[0].viaf for c in self.parser.order_candidates(
+                candidates, name, known_titles=known_titles, strict=strict
+            )]
+            for candidates, name, known_titles in self.lookups()
+        ])
+
+    def test_parity(self):
+        # NumPy is a requirement, so this exercises the array code.
+        assert viaf.numpy is not None
+        self.check_parity()
+
+    def test_parity_strict(self):
+        self.check_parity(strict=True)
+
+    def test_parity_without_numpy(self):
+        old_numpy = viaf.numpy
+        viaf.numpy = None
+        try:
+            self.check_parity()
+            self.check_parity(strict=True)
+        finally:
+            viaf.numpy = old_numpy
+
+    def test_match_confidences_updated(self):
+        # Like weigh_contributor, the batch API leaves each
+        # candidate's weight in its match_confidences.
+        candidates, name, known_titles = self.lookups()[1]
+        [weights] = self.parser.weigh_candidate_lists(
+            [(candidates, name, known_titles)]
+        )
+        eq_(list(weights), [c[1]['total'] for c in candidates])
+
+    def test_empty_lookups(self):
+        eq_([], self.parser.weigh_candidate_lists([]))
+        eq_([[]], [list(x) for x in
+                   self.parser.weigh_candidate_lists([([], "Name", None)])])
+        eq_([[]], self.parser.order_candidate_lists([([], "Name", None)]))
+
+
 class MockVIAFClientLookup(MockVIAFClient, VIAFClient):
     """A mocked VIAFClient that can queue mocked lookup results and
     still be used to test VIAFClient#process_contributor.
@@ -300,6 +579,7 @@ class TestVIAFClient(DatabaseTest):
 
     def setup(self):
         super(TestVIAFClient, self).setup()
+        VIAFParser.clusters.clear()
         self.client = VIAFClient(self._db)
         self.log = logging.getLogger("VIAF Client Test")
 
@@ -378,6 +658,87 @@ class TestVIAFClient(DatabaseTest):
         eq_(selected_candidate.viaf, "9581122")
         eq_(selected_candidate.sort_name, "Kaling, Mindy")
 
+    def test_lookup_by_viaf_reuses_parsed_cluster(self):
+        h = self.queue_file_in_mock_http("mindy_kaling.xml")
+        self.client.lookup_by_viaf(viaf="9581122", do_get=h.do_get)
+        eq_(1, len(h.requests))
+
+        # The second lookup doesn't touch the network or the
+        # Representation.
+        def do_get(*args, **kwargs):
+            raise Exception("Should not be called!")
+        (selected_candidate, match_confidences,
+         contributor_titles) = self.client.lookup_by_viaf(
+             viaf="9581122", do_get=do_get
+         )
+        eq_("Kaling, Mindy", selected_candidate.sort_name)
+
+        # Neither does a lookup of the cluster's name titles.
+        eq_(VIAFParser.clusters.get("9581122").name_titles,
+            self.client.lookup_name_title("9581122", do_get=do_get))
+
+    def test_lookup_by_viaf_uses_stored_cluster(self):
+        h = self.queue_file_in_mock_http("mindy_kaling.xml")
+        self.client.lookup_by_viaf(viaf="9581122", do_get=h.do_get)
+
+        # The parsed cluster was stored in the database.
+        [record] = self._db.query(VIAFClusterRecord).all()
+        eq_("9581122", record.viaf)
+        assert "Kaling, Mindy" in record.data['sort_names']
+
+        # Once it's been forgotten in memory, and the Representation
+        # is gone, the stored cluster is used instead.
+        VIAFParser.clusters.clear()
+        self._db.query(viaf.Representation).delete()
+        def do_get(*args, **kwargs):
+            raise Exception("Should not be called!")
+        (selected_candidate, match_confidences,
+         contributor_titles) = self.client.lookup_by_viaf(
+             viaf="9581122", do_get=do_get
+         )
+        eq_("Kaling, Mindy", selected_candidate.sort_name)
+
+
+class TestVIAFClusterStore(DatabaseTest):
+
+    def setup(self):
+        super(TestVIAFClusterStore, self).setup()
+        VIAFParser.clusters.clear()
+        self.store = VIAFClusterStore(self._db)
+
+    def test_get_and_set(self):
+        eq_(None, self.store.get("123"))
+
+        cluster = VIAFCluster(
+            viaf="123", wikipedia_name="Mindy_Kaling",
+            sort_names=["Kaling, Mindy", "Kaling, Mindy"],
+            unimarc_names=[("Mindy", "Kaling", None, "Kaling, Mindy")],
+            titles=["Is Everyone Hanging Out Without Me?"],
+        )
+        self.store.set(cluster)
+        eq_(cluster, self.store.get("123"))
+
+        # Even once it's gone from memory, the cluster can be rebuilt
+        # from the database.
+        VIAFParser.clusters.clear()
+        stored = self.store.get("123")
+        assert stored is not cluster
+        eq_("123", stored.viaf)
+        eq_(cluster.to_dict(), stored.to_dict())
+        eq_([("Mindy", "Kaling", None, "Kaling, Mindy")],
+            stored.unimarc_names)
+        eq_(2, stored.sort_name_popularity["Kaling, Mindy"])
+
+        # A stale cluster is ignored.
+        VIAFParser.clusters.clear()
+        record = self._db.query(VIAFClusterRecord).one()
+        record.timestamp -= VIAFClusterStore.MAX_AGE
+        eq_(None, self.store.get("123"))
+
+    def test_set_ignores_cluster_without_viaf_id(self):
+        self.store.set(VIAFCluster(sort_names=["Kaling, Mindy"]))
+        eq_([], self._db.query(VIAFClusterRecord).all())
+
     def test_lookup_by_name(self):
         # there can be one and only one Mindy
         h = self.queue_file_in_mock_http("mindy_kaling.xml")
@@ -387,3 +748,163 @@ class TestVIAFClient(DatabaseTest):
          contributor_titles) = self.client.lookup_by_name(sort_name="Mindy Kaling", do_get=h.do_get)
         eq_(selected_candidate.viaf, "9581122")
         eq_(selected_candidate.sort_name, "Kaling, Mindy")
+
+    def test_lookup_by_name_stops_when_no_better_match_is_possible(self):
+        # Every page of search results contains Mindy Kaling.
+        xml = self.sample_data("mindy_kaling.xml")
+        requests = []
+        def do_get(url, headers, **kwargs):
+            requests.append(url)
+            return 200, {"content-type": "text/xml"}, xml
+
+        (selected_candidate, match_confidences,
+         contributor_titles) = self.client.lookup_by_name(
+             sort_name="Mindy Kaling", do_get=do_get
+         )
+        eq_("Kaling, Mindy", selected_candidate.sort_name)
+
+        # The first page wasn't full, so there was no point in asking
+        # for another one.
+        eq_(1, len(requests))
+        assert "startRecord=1&" in requests[0]
+
+        # Every page of these search results is full.
+        xml = self.sample_data("amy_levin_all_viaf.xml")
+        requests = []
+
+        # Keep track of which pages are fetched in the background. A
+        # page that's prefetched but never read is never requested.
+        prefetched = []
+        def prefetch(url, do_get):
+            prefetched.append(url)
+            return do_get
+        self.client.prefetch = prefetch
+
+        # If no candidate on a later page could beat the best
+        # candidate so far, the next page isn't read. VIAF said there
+        # were more clusters, so it was being fetched in the
+        # background before that became clear.
+        class Hopeless(VIAFParser):
+            @classmethod
+            def best_possible_weight(cls, *args, **kwargs):
+                return -1000
+        self.client.parser = Hopeless()
+        self.client.MINIMUM_MATCH_WEIGHT = -1000
+        self.client.lookup_by_name(sort_name="Levin, Amy", do_get=do_get)
+        eq_(1, len(requests))
+        eq_(1, len(prefetched))
+        assert "startRecord=11&" in prefetched[0]
+
+        # Otherwise, pages are fetched until MAXIMUM_PAGES is reached
+        # -- but not beyond.
+        class Hopeful(VIAFParser):
+            @classmethod
+            def best_possible_weight(cls, *args, **kwargs):
+                return 1000
+        self.client.parser = Hopeful()
+        self.client.MAXIMUM_PAGES = 3
+        requests = []
+        prefetched = []
+        self.client.lookup_by_name(sort_name="Levin, Amy", do_get=do_get)
+        eq_(3, len(requests))
+        assert "startRecord=21&" in requests[-1]
+
+        # VIAF said there were 13 clusters, so only the second page
+        # was known to be needed before the one before it was
+        # parsed. The third page was only requested once the second
+        # turned out to be full.
+        eq_(1, len(prefetched))
+        assert "startRecord=11&" in prefetched[0]
+
+        # Pages that are already cached aren't fetched again.
+        requests = []
+        prefetched = []
+        self.client.lookup_by_name(sort_name="Levin, Amy", do_get=do_get)
+        eq_([], requests)
+        eq_([], prefetched)
+
+    def test_lookup_by_name_prefetches_before_parsing(self):
+        xml = self.sample_data("amy_levin_all_viaf.xml")
+        def do_get(url, headers, **kwargs):
+            return 200, {"content-type": "text/xml"}, xml
+
+        class CountingParser(VIAFParser):
+            weighed = []
+            @classmethod
+            def weigh_contributor(cls, candidate, *args, **kwargs):
+                cls.weighed.append(candidate)
+                return super(CountingParser, cls).weigh_contributor(
+                    candidate, *args, **kwargs
+                )
+        self.client.parser = CountingParser()
+
+        # The next page starts downloading before anything on the
+        # current page has been weighed.
+        weighed_at_prefetch = []
+        def prefetch(url, do_get):
+            weighed_at_prefetch.append(len(CountingParser.weighed))
+            return do_get
+        self.client.prefetch = prefetch
+        self.client.MAXIMUM_PAGES = 2
+        self.client.lookup_by_name(sort_name="Levin, Amy", do_get=do_get)
+        eq_([0], weighed_at_prefetch)
+
+    def test_lookup_by_name_counts_clusters_not_candidates(self):
+        xml = self.sample_data("amy_levin_all_viaf.xml")
+        requests = []
+        def do_get(url, headers, **kwargs):
+            requests.append(url)
+            return 200, {"content-type": "text/xml"}, xml
+
+        # Only some of the clusters on each page turn into candidates.
+        class Picky(VIAFParser):
+            def extract_viaf_info(self, cluster, *args, **kwargs):
+                result = super(Picky, self).extract_viaf_info(
+                    cluster, *args, **kwargs
+                )
+                if result[0] and int(result[0].viaf or 0) % 2:
+                    return None, {}, []
+                return result
+
+            # Nothing is good enough to stop the search early.
+            @classmethod
+            def best_possible_weight(cls, *args, **kwargs):
+                return 1000
+        self.client.parser = Picky()
+        self.client.MAXIMUM_PAGES = 2
+
+        # The first page is still full, so the second page is read.
+        self.client.lookup_by_name(sort_name="Levin, Amy", do_get=do_get)
+        eq_(2, len(requests))
+
+    def test_lookup_by_name_weighs_each_candidate_once(self):
+        class CountingParser(VIAFParser):
+            weighed = []
+            @classmethod
+            def weigh_contributor(cls, candidate, *args, **kwargs):
+                cls.weighed.append(candidate)
+                return super(CountingParser, cls).weigh_contributor(
+                    candidate, *args, **kwargs
+                )
+        self.client.parser = CountingParser()
+
+        h = self.queue_file_in_mock_http("amy_levin_all_viaf.xml")
+        self.client.lookup_by_name(sort_name="Levin, Amy", do_get=h.do_get)
+        assert len(CountingParser.weighed) > 1
+        eq_(len(CountingParser.weighed),
+            len(set(id(x) for x in CountingParser.weighed)))
+
+    def test_best_possible_weight(self):
+        m = VIAFParser.best_possible_weight
+        top = m(1)
+        eq_(VIAFParser.MAX_NAME_WEIGHT - 10, top)
+
+        # Less popular clusters can't do as well.
+        eq_(top - 100, m(11))
+
+        # Unless popularity is being ignored.
+        eq_(VIAFParser.MAX_NAME_WEIGHT, m(11, ignore_popularity=True))
+
+        # Each known title can add to the weight.
+        eq_(top + 2 * VIAFParser.MAX_TITLE_WEIGHT,
+            m(1, known_titles=["a", "b"]))
@@ -1,22 +1,41 @@
+import datetime
 import logging
 import os
 import re
+from io import BytesIO
 
 from nose.tools import set_trace
 from lxml import etree
 from fuzzywuzzy import fuzz
+from sqlalchemy import (
+    Column,
+    DateTime,
+    Integer,
+    Unicode,
+)
+from sqlalchemy.dialects.postgresql import JSON
 
 from collections import Counter, defaultdict
 
+from cache import LRUCache
+from concurrency import run_in_background
+from http_pool import (
+    configure_from_database,
+    shared_pool,
+)
+
 from core.metadata_layer import (
     ContributorData,
     Metadata,
 )
 
 from core.model import (
+    Base,
     Contributor,
     DataSource,
     Representation,
+    get_one,
+    get_one_or_create,
 )
 
 from core.util.personal_names import (
@@ -36,6 +55,12 @@ from core.util.xmlparser import (
     XMLParser,
 )
 
+try:
+    # Used for scoring large batches of VIAF candidates, if it's
+    # available.
+    import numpy
+except ImportError, e:
+    numpy = None
 
 class NameParser(object):
     """Parse VIAF-style personal names.
@@ -96,12 +121,148 @@ class NameParser(object):
 
         return name_without_lifespan.strip(), birth, death
 
+class VIAFCluster(object):
+    """The information from a VIAF cluster that's needed to evaluate it
+    as a match for some contributor, extracted once so that the
+    XML doesn't have to be searched again.
+    """
+
+    def __init__(self, viaf=None, wikipedia_name=None, sort_names=None,
+                 name_titles=None, alternate_names=None, unimarc_names=None,
+                 titles=None):
+        """Constructor.
+
+        :param sort_names: The names in the cluster's MARC21 100 and
+            110 fields, in the order they were found.
+        :param name_titles: The titles (e.g. "Sir") from those fields.
+        :param alternate_names: The names in the cluster's MARC21 400
+            and 700 fields.
+        :param unimarc_names: A list of (given name, family name,
+            extra, sort name) 4-tuples, one per UNIMARC record.
+        :param titles: The titles of works attributed to the
+            contributor.
+        """
+        self.viaf = viaf
+        self.wikipedia_name = wikipedia_name
+        self.sort_names = sort_names or []
+        self.name_titles = name_titles or []
+        self.alternate_names = alternate_names or []
+        self.unimarc_names = unimarc_names or []
+        self.titles = titles or []
+
+    @property
+    def sort_name_popularity(self):
+        """How many times each sort name shows up in the cluster."""
+        popularity = Counter()
+        for sort_name in self.sort_names:
+            if sort_name.endswith(","):
+                sort_name = sort_name[:-1]
+            popularity[sort_name] += 1
+        return popularity
+
+    FIELDS = ('wikipedia_name', 'sort_names', 'name_titles',
+              'alternate_names', 'unimarc_names', 'titles')
+
+    def to_dict(self):
+        """Turn this cluster into something that can be stored as JSON."""
+        return dict((field, getattr(self, field)) for field in self.FIELDS)
+
+    @classmethod
+    def from_dict(cls, viaf, data):
+        """Rebuild a VIAFCluster from the output of to_dict()."""
+        data = dict(data)
+        data['unimarc_names'] = [
+            tuple(parts) for parts in data.get('unimarc_names') or []
+        ]
+        return cls(viaf=viaf, **data)
+
+    def __repr__(self):
+        return "<VIAFCluster viaf=%s sort_names=%r>" % (
+            self.viaf, self.sort_names
+        )
+
+
+class VIAFClusterRecord(Base):
+    """A VIAFCluster, stored so that it survives restarts and is
+    shared between processes.
+    """
+    __tablename__ = 'viafclusters'
+    id = Column(Integer, primary_key=True)
+    viaf = Column(Unicode, nullable=False, unique=True)
+
+    # The output of VIAFCluster.to_dict().
+    data = Column(JSON, nullable=False)
+
+    timestamp = Column(DateTime, nullable=False)
+
+
+class VIAFClusterStore(object):
+    """Keeps parsed VIAFClusters, keyed by VIAF ID, so a cluster that's
+    been parsed once doesn't need to be fetched or parsed again.
+
+    Clusters are kept in memory, in `VIAFParser.clusters`, and also
+    stored as VIAFClusterRecords.
+    """
+
+    # The same amount of time a cluster's Representation is considered
+    # fresh.
+    MAX_AGE = datetime.timedelta(days=30*6)
+
+    def __init__(self, _db):
+        self._db = _db
+
+    def get(self, viaf):
+        """Look for a fresh VIAFCluster with the given VIAF ID.
+
+        :return: A VIAFCluster, or None.
+        """
+        cluster = VIAFParser.clusters.get(viaf)
+        if cluster:
+            return cluster
+
+        record = get_one(self._db, VIAFClusterRecord, viaf=unicode(viaf))
+        if not record:
+            return None
+        remaining = (
+            record.timestamp + self.MAX_AGE - datetime.datetime.utcnow()
+        ).total_seconds()
+        if remaining <= 0:
+            return None
+        cluster = VIAFCluster.from_dict(viaf, record.data)
+        VIAFParser.clusters.set(viaf, cluster)
+        return cluster
+
+    def set(self, cluster):
+        """Store a VIAFCluster."""
+        if not cluster.viaf:
+            return
+        VIAFParser.clusters.set(cluster.viaf, cluster)
+        data = cluster.to_dict()
+        now = datetime.datetime.utcnow()
+        record, is_new = get_one_or_create(
+            self._db, VIAFClusterRecord, viaf=unicode(cluster.viaf),
+            create_method_kwargs=dict(data=data, timestamp=now)
+        )
+        record.data = data
+        record.timestamp = now
+
+
 class VIAFParser(XMLParser):
 
     NAMESPACES = {'ns2' : "http://viaf.org/viaf/terms#"}
 
     log = logging.getLogger("VIAF Parser")
     wikidata_id = re.compile("^Q[0-9]")
+    number_of_records_tag = re.compile(
+        "<(?:[A-Za-z0-9_]+:)?numberOfRecords[^>]*>\\s*([0-9]+)"
+    )
+
+    # Parsed VIAFClusters, keyed by VIAF ID. This is shared by every
+    # parser, so a cluster seen in one set of search results doesn't
+    # need to be parsed again when it shows up in another, or when
+    # it's looked up directly. Clusters that are looked up directly
+    # are also stored in the database by VIAFClusterStore.
+    clusters = LRUCache(5000, ttl=60*60*24)
 
     @classmethod
     def combine_nameparts(self, given, family, extra):
@@ -131,6 +292,14 @@ class VIAFParser(XMLParser):
         return n1.replace(".", "").lower() == n2.replace(".", "").lower()
 
 
+    @classmethod
+    def normalize_title(cls, title):
+        """Normalize a title so that two titles match according to
+        name_matches() exactly when their normalized forms are equal.
+        """
+        return unfluff_title(title).replace(".", "").lower()
+
+
     @classmethod
     def prepare_contributor_name_for_matching(cls, name):
         """
@@ -141,8 +310,80 @@ class VIAFParser(XMLParser):
         return normalize_contributor_name_for_matching(name)
 
 
+    # How much each kind of name match counts towards a candidate's
+    # weight in weigh_contributor, in the order they're added up.
+    NAME_MATCH_WEIGHTS = [
+        ("sort_name", 2),
+        ("display_name", 0.5),
+        ("unimarc", 0.3),
+        ("guessed_sort_name", 0.5),
+        ("alternate_name", 0.2),
+    ]
+
+    # How much weigh_contributor adds for having a display name, and
+    # for having a VIAF ID.
+    DATA_QUALITY_WEIGHT = 0.2
+
+    # The most that weigh_contributor will give a candidate for name
+    # matches and data quality: a perfect match on the sort name,
+    # display name, UNIMARC record, guessed sort name and alternate
+    # name, plus a display name and a VIAF ID.
+    MAX_NAME_WEIGHT = (
+        sum(weight * 100 for key, weight in NAME_MATCH_WEIGHTS)
+        + 2 * DATA_QUALITY_WEIGHT
+    )
+
+    # The most that weigh_titles will give a candidate for each known
+    # title.
+    MAX_TITLE_WEIGHT = 0.8 * 100
+
+    @classmethod
+    def best_possible_weight(cls, library_popularity, known_titles=None,
+                             ignore_popularity=False):
+        """The highest weight weigh_contributor could possibly give a
+        candidate with the given library popularity.
+
+        This makes it possible to tell when no candidate further down
+        a list of search results could do better than a candidate
+        we've already seen.
+        """
+        weight = cls.MAX_NAME_WEIGHT
+        weight += cls.MAX_TITLE_WEIGHT * len(known_titles or [])
+        if not ignore_popularity:
+            weight += -10 * library_popularity
+        return weight
+
+
+    @classmethod
+    def should_ignore_popularity(cls, most_popular_candidate):
+        """Should library popularity be ignored when weighing a set of
+        candidates?
+
+        If the top library popularity candidate is a really bad name
+        match, then don't penalize the bottom popularity candidates
+        for being on the bottom.
+        """
+        (contributor_data, match_confidences,
+         contributor_titles) = most_popular_candidate
+        ignore_popularity = False
+        if match_confidences.get("library_popularity") == 1:
+            if ("sort_name" in match_confidences and
+                match_confidences["sort_name"] < 50):
+                # baaad match
+                ignore_popularity = True
+
+            if ("guessed_sort_name" in match_confidences and
+                match_confidences["guessed_sort_name"] < 50):
+                ignore_popularity = True
+
+            if (("sort_name" not in match_confidences) and
+                ("guessed_sort_name" not in match_confidences)):
+                ignore_popularity = True
+        return ignore_popularity
+
+
     @classmethod
-    def weigh_contributor(cls, candidate, working_sort_name, known_titles=None, strict=False, ignore_popularity=False):
+    def weigh_contributor(cls, candidate, working_sort_name, known_titles=None, strict=False, ignore_popularity=False, memo=None):
         """ Find the author who corresponds the best to the working_sort_name.
             Consider as evidence of suitability:
             - top-most in viaf-returned xml (most popular in libraries)
@@ -153,6 +394,8 @@ class VIAFParser(XMLParser):
             So, if the total match confidence is 110%, that's acceptable, and may not even
             be the best match if there's a 120% out there.  But having an exact title match
             does matter more than a fuzzy unimarc tag match.
+
+            :param memo: A dictionary passed along to weigh_titles().
         """
         report_string = "no_viaf"
         (contributor, match_confidences, contributor_titles) = candidate
@@ -185,42 +428,27 @@ class VIAFParser(XMLParser):
             match_confidences["total"] += -10 * match_confidences["library_popularity"]
             report_string += ", pop=10 * %s" % match_confidences["library_popularity"]
 
-        if "sort_name" in match_confidences:
+        if strict and match_confidences.get("sort_name", 90) < 90:
             # fuzzy match filter may not always give a 100% match, so cap arbitrarily at 90% as a "sure match"
-            if strict and match_confidences["sort_name"] < 90:
-                match_confidences["total"] = 0
-                report_string += ", strict and no sort_name match, return 0 (%s)" % match_confidences["sort_name"]
-                return 0
-
-            match_confidences["total"] += 2 * match_confidences["sort_name"]
-            report_string += ", mc[sort_name]= %s" % match_confidences["sort_name"]
+            match_confidences["total"] = 0
+            report_string += ", strict and no sort_name match, return 0 (%s)" % match_confidences["sort_name"]
+            return 0
 
-        if "display_name" in match_confidences:
-            match_confidences["total"] += 0.5 * match_confidences["display_name"]
-            report_string += ", mc[display_name]=%s" % match_confidences["display_name"]
-
-        if "unimarc" in match_confidences:
-            match_confidences["total"] += 0.3 * match_confidences["unimarc"]
-            report_string += ", mc[unimarc]=%s" % match_confidences["unimarc"]
-
-        if "guessed_sort_name" in match_confidences:
-            match_confidences["total"] += 0.5 * match_confidences["guessed_sort_name"]
-            report_string += ", mc[guessed_sort_name]=%s" % match_confidences["guessed_sort_name"]
-
-        if "alternate_name" in match_confidences:
-            match_confidences["total"] += 0.2 * match_confidences["alternate_name"]
-            report_string += ", mc[alternate_name]=%s" % match_confidences["alternate_name"]
+        for key, weight in cls.NAME_MATCH_WEIGHTS:
+            if key in match_confidences:
+                match_confidences["total"] += weight * match_confidences[key]
+                report_string += ", mc[%s]=%s" % (key, match_confidences[key])
 
         # Add in some data quality evidence.  We want the contributor to have recognizable
         # data to work with.
         if contributor.display_name:
-            match_confidences["total"] += 0.2
+            match_confidences["total"] += cls.DATA_QUALITY_WEIGHT
             report_string += ", have contributor.display_name=%s" % contributor.display_name
 
         if contributor.viaf:
-            match_confidences["total"] += 0.2
+            match_confidences["total"] += cls.DATA_QUALITY_WEIGHT
 
-        cls.weigh_titles(known_titles, contributor_titles, match_confidences, strict)
+        cls.weigh_titles(known_titles, contributor_titles, match_confidences, strict, memo=memo)
         if "title" in match_confidences:
             report_string += ", mc[title]=%s" % match_confidences["title"]
 
@@ -233,7 +461,28 @@ class VIAFParser(XMLParser):
 
 
     @classmethod
-    def weigh_titles(cls, known_titles=None, contributor_titles=None, match_confidences=None, strict=False):
+    def weigh_titles(cls, known_titles=None, contributor_titles=None, match_confidences=None, strict=False, memo=None):
+        """
+        :param memo: A dictionary for remembering normalized titles and
+            title match ratios. Pass in the same dictionary when weighing
+            a number of candidates against the same known titles, and
+            throw it away afterwards.
+        """
+        if memo is None:
+            memo = {}
+
+        def normalized(title):
+            key = ("normalized", title)
+            if key not in memo:
+                memo[key] = cls.normalize_title(title)
+            return memo[key]
+
+        def ratio(known_title, contributor_title):
+            key = ("ratio", known_title, contributor_title)
+            if key not in memo:
+                memo[key] = title_match_ratio(known_title, contributor_title)
+            return memo[key]
+
         if known_titles:
             for known_title in known_titles:
                 if strict:
@@ -255,7 +504,7 @@ class VIAFParser(XMLParser):
                         # TODO: In future, consider doing:
                         # "Pride and Prejudice (Spanish)" should connect to two authors --
                         # Jane Austen and the translator.
-                        if cls.name_matches(unfluff_title(contributor_title), unfluff_title(known_title)):
+                        if normalized(contributor_title) == normalized(known_title):
                             match_confidences["title"] = 90
                             match_confidences["total"] += 0.8 * match_confidences["title"]
                             # match is good enough, we can stop
@@ -266,7 +515,7 @@ class VIAFParser(XMLParser):
                         <ns1:title>Britain, detente and changing east-west relations</ns1:title> (with accented e in detente)
                         doesn't match "Britain, Detente and Changing East-West Relations" in our DB.
                         '''
-                        match_confidence = title_match_ratio(known_title, contributor_title)
+                        match_confidence = ratio(known_title, contributor_title)
                         match_confidences["title"] = match_confidence
                         if match_confidence > 80:
                             match_confidences["total"] += 0.6 * match_confidence
@@ -275,34 +524,156 @@ class VIAFParser(XMLParser):
 
 
 
+    # Compiled versions of the XPath expressions used to pick apart a
+    # VIAF cluster. Compiling them once saves lxml from re-parsing the
+    # expressions for every cluster.
+    _marc21_subfields = etree.XPath(
+        './/*[local-name()="datafield"][@dtype="MARC21"][@tag=$tag]'
+        '/*[local-name()="subfield"][@code=$code]'
+    )
+    _clusters = etree.XPath('//*[local-name()="VIAFCluster"]')
+    _sources = etree.XPath(
+        './/*[local-name()="sources"]/*[local-name()="source"]'
+    )
+    _unimarc_subfield = etree.XPath(
+        'ns2:subfield[@code=$code]', namespaces=NAMESPACES
+    )
+
+    @classmethod
+    def _local_name(cls, element):
+        """Strip the namespace from an element's tag."""
+        tag = element.tag
+        return tag[tag.rfind('}')+1:]
+
     def alternate_name_forms_for_cluster(self, cluster):
         """Find all pseudonyms in the given cluster."""
         for tag in ('400', '700'):
-            for data_field in self._xpath(
-                    cluster, './/*[local-name()="datafield"][@dtype="MARC21"][@tag="%s"]' % tag):
-                for potential_match in self._xpath(
-                        data_field, '*[local-name()="subfield"][@code="a"]'):
-                    yield potential_match.text
+            for potential_match in self._marc21_subfields(
+                    cluster, tag=tag, code="a"):
+                yield potential_match.text
 
 
     def sort_names_for_cluster(self, cluster):
         """Find all sort names for the given cluster."""
         for tag in ('100', '110'):
-            for data_field in self._xpath(
-                    cluster, './/*[local-name()="datafield"][@dtype="MARC21"][@tag="%s"]' % tag):
-                for potential_match in self._xpath(
-                        data_field, '*[local-name()="subfield"][@code="a"]'):
-                    yield potential_match.text
+            for potential_match in self._marc21_subfields(
+                    cluster, tag=tag, code="a"):
+                yield potential_match.text
 
 
     def name_titles_for_cluster(self, cluster):
         """Find all sort names for the given cluster."""
         for tag in ('100', '110'):
-            for data_field in self._xpath(
-                    cluster, './/*[local-name()="datafield"][@dtype="MARC21"][@tag="%s"]' % tag):
-                for potential_match in self._xpath(
-                        data_field, '*[local-name()="subfield"][@code="c"]'):
-                    yield potential_match.text
+            for potential_match in self._marc21_subfields(
+                    cluster, tag=tag, code="c"):
+                yield potential_match.text
+
+
+    def viaf_id_for_cluster(self, cluster):
+        """Find the VIAF ID of the given cluster.
+
+        The viafID tag comes near the start of a cluster, so this
+        stops looking as soon as it's found.
+        """
+        for element in cluster.iterdescendants():
+            if (isinstance(element.tag, basestring)
+                and self._local_name(element) == 'viafID'):
+                return element.text
+        return None
+
+
+    def parse_cluster(self, cluster):
+        """Extract everything we might need from a VIAF cluster.
+
+        The result is kept in `VIAFParser.clusters`, and reused the
+        next time a cluster with the same VIAF ID is parsed.
+
+        :param cluster: An lxml element for a VIAFCluster tag, or a
+            VIAFCluster that's already been parsed.
+        :return: A VIAFCluster.
+        """
+        if isinstance(cluster, VIAFCluster):
+            return cluster
+
+        viaf = self.viaf_id_for_cluster(cluster)
+        if viaf is not None:
+            parsed = self.clusters.get(viaf)
+            if parsed:
+                return parsed
+
+        parsed = self.extract_cluster(cluster)
+        if viaf:
+            self.clusters.set(viaf, parsed)
+        return parsed
+
+
+    def extract_cluster(self, cluster):
+        """Turn a VIAF cluster into a VIAFCluster in a single pass over
+        the cluster's elements.
+
+        This finds the same information as viaf_id_for_cluster,
+        extract_wikipedia_name, sort_names_for_cluster,
+        name_titles_for_cluster, alternate_name_forms_for_cluster
+        and extract_name_from_unimarc, in the same order, without
+        searching the tree once for each.
+        """
+        local_name = self._local_name
+        viaf = None
+        wikipedia_name = None
+        marc21 = defaultdict(list)
+        unimarcs = []
+        titles = []
+        for element in cluster.iterdescendants():
+            if not isinstance(element.tag, basestring):
+                # A comment or processing instruction.
+                continue
+            name = local_name(element)
+            if name == 'datafield':
+                dtype = element.get('dtype')
+                if dtype == 'MARC21':
+                    marc21[element.get('tag')].append(element)
+                elif dtype == 'UNIMARC':
+                    unimarcs.append(element)
+            elif name == 'viafID':
+                if viaf is None:
+                    viaf = element.text
+            elif name == 'source':
+                if (wikipedia_name is None
+                    and local_name(element.getparent()) == 'sources'):
+                    wikipedia_name = self._wikipedia_name_from_source(
+                        element.text
+                    )
+            elif name == 'title':
+                work = element.getparent()
+                if local_name(work) == 'work':
+                    work_list = work.getparent()
+                    if (work_list is not None
+                        and local_name(work_list) == 'titles'):
+                        titles.append(element.text)
+
+        def subfields(tags, code):
+            values = []
+            for tag in tags:
+                for datafield in marc21.get(tag, []):
+                    for subfield in datafield:
+                        if (isinstance(subfield.tag, basestring)
+                            and local_name(subfield) == 'subfield'
+                            and subfield.get('code') == code):
+                            values.append(subfield.text)
+            return values
+
+        return VIAFCluster(
+            viaf=viaf,
+            wikipedia_name=wikipedia_name,
+            sort_names=subfields(('100', '110'), 'a'),
+            name_titles=subfields(('100', '110'), 'c'),
+            alternate_names=subfields(('400', '700'), 'a'),
+            unimarc_names=[
+                self.extract_name_from_unimarc(unimarc)
+                for unimarc in unimarcs
+            ],
+            titles=titles,
+        )
 
 
     def cluster_has_record_for_named_author(
@@ -313,9 +684,11 @@ class VIAFParser(XMLParser):
         Don't short-circuit the xml parsing process -- if found an author name
         match, keep parsing and see what else can find.
 
+        :param cluster: An lxml element or a parsed VIAFCluster.
         :return: a dictionary containing description of xml field
         that matched author name searched for.
         """
+        cluster = self.parse_cluster(cluster)
         match_confidences = {}
         if not contributor_data:
             contributor_data = ContributorData()
@@ -323,7 +696,7 @@ class VIAFParser(XMLParser):
         # If we have a sort name to look for, and it's in this cluster's
         # sort names, great.
         if working_sort_name:
-            for potential_match in self.sort_names_for_cluster(cluster):
+            for potential_match in cluster.sort_names:
                 match_confidence = contributor_name_match_ratio(potential_match, working_sort_name)
                 match_confidences["sort_name"] = match_confidence
                 # fuzzy match filter may not always give a 100% match, so cap arbitrarily at 90% as a "sure match"
@@ -334,7 +707,7 @@ class VIAFParser(XMLParser):
         # If we have a display name to look for, and this cluster's
         # Wikipedia name converts to the display name, great.
         if working_display_name:
-            wikipedia_name = self.extract_wikipedia_name(cluster)
+            wikipedia_name = cluster.wikipedia_name
             if wikipedia_name:
                 contributor_data.wikipedia_name=wikipedia_name
                 display_name = self.wikipedia_name_to_display_name(wikipedia_name)
@@ -346,11 +719,8 @@ class VIAFParser(XMLParser):
 
         # If there are UNIMARC records, and every part of the UNIMARC
         # record matches the sort name or the display name, great.
-        unimarcs = self._xpath(cluster, './/*[local-name()="datafield"][@dtype="UNIMARC"]')
-        candidates = []
-        for unimarc in unimarcs:
-            (possible_given, possible_family,
-             possible_extra, possible_sort_name) = self.extract_name_from_unimarc(unimarc)
+        for (possible_given, possible_family,
+             possible_extra, possible_sort_name) in cluster.unimarc_names:
             if working_sort_name:
                 match_confidence = contributor_name_match_ratio(possible_sort_name, working_sort_name)
                 match_confidences["unimarc"] = match_confidence
@@ -372,7 +742,7 @@ class VIAFParser(XMLParser):
         # of the cluster sort names.
         if working_display_name and not working_sort_name:
             test_sort_name = display_name_to_sort_name(working_display_name)
-            for potential_match in self.sort_names_for_cluster(cluster):
+            for potential_match in cluster.sort_names:
                 match_confidence = contributor_name_match_ratio(potential_match, test_sort_name)
                 match_confidences["guessed_sort_name"] = match_confidence
                 if match_confidence > 90:
@@ -381,7 +751,7 @@ class VIAFParser(XMLParser):
 
         # OK, last last-ditch effort.  See if the alternate name forms (pseudonyms) are it.
         if working_sort_name:
-            for potential_match in self.alternate_name_forms_for_cluster(cluster):
+            for potential_match in cluster.alternate_names:
                 match_confidence = contributor_name_match_ratio(potential_match, working_sort_name)
                 match_confidences["alternate_name"] = match_confidence
                 if match_confidence > 90:
@@ -392,7 +762,7 @@ class VIAFParser(XMLParser):
 
 
     def order_candidates(self, contributor_candidates, working_sort_name,
-                        known_titles=None, strict=False):
+                        known_titles=None, strict=False, weighed=False):
         """
         Accepts a list of tuples, each tuple containing:
         - a ContributorData object filled with VIAF id, display, sort, family,
@@ -408,47 +778,159 @@ class VIAFParser(XMLParser):
         appears in most libraries when searching for working_sort_name is on top.
         Assumes the xml's order is preserved in the contributor_candidates list.
 
+        :param weighed: If this is True, every candidate has already
+            been run through weigh_contributor with these same
+            arguments, and the weights found in match_confidences
+            will be used instead of being calculated again.
+
         :return: the list of tuples, ordered by percent match, in descending order
         (top match first).
         """
         if not contributor_candidates:
             return contributor_candidates
 
+        if not weighed:
+            # Weigh each candidate exactly once, the same way a batch
+            # of lookups would be.
+            [ordered] = self.order_candidate_lists(
+                [(contributor_candidates, working_sort_name, known_titles)],
+                strict=strict
+            )
+            contributor_candidates[:] = ordered
+            return contributor_candidates
+
         # Double-check that the candidate list is ordered by library
         # popularity, as it came from viaf
         contributor_candidates.sort(key=lambda c: c[1].get('library_popularity'))
-        # Grab the most popular candidate.
-        (contributor_data, match_confidences, contributor_titles) = contributor_candidates[0]
 
-        # If the top library popularity candidate is a really bad name
-        # match, then don't penalize the bottom popularity candidates
-        # for being on the bottom.
-        ignore_popularity = False
-        if match_confidences.get("library_popularity") == 1:
-            if ("sort_name" in match_confidences and
-                match_confidences["sort_name"] < 50):
-                # baaad match
-                ignore_popularity = True
+        # higher score for better match, so to have best match first, do desc order.
+        contributor_candidates.sort(key=lambda x: x[1]["total"], reverse=True)
+        return contributor_candidates
 
-            if ("guessed_sort_name" in match_confidences and
-                match_confidences["guessed_sort_name"] < 50):
-                ignore_popularity = True
 
-            if (("sort_name" not in match_confidences) and
-                ("guessed_sort_name" not in match_confidences)):
-                ignore_popularity = True
+    @classmethod
+    def weigh_candidate_lists(cls, lookups, strict=False, memo=None):
+        """Weigh the candidates for many contributors at once.
+
+        This gives the same weights as running every candidate through
+        weigh_contributor, the way order_candidates would. If NumPy is
+        installed, the popularity and name match parts of the weights
+        are calculated for every candidate in one set of array
+        operations; otherwise the candidates are weighed one at a time.
+
+        :param lookups: A list of (contributor_candidates,
+            working_sort_name, known_titles) 3-tuples, one per
+            contributor.
+        :param memo: A dictionary passed along to weigh_titles().
+        :return: A list containing, for each lookup, a sequence of
+            weights in the same order as its candidates -- a NumPy
+            array if NumPy is installed.
+        """
+        if memo is None:
+            memo = {}
+        ignore_popularity = []
+        for candidates, working_sort_name, known_titles in lookups:
+            ignore = False
+            if candidates:
+                most_popular = min(
+                    candidates, key=lambda c: c[1].get('library_popularity')
+                )
+                ignore = cls.should_ignore_popularity(most_popular)
+            ignore_popularity.append(ignore)
+
+        if numpy is None:
+            return [
+                [cls.weigh_contributor(
+                    candidate, working_sort_name=working_sort_name,
+                    known_titles=known_titles, strict=strict,
+                    ignore_popularity=ignore, memo=memo
+                ) for candidate in candidates]
+                for (candidates, working_sort_name, known_titles), ignore
+                in zip(lookups, ignore_popularity)
+            ]
+
+        # Build one row per candidate, across every lookup.
+        rows = []
+        for (candidates, working_sort_name, known_titles), ignore in zip(
+                lookups, ignore_popularity):
+            for contributor, match_confidences, titles in candidates:
+                match_confidences = match_confidences or {}
+                popularity = 0
+                if ("library_popularity" in match_confidences
+                    and not ignore):
+                    popularity = match_confidences["library_popularity"]
+                rows.append(
+                    [popularity]
+                    + [match_confidences.get(key, 0)
+                       for key, weight in cls.NAME_MATCH_WEIGHTS]
+                    + [1 if contributor.display_name else 0,
+                       1 if contributor.viaf else 0]
+                )
+        columns = numpy.array(rows, dtype=float).reshape(
+            len(rows), 3 + len(cls.NAME_MATCH_WEIGHTS)
+        ).T
+
+        # Add the weights up in the same order weigh_contributor does,
+        # so the totals come out exactly the same.
+        totals = numpy.zeros(len(rows))
+        totals += -10 * columns[0]
+        for i, (key, weight) in enumerate(cls.NAME_MATCH_WEIGHTS):
+            totals += weight * columns[i+1]
+        totals += cls.DATA_QUALITY_WEIGHT * columns[-2]
+        totals += cls.DATA_QUALITY_WEIGHT * columns[-1]
+
+        # Title matches and strictness can't be expressed as array
+        # operations, so they're handled one candidate at a time.
+        weights = []
+        row = 0
+        for candidates, working_sort_name, known_titles in lookups:
+            lookup_weights = numpy.zeros(len(candidates))
+            for i, candidate in enumerate(candidates):
+                contributor, match_confidences, titles = candidate
+                total = float(totals[row])
+                row += 1
+                if strict and not match_confidences:
+                    total = 0
+                elif strict and match_confidences.get("sort_name", 90) < 90:
+                    match_confidences["total"] = total = 0
+                else:
+                    if not match_confidences:
+                        match_confidences = {}
+                    match_confidences["total"] = total
+                    cls.weigh_titles(
+                        known_titles, titles, match_confidences, strict,
+                        memo=memo
+                    )
+                    total = match_confidences["total"]
+                lookup_weights[i] = total
+            weights.append(lookup_weights)
+        return weights
 
 
-        # higher score for better match, so to have best match first, do desc order.
-        contributor_candidates.sort(
-            key=lambda x: self.weigh_contributor(
-                x, working_sort_name=working_sort_name,
-                known_titles=known_titles, strict=strict,
-                ignore_popularity=ignore_popularity
-            ),
-            reverse=True
-        )
-        return contributor_candidates
+    @classmethod
+    def order_candidate_lists(cls, lookups, strict=False, memo=None):
+        """Order the candidates for many contributors at once.
+
+        :param lookups: A list of (contributor_candidates,
+            working_sort_name, known_titles) 3-tuples, as for
+            weigh_candidate_lists.
+        :param memo: A dictionary passed along to weigh_titles().
+        :return: A list containing, for each lookup, its candidates
+            in the order order_candidates would put them in.
+        """
+        ordered = []
+        weights = cls.weigh_candidate_lists(lookups, strict=strict, memo=memo)
+        for (candidates, working_sort_name, known_titles), lookup_weights in zip(
+                lookups, weights):
+            # Like order_candidates, break ties in favor of the more
+            # popular candidate.
+            indexes = sorted(
+                range(len(candidates)),
+                key=lambda i: candidates[i][1].get('library_popularity')
+            )
+            indexes.sort(key=lambda i: lookup_weights[i], reverse=True)
+            ordered.append([candidates[i] for i in indexes])
+        return ordered
 
 
     def parse_multiple(
@@ -477,31 +959,102 @@ class VIAFParser(XMLParser):
         if not xml:
             return []
 
-        tree = etree.fromstring(xml, parser=etree.XMLParser(recover=True))
-
         # NOTE:  we can get the total number of clusters that a viaf search could return with:
         # numberOfRecords_tag = self._xpath1(tree, './/*[local-name()="numberOfRecords"]')
         # but it's cleaner to call parse 50 times and quit when it's done than pass around record limits.
+        return list(
+            self.parse_multiple_iter(
+                xml, working_sort_name, working_display_name, page
+            )
+        )
+
+
+    @classmethod
+    def number_of_records(cls, xml):
+        """Find the total number of clusters a VIAF search matched,
+        without parsing the response.
+
+        :return: An integer, or None if the response doesn't say.
+        """
+        if not xml:
+            return None
+        match = cls.number_of_records_tag.search(xml)
+        if not match:
+            return None
+        return int(match.group(1))
+
+
+    def parse_multiple_iter(
+            self, xml, working_sort_name=None, working_display_name=None,
+            page=1, counts=None):
+        """Parse a VIAF response containing multiple clusters, yielding
+        each contributor candidate as soon as its cluster has been
+        read.
+
+        The document is never held in memory as a complete tree:
+        each cluster is discarded once it's been processed.
+
+        :param counts: If a dictionary is passed in, the number of
+            clusters read is kept in it under 'clusters', including
+            clusters that didn't yield a candidate.
+        :yield: The same (contributor_data, match_confidences,
+            contributor_titles) 3-tuples as parse_multiple() returns.
+        """
+        if not xml:
+            return
+        if isinstance(xml, unicode):
+            xml = xml.encode("utf8")
 
         # each contributor_candidate entry contains 3 objects:
         # a contributor_data, a dictionary of search match confidence weights,
         # and a list of metadata objects representing authored titles.
-        contributor_candidates = []
-        for cluster in self._xpath(tree, '//*[local-name()="VIAFCluster"]'):
-            contributor_data, match_confidences, contributor_titles = self.extract_viaf_info(
-                cluster, working_sort_name, working_display_name)
+        found = 0
+        clusters = etree.iterparse(
+            BytesIO(xml), events=('end',), tag='{*}VIAFCluster', recover=True
+        )
+        if counts is not None:
+            counts['clusters'] = 0
+        try:
+            for event, cluster in clusters:
+                if counts is not None:
+                    counts['clusters'] += 1
+                contributor_data, match_confidences, contributor_titles = self.extract_viaf_info(
+                    cluster, working_sort_name, working_display_name)
+
+                # We're done with this cluster and everything that
+                # came before it.
+                self._discard(cluster)
+
+                if not contributor_data:
+                    continue
 
-            if not contributor_data:
-                continue
+                if contributor_data.display_name or contributor_data.viaf:
+                    # assume we asked for viaf feed, sorted with sortKeys=holdingscount
+                    found += 1
+                    match_confidences["library_popularity"] = found + 10 * (page-1)
+                    yield (contributor_data, match_confidences, contributor_titles)
+        except etree.XMLSyntaxError, e:
+            # Even the recovering parser couldn't make sense of the
+            # rest of the document. Go with the clusters we've got.
+            self.log.warn("Could not parse VIAF response: %r", e)
 
-            # assume we asked for viaf feed, sorted with sortKeys=holdingscount
-            match_confidences["library_popularity"] = (len(contributor_candidates)+1) + 10 * (page-1)
-            if contributor_data.display_name or contributor_data.viaf:
-                contributor_candidate = (contributor_data, match_confidences, contributor_titles)
-                contributor_candidates.append(contributor_candidate)
 
-        # We could not find any names or viaf ids for this author.
-        return contributor_candidates
+    @classmethod
+    def _discard(cls, element):
+        """Free up an element that iterparse() is done with, along with
+        everything that came before it in the document.
+
+        Clearing the element isn't enough on its own: the empty
+        element is still attached to its parent, and so are the
+        elements that enclosed earlier clusters (e.g. <record>), so
+        those are removed too, at every level up to the root.
+        """
+        element.clear()
+        while element.getparent() is not None:
+            parent = element.getparent()
+            while element.getprevious() is not None:
+                del parent[0]
+            element = parent
 
 
     def parse(self, xml, working_sort_name=None, working_display_name=None):
@@ -522,22 +1075,27 @@ class VIAFParser(XMLParser):
 
     def extract_wikipedia_name(self, cluster):
         """Extract Wiki name from a single VIAF cluster."""
-        for source in self._xpath(cluster, './/*[local-name()="sources"]/*[local-name()="source"]'):
-            if source.text.startswith("WKP|"):
-                # This could be a Wikipedia page, which is great,or it
-                # could be a Wikidata ID, which we don't want.
-                potential_wikipedia = source.text[4:]
-                if not self.wikidata_id.search(potential_wikipedia):
-                    return potential_wikipedia
+        for source in self._sources(cluster):
+            wikipedia_name = self._wikipedia_name_from_source(source.text)
+            if wikipedia_name:
+                return wikipedia_name
+
+
+    def _wikipedia_name_from_source(self, source):
+        """Turn the text of a VIAF source tag into a Wikipedia name,
+        assuming it's a Wikipedia source.
+        """
+        if source and source.startswith("WKP|"):
+            # This could be a Wikipedia page, which is great,or it
+            # could be a Wikidata ID, which we don't want.
+            potential_wikipedia = source[4:]
+            if not self.wikidata_id.search(potential_wikipedia):
+                return potential_wikipedia
+        return None
 
 
     def sort_names_by_popularity(self, cluster):
-        sort_name_popularity = Counter()
-        for possible_sort_name in self.sort_names_for_cluster(cluster):
-            if possible_sort_name.endswith(","):
-                possible_sort_name = possible_sort_name[:-1]
-            sort_name_popularity[possible_sort_name] += 1
-        return sort_name_popularity
+        return self.parse_cluster(cluster).sort_name_popularity
 
 
     def extract_viaf_info(self, cluster, working_sort_name=None,
@@ -550,6 +1108,7 @@ class VIAFParser(XMLParser):
         - list of titles attributed to the contributor in the cluster.
         or Nones on error.
         """
+        cluster = self.parse_cluster(cluster)
         contributor_data = ContributorData()
         contributor_titles = []
         match_confidences = {}
@@ -562,18 +1121,14 @@ class VIAFParser(XMLParser):
         )
 
         # Get the VIAF ID for this cluster, just in case we don't have one yet.
-        viaf_tag = self._xpath1(cluster, './/*[local-name()="viafID"]')
-        if viaf_tag is None:
-            contributor_data.viaf = None
-        else:
-            contributor_data.viaf = viaf_tag.text
+        contributor_data.viaf = cluster.viaf
 
         # If we don't have a working sort name, find the most popular
         # sort name in this cluster and use it as the sort name.
-        sort_name_popularity = self.sort_names_by_popularity(cluster)
+        sort_name_popularity = cluster.sort_name_popularity
 
         # Does this cluster have a Wikipedia page?
-        contributor_data.wikipedia_name = self.extract_wikipedia_name(cluster)
+        contributor_data.wikipedia_name = cluster.wikipedia_name
         if contributor_data.wikipedia_name:
             contributor_data.display_name = self.wikipedia_name_to_display_name(contributor_data.wikipedia_name)
             working_display_name = contributor_data.display_name
@@ -582,11 +1137,9 @@ class VIAFParser(XMLParser):
             # a band they're in.)
 
         known_name = working_sort_name or working_display_name
-        unimarcs = self._xpath(cluster, './/*[local-name()="datafield"][@dtype="UNIMARC"]')
         candidates = []
-        for unimarc in unimarcs:
-            (possible_given, possible_family,
-             possible_extra, possible_sort_name) = self.extract_name_from_unimarc(unimarc)
+        for (possible_given, possible_family,
+             possible_extra, possible_sort_name) in cluster.unimarc_names:
             # Some part of this name must also show up in the original
             # name for it to even be considered. Otherwise it's a
             # better bet to try to munge the original name.
@@ -630,9 +1183,7 @@ class VIAFParser(XMLParser):
 
 
         # Now go through the title elements, and make a list.
-        titles = self._xpath(cluster, './/*[local-name()="titles"]/*[local-name()="work"]/*[local-name()="title"]')
-        for title in titles:
-            contributor_titles.append(title.text)
+        contributor_titles.extend(cluster.titles)
 
         return contributor_data, match_confidences, contributor_titles
 
@@ -716,9 +1267,9 @@ class VIAFParser(XMLParser):
                 ('b', 'given'),
                 ('c', 'extra'),
                 ):
-            value = self._xpath1(unimarc, 'ns2:subfield[@code="%s"]' % code)
-            if value is not None and value.text:
-                value = value.text
+            values = self._unimarc_subfield(unimarc, code=code)
+            if values and values[0].text:
+                value = values[0].text
                 value = self.remove_commas_from(value)
                 sort_name_in_progress.append(value)
                 data[key] = value
@@ -734,11 +1285,25 @@ class VIAFClient(object):
 
     SUBDIR = "viaf"
 
+    # from OCLC tech support:
+    # VIAF's SRU endpoint can only return a maximum number of 10 records
+    # when the recordSchema is http://viaf.org/VIAFCluster
+    MAXIMUM_RECORDS = 10 # viaf maximum that's not ignored
+
+    # limit ourselves to reading the first 500 viaf clusters, on the
+    # assumption that search match quality is unlikely to be usable after that.
+    MAXIMUM_PAGES = 50
+
+    # A candidate must be weighted at least this highly to be
+    # considered a match.
+    MINIMUM_MATCH_WEIGHT = 70
+
     MEDIA_TYPE = Representation.TEXT_XML_MEDIA_TYPE
     REPRESENTATION_MAX_AGE = 60*60*24*30*6    # 6 months
 
     def __init__(self, _db):
         self._db = _db
+        configure_from_database(_db)
         self.parser = VIAFParser()
         self.log = logging.getLogger("VIAF Client")
 
@@ -798,7 +1363,8 @@ class VIAFClient(object):
                     )
             selected_candidate.apply(contributor)
 
-    def select_best_match(self, candidates, working_sort_name, known_titles=None):
+    def select_best_match(self, candidates, working_sort_name, known_titles=None,
+                          weighed=False):
         """Gets the best VIAF match from a series of potential matches
 
         Return a tuple containing the selected_candidate (a ContributorData
@@ -806,13 +1372,15 @@ class VIAFClient(object):
         contributor.
 
         :param known_titles: A list of titles we know this author wrote.
+        :param weighed: Have the candidates already been weighed? See
+            VIAFParser.order_candidates.
         """
 
         # Sort for the best match and select the first.
         candidates = self.parser.order_candidates(
             working_sort_name=working_sort_name,
             contributor_candidates=candidates,
-            known_titles=known_titles
+            known_titles=known_titles, weighed=weighed
         )
         if not candidates:
             return None
@@ -820,39 +1388,46 @@ class VIAFClient(object):
         (selected_candidate, match_confidences, contributor_titles) = candidates[0]
 
         if (not selected_candidate or "total" not in match_confidences or
-            match_confidences["total"] < 70):
+            match_confidences["total"] < self.MINIMUM_MATCH_WEIGHT):
             # The best match is dubious. Best to avoid this.
             return None
 
         return selected_candidate, match_confidences, contributor_titles
 
 
-    def lookup_name_title(self, viaf, do_get=None):
+    def cluster_for_viaf(self, viaf, do_get=None):
+        """Find the parsed VIAFCluster for a VIAF ID, fetching and parsing
+        the cluster only if it's not in the VIAFClusterStore.
+        """
+        store = VIAFClusterStore(self._db)
+        cluster = store.get(viaf)
+        if cluster:
+            return cluster
+
         url = self.LOOKUP_URL % dict(viaf=viaf)
         r, cached = Representation.get(
-            self._db, url, do_get=do_get, max_age=self.REPRESENTATION_MAX_AGE
+            self._db, url, do_get=do_get or shared_pool().do_get,
+            max_age=self.REPRESENTATION_MAX_AGE
         )
 
         xml = r.content
-        cluster = etree.fromstring(xml, parser=etree.XMLParser(recover=True))
+        tree = etree.fromstring(xml, parser=etree.XMLParser(recover=True))
+        cluster = self.parser.parse_cluster(tree)
+        store.set(cluster)
+        return cluster
 
-        titles = []
-        for potential_title in self.parser.name_titles_for_cluster(cluster):
-            titles.append(potential_title)
-        return titles
 
+    def lookup_name_title(self, viaf, do_get=None):
+        return list(self.cluster_for_viaf(viaf, do_get).name_titles)
 
 
     def lookup_by_viaf(self, viaf, working_sort_name=None,
                        working_display_name=None, do_get=None):
-        url = self.LOOKUP_URL % dict(viaf=viaf)
-        r, cached = Representation.get(
-            self._db, url, do_get=do_get, max_age=self.REPRESENTATION_MAX_AGE
+        cluster = self.cluster_for_viaf(viaf, do_get)
+        return self.parser.extract_viaf_info(
+            cluster, working_sort_name, working_display_name
         )
 
-        xml = r.content
-        return self.parser.parse(xml, working_sort_name, working_display_name)
-
 
     def lookup_by_name(self, sort_name, display_name=None, do_get=None,
                        known_titles=None):
@@ -861,6 +1436,14 @@ class VIAFClient(object):
         author name.  Selects the cluster we deem the best match for
         the author we mean.
 
+        Candidates are weighed as each page of search results comes
+        in, and the search stops as soon as a candidate is found that
+        no less popular cluster could beat, or a page comes back less
+        than full. As soon as a page is known to be full, the next
+        page is fetched in the background while this one is parsed;
+        if this page turns up a certain match, that response is
+        never used.
+
         :param sort_name: Author name in Last, First format.
         :param display_name: Author name in First Last format.
         :param do_get: Ask Representation to use Http GET?
@@ -868,49 +1451,154 @@ class VIAFClient(object):
         :return: (selected_candidate, match_confidences, contributor_titles) for selected ContributorData.
         """
         author_name = sort_name or display_name
-        # from OCLC tech support:
-        # VIAF's SRU endpoint can only return a maximum number of 10 records
-        # when the recordSchema is http://viaf.org/VIAFCluster
-        maximum_records = 10 # viaf maximum that's not ignored
-        page = 1
-        contributor_candidates = []
+        maximum_records = self.MAXIMUM_RECORDS
+        scope = 'local.personalNames'
+        if is_corporate_name(author_name):
+            scope = 'local.corporateNames'
 
-        # limit ourselves to reading the first 500 viaf clusters, on the
-        # assumption that search match quality is unlikely to be usable after that.
-        for page in range (1, 51):
+        def search_url(page):
             start_record = 1 + maximum_records * (page-1)
-            scope = 'local.personalNames'
-            if is_corporate_name(author_name):
-                scope = 'local.corporateNames'
-
-            url = self.SEARCH_URL.format(
+            return self.SEARCH_URL.format(
                 scope=scope, author_name=author_name.encode("utf8"),
                 maximum_records=maximum_records, start_record=start_record
             )
+
+        do_get = do_get or shared_pool().do_get
+        contributor_candidates = []
+        ignore_popularity = False
+        best_weight = None
+        page_get = do_get
+        fresh_urls = None
+        memo = {}
+        for page in range(1, self.MAXIMUM_PAGES + 1):
             representation, cached = Representation.get(
-                self._db, url, do_get=do_get, max_age=self.REPRESENTATION_MAX_AGE
+                self._db, search_url(page), do_get=page_get,
+                max_age=self.REPRESENTATION_MAX_AGE
             )
             xml = representation.content
 
-            candidates = self.parser.parse_multiple(xml, sort_name, display_name, page)
-            if not any(candidates):
+            # If VIAF says this page is full and there's another one
+            # after it, start fetching the next page now, so it
+            # downloads while this one is parsed -- unless what we
+            # already have is certain to end the search after this
+            # page.
+            page_get = do_get
+            total = self.parser.number_of_records(xml)
+            if (total is not None and total > maximum_records * page
+                and page < self.MAXIMUM_PAGES
+                and not self.is_certain(
+                    best_weight, 1 + maximum_records * page, known_titles,
+                    ignore_popularity)):
+                # Find out which pages are already cached, the first
+                # time that question comes up.
+                if fresh_urls is None:
+                    fresh_urls = self.fresh_urls(
+                        [search_url(x) for x in
+                         range(page + 1, self.MAXIMUM_PAGES + 1)]
+                    )
+                if search_url(page + 1) not in fresh_urls:
+                    page_get = self.prefetch(search_url(page + 1), do_get)
+
+            # Weigh each candidate as soon as its cluster has been
+            # parsed.
+            counts = {}
+            for candidate in self.parser.parse_multiple_iter(
+                    xml, sort_name, display_name, page, counts=counts):
+                if page == 1 and not contributor_candidates:
+                    ignore_popularity = self.parser.should_ignore_popularity(
+                        candidate
+                    )
+                contributor_candidates.append(candidate)
+                weight = self.parser.weigh_contributor(
+                    candidate, working_sort_name=author_name,
+                    known_titles=known_titles,
+                    ignore_popularity=ignore_popularity, memo=memo
+                )
+                if best_weight is None or weight > best_weight:
+                    best_weight = weight
+
+            # Clusters that don't yield a candidate still count
+            # towards filling up the page.
+            clusters = counts.get('clusters', 0)
+            if not clusters:
                 # Delete the representation so it's not cached.
                 self._db.query(Representation).filter(
                     Representation.id==representation.id
                 ).delete()
+            if clusters < maximum_records or page == self.MAXIMUM_PAGES:
                 # We ran out of clusters, so we can relax and move on to
                 # ordering the returned results
                 break
 
-            contributor_candidates.extend(candidates)
-            page += 1
+            # The most popular cluster on the next page can only be
+            # this popular.
+            if self.is_certain(best_weight, 1 + maximum_records * page,
+                               known_titles, ignore_popularity):
+                # Nothing we find from here on can beat what we have.
+                break
 
+        # Every candidate was weighed as it came in; there's no need to
+        # do it again.
         best_match = self.select_best_match(candidates=contributor_candidates,
-            working_sort_name=author_name, known_titles=known_titles)
+            working_sort_name=author_name, known_titles=known_titles,
+            weighed=True)
 
         return best_match
 
 
+    def is_certain(self, best_weight, next_popularity, known_titles=None,
+                   ignore_popularity=False):
+        """Is the best match found so far good enough, and far enough
+        ahead, that no cluster with the given library popularity (or
+        any less popular cluster) could replace it?
+        """
+        if best_weight is None or best_weight < self.MINIMUM_MATCH_WEIGHT:
+            return False
+        return best_weight > self.parser.best_possible_weight(
+            next_popularity, known_titles, ignore_popularity
+        )
+
+    def fresh_urls(self, urls):
+        """Find out which of the given URLs have Representations in the
+        database that are recent enough to use, with a single query.
+
+        :return: A set of URLs.
+        """
+        if not urls:
+            return set()
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=self.REPRESENTATION_MAX_AGE
+        )
+        qu = self._db.query(Representation.url).filter(
+            Representation.url.in_(urls)
+        ).filter(
+            Representation.content != None
+        ).filter(
+            Representation.fetched_at > cutoff
+        )
+        return set(url for [url] in qu)
+
+    def prefetch(self, url, do_get):
+        """Start fetching a URL in the background.
+
+        :return: A function that can be passed into Representation.get
+            as `do_get`, to pick up the response once it's needed.
+        """
+        def fetch(url):
+            try:
+                return do_get(url, {}), None
+            except Exception, e:
+                return None, e
+        wait = run_in_background(fetch, [url], 1)
+
+        def prefetched_get(*args, **kwargs):
+            [(response, exception)] = wait()
+            if exception:
+                raise exception
+            return response
+        return prefetched_get
+
+
 class MockVIAFClient(VIAFClient):
 
     def __init__(self, _db):